@@ -0,0 +1,44 @@
+# Downsampling for the weight chart.
+#
+# Largest-Triangle-Three-Buckets keeps the first and last point and, from each
+# bucket in between, the point that forms the largest triangle with the point
+# chosen before it and the average of the next bucket. Peaks and dips survive,
+# so a multi-year history still looks like itself in a few hundred points.
+
+
+def lttb(points, threshold):
+    """
+    Downsample a list of (x, y) pairs, sorted by x, to at most `threshold`
+    points. Returns the list unchanged when it's already small enough.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (count - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket (the last point for the final bucket)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, count)
+        next_bucket = points[next_start:next_end] or [points[-1]]
+        avg_x = sum(x for x, _ in next_bucket) / len(next_bucket)
+        avg_y = sum(y for _, y in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        best_area = -1
+        best = None
+        for j in range(int(i * bucket_size) + 1, int((i + 1) * bucket_size) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
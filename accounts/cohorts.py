@@ -0,0 +1,172 @@
+import warnings
+from datetime import date
+
+import numpy as np
+from django.core.cache import cache
+
+from .models import User, WeightLog
+
+# Cohort progress analytics.
+#
+# A cohort's weight logs are read in one query (the cohort is a subquery, not
+# an id list) into flat NumPy arrays sorted by (user, date). Every member's
+# series is aligned on their first log, and readings are averaged per member
+# per week into a members x weeks matrix with NaN for weeks without a log.
+# The curves, percentile bands and logging retention are then column-wise
+# reductions of that matrix, with no per-member Python loop.
+#
+# Results are cached for COHORT_CACHE_TIMEOUT; analytics may lag new logs by
+# up to that long.
+
+COHORT_KINDS = ('all', 'trainer', 'plan', 'signup')
+COHORT_CACHE_TIMEOUT = 60 * 60
+DEFAULT_WEEKS = 26
+MAX_WEEKS = 104
+PERCENTILES = (10, 25, 50, 75, 90)
+FETCH_CHUNK_SIZE = 20000
+
+
+class CohortError(ValueError):
+    pass
+
+
+def cohort_members(kind, value=''):
+    """Members in the cohort, as a queryset usable as a subquery"""
+    members = User.objects.filter(role='Member')
+    if kind == 'all':
+        return members
+    if kind == 'trainer':
+        if not str(value).isdigit():
+            raise CohortError('Choose a trainer.')
+        return members.filter(member_private_classes__trainer_id=value).distinct()
+    if kind == 'plan':
+        if not str(value).isdigit():
+            raise CohortError('Choose a membership plan.')
+        return members.filter(membersubscription__plan_id=value).distinct()
+    if kind == 'signup':
+        try:
+            year, month = (int(part) for part in str(value).split('-'))
+            date(year, month, 1)
+        except ValueError:
+            raise CohortError('Signup month must be YYYY-MM.')
+        return members.filter(created_at__year=year, created_at__month=month)
+    raise CohortError(f'Unknown cohort type: {kind}')
+
+
+def load_series(members):
+    """(user id, day ordinal, weight) arrays for the members' logs, sorted by user then date"""
+    rows = WeightLog.objects.filter(
+        user__in=members.values('id')
+    ).order_by('user_id', 'date').values_list('user_id', 'date', 'weight').iterator(chunk_size=FETCH_CHUNK_SIZE)
+
+    user_chunks, day_chunks, weight_chunks = [], [], []
+    buffer = []
+
+    def flush():
+        if buffer:
+            user_ids, days, weights = zip(*buffer)
+            user_chunks.append(np.fromiter(user_ids, dtype=np.int64, count=len(buffer)))
+            day_chunks.append(np.fromiter((d.toordinal() for d in days), dtype=np.int64, count=len(buffer)))
+            weight_chunks.append(np.fromiter(weights, dtype=np.float64, count=len(buffer)))
+            buffer.clear()
+
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= FETCH_CHUNK_SIZE:
+            flush()
+    flush()
+
+    if not user_chunks:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float64)
+    return np.concatenate(user_chunks), np.concatenate(day_chunks), np.concatenate(weight_chunks)
+
+
+def _to_list(values, digits=2):
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def compute_cohort_curves(user_ids, days, weights, weeks=DEFAULT_WEEKS, today=None):
+    """
+    Weekly curves for a cohort from the arrays returned by load_series().
+
+    change: weight relative to each member's first log, averaged per week
+    active: share of eligible members who logged in that week
+    retained: share of eligible members still logging in that week or later
+    A member is eligible for week w once their first log is w weeks old.
+    """
+    today = today or date.today()
+    week_range = list(range(weeks + 1))
+    if user_ids.size == 0:
+        empty = [None] * len(week_range)
+        return {
+            'members': 0,
+            'weeks': week_range,
+            'mean': empty,
+            'percentiles': {f'p{p}': empty for p in PERCENTILES},
+            'counts': [0] * len(week_range),
+            'active': empty,
+            'retained': empty,
+        }
+
+    # Member boundaries in the (user, date) sorted arrays
+    _, starts, counts = np.unique(user_ids, return_index=True, return_counts=True)
+    member_count = starts.size
+    member_index = np.repeat(np.arange(member_count), counts)
+
+    first_day = days[starts]
+    offset_weeks = (days - first_day[member_index]) // 7
+    change = weights - weights[starts][member_index]
+
+    # Mean change per (member, week) within the horizon
+    in_range = offset_weeks <= weeks
+    cells = member_index[in_range] * (weeks + 1) + offset_weeks[in_range]
+    size = member_count * (weeks + 1)
+    totals = np.bincount(cells, weights=change[in_range], minlength=size)
+    hits = np.bincount(cells, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matrix = (totals / hits).reshape(member_count, weeks + 1)
+    logged = hits.reshape(member_count, weeks + 1) > 0
+
+    # Columns nobody reached are all-NaN; silence the empty-slice warnings
+    counts_per_week = logged.sum(axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        mean = np.nanmean(matrix, axis=0)
+        bands = np.nanpercentile(matrix, PERCENTILES, axis=0)
+
+    last_week = np.maximum.reduceat(offset_weeks, starts)
+    tenure_weeks = (today.toordinal() - first_day) // 7
+    week_numbers = np.arange(weeks + 1)
+    eligible = tenure_weeks[:, None] >= week_numbers[None, :]
+    eligible_counts = eligible.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        active = (logged & eligible).sum(axis=0) / eligible_counts
+        retained = ((last_week[:, None] >= week_numbers[None, :]) & eligible).sum(axis=0) / eligible_counts
+
+    return {
+        'members': int(member_count),
+        'weeks': week_range,
+        'mean': _to_list(mean),
+        'percentiles': {f'p{p}': _to_list(band) for p, band in zip(PERCENTILES, bands)},
+        'counts': [int(c) for c in counts_per_week],
+        'active': _to_list(active, 3),
+        'retained': _to_list(retained, 3),
+    }
+
+
+def cohort_analytics(kind, value='', weeks=DEFAULT_WEEKS):
+    """Cached curves for a cohort; raises CohortError for an invalid cohort"""
+    weeks = max(1, min(int(weeks), MAX_WEEKS))
+    today = date.today()
+    key = f'cohort_analytics:{kind}:{value}:{weeks}:{today.isoformat()}'
+    result = cache.get(key)
+    if result is None:
+        members = cohort_members(kind, value)
+        result = {
+            'cohort': {'kind': kind, 'value': value},
+            'cohort_size': members.count(),
+            **compute_cohort_curves(*load_series(members), weeks=weeks, today=today),
+        }
+        cache.set(key, result, COHORT_CACHE_TIMEOUT)
+    return result
@@ -0,0 +1,162 @@
+import datetime
+import json
+
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import JsonResponse
+
+# Server-side processing for the admin DataTables lists.
+#
+# The browser only ever receives one page of rows. Sorting is limited to the
+# columns listed in `order_columns` (all backed by an index), searching runs
+# as icontains lookups in the database, and paging forward uses a keyset
+# cursor so deep pages don't pay for a growing OFFSET.
+
+MAX_PAGE_LENGTH = 100
+CURSOR_SALT = 'accounts.datatables.cursor'
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keep full microsecond precision so keyset comparisons stay exact"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorSerializer:
+    """JSON serializer for signed cursors"""
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'), cls=CursorEncoder).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(data.decode('latin-1'))
+
+
+def _int_param(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _requested_ordering(params, order_columns, default_ordering):
+    """Map DataTables' order[0][column] / order[0][dir] onto model fields"""
+    column = _int_param(params, 'order[0][column]', None)
+    fields = order_columns.get(column)
+    if not fields:
+        ordering = list(default_ordering)
+    else:
+        prefix = '-' if params.get('order[0][dir]') == 'desc' else ''
+        ordering = [prefix + field for field in fields]
+
+    # Always finish on the primary key so the ordering (and the cursor) is total
+    if ordering[-1].lstrip('-') != 'id':
+        ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+    return ordering
+
+
+def _keyset_filter(ordering, values):
+    """
+    Rows strictly after `values` in `ordering`, as a lexicographic comparison:
+    (a > x) OR (a = x AND b > y) OR ...
+    """
+    condition = Q()
+    equal_so_far = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal_so_far & Q(**{f'{name}__{lookup}': value})
+        equal_so_far &= Q(**{name: value})
+    return condition
+
+
+def _field_value(obj, field):
+    value = obj
+    for part in field.split('__'):
+        value = getattr(value, part)
+    return value
+
+
+def filter_queryset(params, queryset, filters=None, search_fields=()):
+    """
+    Apply the filter dropdowns and the search box from `params`.
+    Returns (queryset, filtered); shared by the list endpoints and the exports.
+    """
+    filtered = False
+
+    for name, apply_filter in (filters or {}).items():
+        value = params.get(name, '').strip()
+        if value:
+            queryset = apply_filter(queryset, value)
+            filtered = True
+
+    search = params.get('search[value]', '').strip()
+    if search and search_fields:
+        query = Q()
+        for field in search_fields:
+            query |= Q(**{f'{field}__icontains': search})
+        queryset = queryset.filter(query)
+        filtered = True
+
+    return queryset, filtered
+
+
+def datatables_response(request, queryset, *, order_columns, default_ordering,
+                        search_fields, render_row, filters=None):
+    """
+    Answer a DataTables server-side request for `queryset`.
+
+    order_columns: {column index: [field, ...]} for the sortable columns
+    default_ordering: ordering used when the client doesn't ask for one
+    search_fields: fields matched with icontains against the search box
+    render_row: callable(obj) -> list of cell HTML strings
+    filters: {query param: callable(queryset, value)} for the filter dropdowns
+    """
+    params = request.GET
+    draw = _int_param(params, 'draw', 0)
+    start = max(_int_param(params, 'start', 0), 0)
+    length = _int_param(params, 'length', 10)
+    if length <= 0 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+
+    records_total = queryset.count()
+    queryset, filtered = filter_queryset(params, queryset, filters, search_fields)
+    records_filtered = queryset.count() if filtered else records_total
+
+    ordering = _requested_ordering(params, order_columns, default_ordering)
+    queryset = queryset.order_by(*ordering)
+
+    # Continue from the previous page's last row when the client hands back
+    # the cursor for the same ordering; otherwise fall back to an offset.
+    page = None
+    cursor = params.get('cursor')
+    if cursor:
+        try:
+            cursor_data = signing.loads(cursor, salt=CURSOR_SALT, serializer=CursorSerializer)
+        except signing.BadSignature:
+            cursor_data = None
+        if cursor_data and cursor_data.get('ordering') == ordering:
+            page = list(queryset.filter(_keyset_filter(ordering, cursor_data['values']))[:length])
+    if page is None:
+        page = list(queryset[start:start + length])
+
+    next_cursor = None
+    if page:
+        values = [_field_value(page[-1], field.lstrip('-')) for field in ordering]
+        next_cursor = signing.dumps(
+            {'ordering': ordering, 'values': values},
+            salt=CURSOR_SALT,
+            serializer=CursorSerializer,
+        )
+
+    return JsonResponse({
+        'draw': draw,
+        'recordsTotal': records_total,
+        'recordsFiltered': records_filtered,
+        'data': [render_row(obj) for obj in page],
+        'cursor': next_cursor,
+    })
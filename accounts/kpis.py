@@ -0,0 +1,64 @@
+from datetime import date, datetime
+
+from django.core.cache import cache
+from django.db.models import Count, Sum, Q
+
+from .models import User
+from membership.models import MemberSubscription, Payment
+from classes.models import PrivateClass, ClassOccurrence
+
+# Shared KPI numbers for admin_dashboard, admin_reports and admin_reports_pdf.
+# Each table is read once with conditional aggregation and the result is kept
+# in the cache until one of the underlying models changes (see signals.py).
+KPI_CACHE_KEY = 'admin_kpis'
+KPI_CACHE_TIMEOUT = 60 * 15
+
+
+def compute_admin_kpis(today=None):
+    """Run one aggregate query per table and return the KPI numbers"""
+    today = today or date.today()
+
+    users = User.objects.aggregate(
+        total_users=Count('id'),
+        active_members=Count('id', filter=Q(role='Member', is_active=True)),
+        total_trainers=Count('id', filter=Q(role='Trainer', is_active=True)),
+    )
+
+    subscriptions = MemberSubscription.objects.aggregate(
+        active_subscriptions=Count('id', filter=Q(is_active=True)),
+        expired_subscriptions=Count('id', filter=Q(is_active=False)),
+    )
+
+    classes = PrivateClass.objects.aggregate(total_classes=Count('id'))
+    # Occurrences only exist for active classes, one row per session day
+    classes['active_sessions_today'] = ClassOccurrence.objects.filter(date=today).count()
+
+    payments = Payment.objects.aggregate(
+        total_revenue=Sum('amount', filter=Q(payment_status='Completed')),
+        pending_payments=Count('id', filter=Q(payment_status='Pending')),
+        failed_payments=Count('id', filter=Q(payment_status='Failed')),
+    )
+    payments['total_revenue'] = payments['total_revenue'] or 0
+
+    return {
+        'date': today,
+        'generated_at': datetime.now(),
+        **users,
+        **subscriptions,
+        **classes,
+        **payments,
+    }
+
+
+def get_admin_kpis():
+    """Return cached KPI numbers, recomputing when stale or from a previous day"""
+    today = date.today()
+    kpis = cache.get(KPI_CACHE_KEY)
+    if kpis is None or kpis.get('date') != today:
+        kpis = compute_admin_kpis(today)
+        cache.set(KPI_CACHE_KEY, kpis, KPI_CACHE_TIMEOUT)
+    return kpis
+
+
+def invalidate_admin_kpis():
+    cache.delete(KPI_CACHE_KEY)
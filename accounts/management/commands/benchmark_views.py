@@ -0,0 +1,183 @@
+import json
+import platform
+import time
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import synthetic
+from accounts.models import User
+from membership.models import MemberSubscription, Payment
+from classes.models import PrivateClass
+from trainwise.querybudget import QueryStats, install, recording
+
+# (name, who, url name, query string) for every view timed. `who` picks which
+# user the request is made as; the trainer-specific URLs get the trainer's id.
+VIEWS = [
+    ('user-dashboard', 'member', 'user-dashboard', {}),
+    ('my-memberships', 'member', 'my-memberships', {}),
+    ('my-payments', 'member', 'my-payments', {}),
+    ('my-booked-sessions', 'member', 'my-booked-sessions', {}),
+    ('track-progress', 'member', 'track-progress', {}),
+    ('weight-chart-data', 'member', 'weight-chart-data', {'days': 365}),
+    ('book-private-class', 'member', 'book-private-class', {}),
+    ('trainer-free-slots', 'member', 'trainer-free-slots', {'date': 'today'}),
+    ('trainer-dashboard', 'trainer', 'trainer-dashboard', {}),
+    ('trainer-private-classes', 'trainer', 'trainer-private-classes', {}),
+    ('admin-dashboard', 'admin', 'admin-dashboard', {}),
+    ('admin-members-data', 'admin', 'admin-members-data', {'draw': 1, 'start': 0, 'length': 25}),
+    ('admin-payments', 'admin', 'admin-payments', {}),
+    ('admin-payments-data', 'admin', 'admin-payments-data', {'draw': 1, 'start': 0, 'length': 25}),
+    ('admin-private-classes-data', 'admin', 'admin-private-classes-data', {'draw': 1, 'start': 0, 'length': 25}),
+    ('admin-reports', 'admin', 'admin-reports', {}),
+    ('admin-reports-timeseries', 'admin', 'admin-reports-timeseries', {}),
+    ('admin-reports-coverage', 'admin', 'admin-reports-coverage', {}),
+    ('cohort-analytics-data', 'admin', 'cohort-analytics-data', {}),
+]
+TRAINER_URLS = {'trainer-free-slots'}
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _pick_user(username, role, synthetic_username):
+    users = User.objects.filter(role=role)
+    if username:
+        user = users.filter(username=username).first()
+        if user is None:
+            raise CommandError(f"No {role.lower()} named '{username}'.")
+        return user
+    return (
+        users.filter(username=synthetic_username).first()
+        or users.filter(username__startswith=synthetic.USERNAME_PREFIX).order_by('pk').first()
+        or users.order_by('pk').first()
+    )
+
+
+class Command(BaseCommand):
+    help = "Time key views with the test client and write latency percentiles and query counts to JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*', help="Only benchmark these views (see VIEWS for names)")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests per view")
+        parser.add_argument('--warmup', type=int, default=2, help="Untimed requests per view first")
+        parser.add_argument('--cold', action='store_true', help="Clear the cache before every request")
+        parser.add_argument('--admin', help="Username to make admin requests as")
+        parser.add_argument('--trainer', help="Username to make trainer requests as")
+        parser.add_argument('--member', help="Username to make member requests as")
+        parser.add_argument('--output', help="JSON file to write (default: benchmark-<timestamp>.json)")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['warmup'] < 0:
+            raise CommandError("--repeat must be at least 1 and --warmup at least 0.")
+        views = VIEWS
+        if options['views']:
+            known = {name for name, *_ in VIEWS}
+            unknown = set(options['views']) - known
+            if unknown:
+                raise CommandError(f"Unknown view(s): {', '.join(sorted(unknown))}. Known: {', '.join(sorted(known))}")
+            views = [view for view in VIEWS if view[0] in options['views']]
+
+        users = {
+            'admin': _pick_user(options['admin'], 'Admin', synthetic.ADMIN_USERNAME),
+            'trainer': _pick_user(options['trainer'], 'Trainer', f'{synthetic.USERNAME_PREFIX}trainer_000000'),
+            # Same seed, same users: runs against a generated dataset are comparable
+            'member': _pick_user(options['member'], 'Member', f'{synthetic.USERNAME_PREFIX}member_000000'),
+        }
+        missing = [who for who, user in users.items() if user is None]
+        if missing:
+            raise CommandError(
+                f"No user to benchmark as: {', '.join(missing)}. Run generate_synthetic_data first."
+            )
+
+        install()
+        clients = {}
+        for who, user in users.items():
+            clients[who] = Client()
+            clients[who].force_login(user)
+
+        today = timezone.localdate()
+        results = []
+        # The test client's host isn't in ALLOWED_HOSTS outside the test runner
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, who, url_name, params in views:
+                kwargs = {'trainer_id': users['trainer'].pk} if url_name in TRAINER_URLS else {}
+                params = {key: today.isoformat() if value == 'today' else value for key, value in params.items()}
+                result = self.run_view(clients[who], reverse(url_name, kwargs=kwargs), params, options)
+                result.update(name=name, user=who)
+                results.append(result)
+                self.stdout.write(
+                    f"{name:28} {result['status']}  p50 {result['latency_ms']['p50']:8.1f} ms  "
+                    f"p95 {result['latency_ms']['p95']:8.1f} ms  {result['queries']['median']:5.0f} queries"
+                )
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'debug': settings.DEBUG,
+                'cold_cache': options['cold'],
+                'repeat': options['repeat'],
+                'warmup': options['warmup'],
+            },
+            'dataset': {
+                'members': User.objects.filter(role='Member').count(),
+                'trainers': User.objects.filter(role='Trainer').count(),
+                'subscriptions': MemberSubscription.objects.count(),
+                'private_classes': PrivateClass.objects.count(),
+                'payments': Payment.objects.count(),
+            },
+            'users': {who: user.username for who, user in users.items()},
+            'views': results,
+        }
+        path = options['output'] or f"benchmark-{timezone.localtime():%Y%m%d-%H%M%S}.json"
+        with open(path, 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} result(s) to {path}."))
+
+    def run_view(self, client, url, params, options):
+        for _ in range(options['warmup']):
+            if options['cold']:
+                cache.clear()
+            client.get(url, params)
+
+        latencies, queries, sql_ms, render_ms = [], [], [], []
+        statuses = set()
+        for _ in range(options['repeat']):
+            if options['cold']:
+                cache.clear()
+            start = time.perf_counter()
+            with recording(QueryStats()) as stats:
+                response = client.get(url, params)
+                # Streaming responses do their work while being consumed
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(stats.queries)
+            sql_ms.append(stats.sql_time * 1000)
+            render_ms.append(stats.render_time * 1000)
+            statuses.add(response.status_code)
+
+        latencies = np.array(latencies)
+        return {
+            'url': url,
+            'params': params,
+            'status': ','.join(str(status) for status in sorted(statuses)),
+            'latency_ms': {
+                **{f'p{p}': round(float(np.percentile(latencies, p)), 2) for p in PERCENTILES},
+                'mean': round(float(latencies.mean()), 2),
+                'min': round(float(latencies.min()), 2),
+                'max': round(float(latencies.max()), 2),
+            },
+            'queries': {'median': float(np.median(queries)), 'max': max(queries)},
+            'sql_ms': {'median': round(float(np.median(sql_ms)), 2), 'max': round(max(sql_ms), 2)},
+            'render_ms': {'median': round(float(np.median(render_ms)), 2)},
+        }
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import synthetic
+
+
+class Command(BaseCommand):
+    help = "Load a reproducible synthetic dataset (members, trainers, subscriptions, classes, payments, weight logs)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=1000, help="Number of members")
+        parser.add_argument('--trainers', type=int, default=20, help="Number of trainers")
+        parser.add_argument('--plans', type=int, default=4, help="Number of membership plans")
+        parser.add_argument('--years', type=float, default=3, help="Years of history, ending today")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk insert")
+        parser.add_argument('--password', default='synthetic', help="Password for every synthetic user")
+        parser.add_argument('--flush', action='store_true', help="Delete a previous synthetic dataset first")
+        parser.add_argument('--flush-only', action='store_true', help="Delete a previous synthetic dataset and stop")
+
+    def handle(self, *args, **options):
+        for name in ('members', 'trainers', 'plans', 'batch_size'):
+            if options[name] < (0 if name in ('members', 'trainers') else 1):
+                raise CommandError(f"--{name.replace('_', '-')} is out of range.")
+        if options['years'] <= 0:
+            raise CommandError("--years must be positive.")
+
+        if options['flush'] or options['flush_only']:
+            deleted = synthetic.flush()
+            self.stdout.write(f"Deleted {deleted} synthetic row(s).")
+            if options['flush_only']:
+                return
+        elif synthetic.exists():
+            raise CommandError("Synthetic data already exists; pass --flush to replace it.")
+
+        generator = synthetic.Generator(
+            seed=options['seed'],
+            years=options['years'],
+            batch_size=options['batch_size'],
+            password=options['password'],
+            log=self.stdout.write,
+        )
+        counts = generator.generate(options['members'], options['trainers'], options['plans'])
+
+        for label, count in counts.items():
+            self.stdout.write(f"  {label}: {count}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated synthetic data (seed {options['seed']}); log in as {synthetic.ADMIN_USERNAME} "
+            f"with password '{options['password']}'."
+        ))
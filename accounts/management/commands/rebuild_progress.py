@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from accounts import progress
+
+
+class Command(BaseCommand):
+    help = "Rebuild ProgressSummary rows from WeightLog history (all users with logs, or the given usernames)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only rebuild these users")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(weight_logs__isnull=False).distinct()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        count = 0
+        for user in users.iterator():
+            progress.rebuild(user)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt progress for {count} user(s)."))
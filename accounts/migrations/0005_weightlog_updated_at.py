@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_accounts_us_role_cf74dd_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weightlog',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_weightlog_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgressSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='progress', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('log_count', models.PositiveIntegerField(default=0)),
+                ('first_date', models.DateField()),
+                ('first_weight', models.FloatField()),
+                ('last_date', models.DateField()),
+                ('latest_weight', models.FloatField()),
+                ('ema_7', models.FloatField()),
+                ('ema_30', models.FloatField()),
+                ('prev_date', models.DateField(blank=True, null=True)),
+                ('prev_ema_7', models.FloatField(blank=True, null=True)),
+                ('prev_ema_30', models.FloatField(blank=True, null=True)),
+                ('anchor_date', models.DateField()),
+                ('sum_x', models.FloatField(default=0)),
+                ('sum_y', models.FloatField(default=0)),
+                ('sum_xx', models.FloatField(default=0)),
+                ('sum_xy', models.FloatField(default=0)),
+                ('slope', models.FloatField(blank=True, help_text='Trend in kg per day', null=True)),
+                ('goal_weight', models.FloatField(blank=True, null=True)),
+                ('goal_eta', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
 import datetime
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Case, FloatField, When
+from django.db.models.functions import Cast
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -29,6 +31,14 @@ class User(AbstractUser):
     
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta(AbstractUser.Meta):
+        # Back the sortable columns of the admin member/trainer lists
+        indexes = [
+            models.Index(fields=['role', 'created_at']),
+            models.Index(fields=['role', 'first_name', 'last_name']),
+            models.Index(fields=['role', 'email']),
+        ]
+
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}".strip()
@@ -43,6 +53,24 @@ class User(AbstractUser):
         super().save(*args, **kwargs)
 
 
+class WeightLogQuerySet(models.QuerySet):
+    def with_bmi(self):
+        """
+        Annotate `bmi_value` (kg / m^2) from the joined user's height, so BMI
+        for any number of logs comes from this one query. NULL when the user
+        has no height.
+        """
+        weight = Cast('weight', FloatField())
+        height = Cast('user__height', FloatField())
+        return self.annotate(
+            bmi_value=Case(
+                When(user__height__gt=0, then=weight * 10000 / (height * height)),
+                default=None,
+                output_field=FloatField(),
+            )
+        )
+
+
 class WeightLog(models.Model):
     """
     Track user weight over time for progress monitoring
@@ -52,6 +80,9 @@ class WeightLog(models.Model):
     weight = models.DecimalField(max_digits=5, decimal_places=2, help_text="Weight in kg")
     notes = models.TextField(blank=True, null=True, help_text="Optional notes about this entry")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = WeightLogQuerySet.as_manager()
     
     class Meta:
         ordering = ['-date']
@@ -63,7 +94,57 @@ class WeightLog(models.Model):
     @property
     def bmi(self):
         """Calculate BMI if height is available"""
+        # Use the with_bmi() annotation when the log was loaded with it
+        if 'bmi_value' in self.__dict__:
+            return round(self.bmi_value, 1) if self.bmi_value is not None else None
         if self.user.height and self.user.height > 0:
             height_m = float(self.user.height) / 100  # Convert cm to meters
             return round(float(self.weight) / (height_m ** 2), 1)
         return None
+
+
+class ProgressSummary(models.Model):
+    """
+    Running weight statistics for one user, kept up to date from WeightLog
+    changes (see accounts/progress.py) so progress can be read without
+    scanning the history.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='progress')
+    log_count = models.PositiveIntegerField(default=0)
+
+    first_date = models.DateField()
+    first_weight = models.FloatField()
+    last_date = models.DateField()
+    latest_weight = models.FloatField()
+
+    # Time-weighted exponential moving averages, and their values before the
+    # latest entry so re-logging today's weight is still an O(1) update
+    ema_7 = models.FloatField()
+    ema_30 = models.FloatField()
+    prev_date = models.DateField(null=True, blank=True)
+    prev_ema_7 = models.FloatField(null=True, blank=True)
+    prev_ema_30 = models.FloatField(null=True, blank=True)
+
+    # Least-squares sums over (days since anchor_date, weight)
+    anchor_date = models.DateField()
+    sum_x = models.FloatField(default=0)
+    sum_y = models.FloatField(default=0)
+    sum_xx = models.FloatField(default=0)
+    sum_xy = models.FloatField(default=0)
+    slope = models.FloatField(null=True, blank=True, help_text="Trend in kg per day")
+
+    goal_weight = models.FloatField(null=True, blank=True)
+    goal_eta = models.DateField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.latest_weight}kg ({self.log_count} logs)"
+
+    @property
+    def weekly_trend(self):
+        return round(self.slope * 7, 2) if self.slope is not None else None
+
+    @property
+    def total_change(self):
+        return round(self.latest_weight - self.first_weight, 2)
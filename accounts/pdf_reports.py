@@ -0,0 +1,160 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from xhtml2pdf import pisa
+
+# Background PDF generation for the admin report.
+#
+# Turning the report HTML into a PDF with xhtml2pdf takes seconds, so it runs
+# in a process pool instead of the request. The request only renders the
+# HTML (cheap) and hashes it: the hash names the job and the file on disk, so
+# as long as the report content hasn't changed every admin gets the same
+# finished PDF instead of starting another conversion.
+#
+# Job state lives on disk next to the PDF, not in this process, so a status
+# poll answered by a different WSGI worker sees the same job: <job>.running
+# is created exclusively when the job is queued (only one worker wins), and
+# the conversion replaces it with <job>.pdf or <job>.failed.
+
+JOB_RE = re.compile(r'^[0-9a-f]{32}$')
+
+_executor = None
+
+
+def reports_dir():
+    return Path(settings.MEDIA_ROOT) / 'reports'
+
+
+def report_path(job):
+    return reports_dir() / f'{job}.pdf'
+
+
+def _marker_path(job, state):
+    return reports_dir() / f'{job}.{state}'
+
+
+def _remove(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _is_stale(path):
+    """A running marker older than REPORT_PDF_TIMEOUT belongs to a conversion that died"""
+    try:
+        age = time.time() - path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return age > getattr(settings, 'REPORT_PDF_TIMEOUT', 300)
+
+
+def fingerprint(html):
+    """Job id for a rendered report: a hash of its HTML"""
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()[:32]
+
+
+def is_valid_job(job):
+    return bool(JOB_RE.match(job or ''))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'REPORT_PDF_WORKERS', 2))
+    return _executor
+
+
+def _write_pdf(html, path):
+    """
+    Runs in a worker process. Writes to a temporary file next to `path` and
+    renames it into place, so a half-written PDF is never served. On failure
+    leaves a .failed marker for whichever worker answers the next poll.
+    """
+    path = Path(path)
+    running, failed = path.with_suffix('.running'), path.with_suffix('.failed')
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            status = pisa.CreatePDF(html, dest=tmp)
+        if status.err:
+            os.unlink(tmp_path)
+            failed.touch()
+            return False
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        failed.touch()
+        raise
+    finally:
+        _remove(running)
+
+    _prune_reports(path.parent, keep=getattr(settings, 'REPORT_PDF_KEEP', 10))
+    return True
+
+
+def _prune_reports(directory, keep):
+    """Remove all but the `keep` newest report files"""
+    reports = sorted(directory.glob('*.pdf'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in reports[keep:]:
+        try:
+            old.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _claim(job):
+    """Create the job's running marker; False if another worker already holds it"""
+    running = _marker_path(job, 'running')
+    if _is_stale(running):
+        _remove(running)
+    try:
+        os.close(os.open(running, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
+def submit(html):
+    """
+    Make sure a PDF for `html` exists or is being generated.
+    Returns the job id and its status.
+    """
+    job = fingerprint(html)
+    reports_dir().mkdir(parents=True, exist_ok=True)
+    if not report_path(job).exists():
+        # Asking again after a failure retries it
+        _remove(_marker_path(job, 'failed'))
+        if _claim(job):
+            try:
+                _get_executor().submit(_write_pdf, html, str(report_path(job)))
+            except Exception:
+                _remove(_marker_path(job, 'running'))
+                raise
+    return job, status(job)
+
+
+def status(job):
+    """'ready', 'running', 'failed' or 'missing' for a job id"""
+    if report_path(job).exists():
+        return 'ready'
+
+    failed = _marker_path(job, 'failed')
+    if failed.exists():
+        return 'failed'
+
+    running = _marker_path(job, 'running')
+    if not running.exists():
+        return 'missing'
+    if _is_stale(running):
+        # The conversion never finished (its worker was killed, say)
+        _remove(running)
+        return 'failed'
+    return 'running'
@@ -0,0 +1,214 @@
+import math
+import re
+from datetime import timedelta
+
+from django.db import transaction
+
+from .models import ProgressSummary, WeightLog
+
+# Incrementally maintained progress statistics (ProgressSummary).
+#
+# Logging a new latest weight, or re-logging the latest day, updates the
+# summary in O(1): the moving averages advance one step and the regression
+# sums gain (or swap) one point. Anything that rewrites history (back-dated
+# entries, deletes, bulk syncs) rebuilds the user's summary from a single
+# ordered query instead.
+
+MAX_ETA_DAYS = 5 * 365
+# Numbers outside this range in a goal are not body weights ("train 5 days a week")
+GOAL_WEIGHT_RANGE = (20, 400)
+
+
+def _decay(span, days):
+    """Weight kept by the previous average after `days` days, for a span-day EMA"""
+    return (1 - 2 / (span + 1)) ** max(days, 1)
+
+
+def _advance(ema, weight, span, days):
+    return weight + (ema - weight) * _decay(span, days)
+
+
+# -------------------------
+# Goal parsing
+# -------------------------
+_NUMBER = r'(\d+(?:\.\d+)?)\s*(?:kg|kgs|kilos?|kilograms?)?'
+_RELATIVE_GOAL = re.compile(r'\b(lose|gain|drop|put on)\s+' + _NUMBER, re.IGNORECASE)
+_ABSOLUTE_GOAL = re.compile(r'\b(?:to|reach|target|of|at)\s+' + _NUMBER, re.IGNORECASE)
+_BARE_WEIGHT = re.compile(r'(\d+(?:\.\d+)?)\s*(?:kg|kgs|kilos?|kilograms?)\b', re.IGNORECASE)
+
+
+def _target_from_text(goal, start_weight):
+    match = _ABSOLUTE_GOAL.search(goal)
+    if match:
+        return float(match.group(1))
+
+    match = _RELATIVE_GOAL.search(goal)
+    if match and start_weight is not None:
+        amount = float(match.group(2))
+        if match.group(1).lower() in ('lose', 'drop'):
+            return start_weight - amount
+        return start_weight + amount
+
+    match = _BARE_WEIGHT.search(goal)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def parse_goal_weight(goal, start_weight):
+    """
+    Target weight implied by a free-text fitness goal, or None.
+    "Reach 65kg" / "lose weight to 65" -> 65, "lose 5 kg" -> start - 5,
+    "gain 3kg" -> start + 3.
+    """
+    if not goal:
+        return None
+    target = _target_from_text(goal, start_weight)
+    low, high = GOAL_WEIGHT_RANGE
+    if target is None or not low <= target <= high:
+        return None
+    return target
+
+
+# -------------------------
+# Derived values
+# -------------------------
+def _slope(summary):
+    n = summary.log_count
+    denominator = n * summary.sum_xx - summary.sum_x ** 2
+    if n < 2 or abs(denominator) < 1e-9:
+        return None
+    return (n * summary.sum_xy - summary.sum_x * summary.sum_y) / denominator
+
+
+def refresh_goal(summary, user):
+    """Recompute goal_weight / goal_eta from the user's fitness goal and the trend"""
+    summary.goal_weight = parse_goal_weight(user.fitness_goal, summary.first_weight)
+    summary.goal_eta = None
+    if summary.goal_weight is None:
+        return
+
+    remaining = summary.goal_weight - summary.ema_7
+    if abs(remaining) < 0.05:
+        summary.goal_eta = summary.last_date
+    elif summary.slope and remaining * summary.slope > 0:
+        days = math.ceil(remaining / summary.slope)
+        if days <= MAX_ETA_DAYS:
+            summary.goal_eta = summary.last_date + timedelta(days=days)
+
+
+def _finish(summary, user):
+    summary.slope = _slope(summary)
+    refresh_goal(summary, user)
+
+
+# -------------------------
+# Full rebuild
+# -------------------------
+def rebuild(user):
+    """Recompute the user's summary from all of their logs (one query)"""
+    rows = list(WeightLog.objects.filter(user=user).order_by('date').values_list('date', 'weight'))
+    if not rows:
+        ProgressSummary.objects.filter(user=user).delete()
+        return None
+
+    first_date, first_weight = rows[0][0], float(rows[0][1])
+    summary = ProgressSummary(
+        user=user,
+        log_count=len(rows),
+        first_date=first_date,
+        first_weight=first_weight,
+        anchor_date=first_date,
+        ema_7=first_weight,
+        ema_30=first_weight,
+    )
+
+    previous_date = None
+    for log_date, weight in rows:
+        weight = float(weight)
+        x = (log_date - first_date).days
+        summary.sum_x += x
+        summary.sum_y += weight
+        summary.sum_xx += x * x
+        summary.sum_xy += x * weight
+
+        if previous_date is not None:
+            gap = (log_date - previous_date).days
+            summary.prev_date = previous_date
+            summary.prev_ema_7, summary.prev_ema_30 = summary.ema_7, summary.ema_30
+            summary.ema_7 = _advance(summary.ema_7, weight, 7, gap)
+            summary.ema_30 = _advance(summary.ema_30, weight, 30, gap)
+        previous_date = log_date
+
+    summary.last_date = previous_date
+    summary.latest_weight = float(rows[-1][1])
+    _finish(summary, user)
+    summary.save()
+    return summary
+
+
+# -------------------------
+# Incremental updates
+# -------------------------
+def _append(summary, log_date, weight):
+    """Add a log dated after every existing one"""
+    gap = (log_date - summary.last_date).days
+    summary.prev_date = summary.last_date
+    summary.prev_ema_7, summary.prev_ema_30 = summary.ema_7, summary.ema_30
+    summary.ema_7 = _advance(summary.ema_7, weight, 7, gap)
+    summary.ema_30 = _advance(summary.ema_30, weight, 30, gap)
+
+    x = (log_date - summary.anchor_date).days
+    summary.log_count += 1
+    summary.sum_x += x
+    summary.sum_y += weight
+    summary.sum_xx += x * x
+    summary.sum_xy += x * weight
+    summary.last_date = log_date
+    summary.latest_weight = weight
+
+
+def _replace_latest(summary, weight):
+    """The latest log's weight changed"""
+    delta = weight - summary.latest_weight
+    x = (summary.last_date - summary.anchor_date).days
+    summary.sum_y += delta
+    summary.sum_xy += x * delta
+    summary.latest_weight = weight
+    if summary.log_count == 1:
+        summary.first_weight = weight
+
+    if summary.prev_date is None:
+        summary.ema_7 = summary.ema_30 = weight
+    else:
+        gap = (summary.last_date - summary.prev_date).days
+        summary.ema_7 = _advance(summary.prev_ema_7, weight, 7, gap)
+        summary.ema_30 = _advance(summary.prev_ema_30, weight, 30, gap)
+
+
+def record_log(log, created):
+    """Update the summary after a WeightLog save"""
+    with transaction.atomic():
+        summary = ProgressSummary.objects.select_for_update().filter(user_id=log.user_id).first()
+        # log_weight saves the posted date string as-is
+        log_date = WeightLog._meta.get_field('date').to_python(log.date)
+        weight = float(log.weight)
+
+        if summary is not None and created and log_date > summary.last_date:
+            _append(summary, log_date, weight)
+        elif summary is not None and not created and log_date == summary.last_date:
+            _replace_latest(summary, weight)
+        else:
+            return rebuild(log.user)
+
+        _finish(summary, log.user)
+        summary.save()
+        return summary
+
+
+def for_user(user):
+    """The user's summary, built on first access; None if they have no logs"""
+    try:
+        return user.progress
+    except ProgressSummary.DoesNotExist:
+        return rebuild(user)
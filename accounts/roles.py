@@ -0,0 +1,12 @@
+# Role checks shared by views across apps. Keep them here rather than
+# re-deriving them per view so they can't drift apart.
+
+
+def is_admin(user):
+    """Admins and Django staff"""
+    return user.is_authenticated and (user.role == 'Admin' or user.is_staff)
+
+
+def is_staff_member(user):
+    """Anyone working the gym floor: admins and trainers"""
+    return is_admin(user) or (user.is_authenticated and user.role == 'Trainer')
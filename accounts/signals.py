@@ -0,0 +1,56 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import User, WeightLog, ProgressSummary
+from .kpis import invalidate_admin_kpis
+from . import progress
+from membership.models import MemberSubscription, Payment
+from classes.models import PrivateClass
+
+
+# Any write to a table the admin KPIs are computed from drops the cached numbers
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=MemberSubscription)
+@receiver(post_delete, sender=MemberSubscription)
+@receiver(post_save, sender=PrivateClass)
+@receiver(post_delete, sender=PrivateClass)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def invalidate_kpis_on_change(sender, **kwargs):
+    invalidate_admin_kpis()
+
+
+@receiver(post_save, sender=User)
+def invalidate_kpis_on_user_save(sender, update_fields=None, **kwargs):
+    # Logins only touch last_login, which none of the KPIs depend on
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_admin_kpis()
+
+
+# -------------------------
+# Progress summaries
+# -------------------------
+@receiver(post_save, sender=WeightLog)
+def update_progress_on_log_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    progress.record_log(instance, created)
+
+
+@receiver(post_delete, sender=WeightLog)
+def update_progress_on_log_delete(sender, instance, origin=None, **kwargs):
+    # Deleting the user (or a queryset of users) removes the summary along with the logs
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        return
+    progress.rebuild(instance.user)
+
+
+@receiver(post_save, sender=User)
+def refresh_goal_on_user_save(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields and 'fitness_goal' not in update_fields):
+        return
+    summary = ProgressSummary.objects.filter(user=instance).first()
+    if summary is not None:
+        progress.refresh_goal(summary, instance)
+        summary.save(update_fields=['goal_weight', 'goal_eta', 'updated_at'])
@@ -0,0 +1,342 @@
+import random
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from classes.models import ClassOccurrence, PrivateClass
+from membership.models import MemberSubscription, MembershipPlan, Payment
+from .models import User, WeightLog
+
+# Reproducible synthetic data for load and performance testing.
+#
+# Everything is drawn from one random.Random(seed), so the same options give
+# the same rows (ids aside) on every run. Rows are written with bulk_create
+# in batches, which skips save() and signals: the fields save() would fill in
+# (subscription end dates, payment payer/trainer, class prices) are set here,
+# auto_now_add timestamps are put back to their historic values with
+# bulk_update, and the derived tables (occurrences, hourly and daily rollups,
+# progress summaries) are rebuilt once at the end instead of row by row.
+#
+# Synthetic users are recognisable by USERNAME_PREFIX and synthetic plans by
+# PLAN_PRODUCT_ID, so flush() can remove a previous run without touching
+# real data.
+
+USERNAME_PREFIX = 'synth_'
+PLAN_PRODUCT_ID = 'synthetic'
+ADMIN_USERNAME = f'{USERNAME_PREFIX}admin'
+
+PLAN_MONTHS = (1, 3, 6, 12, 2, 4, 9, 18)
+MONTHLY_PRICE = 2000
+FIRST_NAMES = ('Aarav', 'Anita', 'Bikash', 'Deepa', 'Gita', 'Hari', 'Kiran', 'Maya', 'Nabin', 'Pooja',
+               'Rajesh', 'Sabina', 'Sita', 'Suman', 'Sunita', 'Tara', 'Ujwal', 'Yamuna')
+LAST_NAMES = ('Adhikari', 'Bhandari', 'Gurung', 'Karki', 'Khadka', 'Lama', 'Magar', 'Rai',
+              'Sharma', 'Shrestha', 'Tamang', 'Thapa')
+GOALS = ('Lose weight', 'Build muscle', 'Improve endurance', 'Stay fit', 'Gain strength')
+SPECIALIZATIONS = ('Strength', 'Cardio', 'Yoga', 'CrossFit', 'Boxing', 'Pilates')
+PAYMENT_METHODS = (('Online', 6), ('Card', 3), ('Cash', 2))
+
+
+class Generator:
+    """Builds one synthetic dataset; see generate()"""
+
+    def __init__(self, seed=0, years=3, batch_size=1000, password='synthetic', today=None, log=None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.today = today or timezone.localdate()
+        self.first_day = self.today - timedelta(days=int(365 * years))
+        self.password = make_password(password)
+        self.log = log or (lambda message: None)
+        self.counts = {}
+
+    # -------------------------
+    # Helpers
+    # -------------------------
+    def _day_between(self, start, end):
+        return start + timedelta(days=self.random.randint(0, max((end - start).days, 0)))
+
+    def _moment(self, day):
+        """An aware datetime at a random time of `day`"""
+        moment = datetime.combine(day, time(self.random.randint(6, 21), self.random.randint(0, 59)))
+        return timezone.make_aware(moment)
+
+    def _method(self):
+        methods, weights = zip(*PAYMENT_METHODS)
+        return self.random.choices(methods, weights)[0]
+
+    def _create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.counts[model._meta.label] = self.counts.get(model._meta.label, 0) + len(objects)
+        return objects
+
+    def _restore(self, model, objects, *fields):
+        """bulk_create stamps auto_now_add fields with now(); put the generated values back"""
+        model.objects.bulk_update(objects, fields, batch_size=self.batch_size)
+
+    def _person(self, index, role, joined):
+        first_name = self.random.choice(FIRST_NAMES)
+        last_name = self.random.choice(LAST_NAMES)
+        slug = role.lower()
+        user = User(
+            username=f'{USERNAME_PREFIX}{slug}_{index:06d}',
+            email=f'{USERNAME_PREFIX}{slug}_{index:06d}@example.com',
+            first_name=first_name,
+            last_name=last_name,
+            password=self.password,
+            role=role,
+            phone=f'98{self.random.randint(10000000, 99999999)}',
+            gender=self.random.choice(('Male', 'Female')),
+            date_joined=self._moment(joined),
+        )
+        user.created_at = user.date_joined
+        return user
+
+    # -------------------------
+    # Tables
+    # -------------------------
+    def users(self, members, trainers):
+        admin = User(
+            username=ADMIN_USERNAME,
+            email=f'{ADMIN_USERNAME}@example.com',
+            first_name='Synthetic',
+            last_name='Admin',
+            password=self.password,
+            role='Admin',
+            is_staff=True,
+            date_joined=self._moment(self.first_day),
+        )
+        admin.created_at = admin.date_joined
+
+        trainer_rows = []
+        for index in range(trainers):
+            trainer = self._person(index, 'Trainer', self.first_day)
+            trainer.specialization = self.random.choice(SPECIALIZATIONS)
+            trainer.experience_years = self.random.randint(1, 15)
+            trainer_rows.append(trainer)
+
+        member_rows = []
+        for index in range(members):
+            member = self._person(index, 'Member', self._day_between(self.first_day, self.today))
+            member.age = self.random.randint(16, 65)
+            member.height = Decimal(self.random.randint(150, 195))
+            member.weight = Decimal(self.random.randint(50, 110))
+            member.fitness_goal = self.random.choice(GOALS)
+            member.membership_start_date = timezone.localdate(member.date_joined)
+            member_rows.append(member)
+
+        everyone = self._create(User, [admin] + trainer_rows + member_rows)
+        self._restore(User, everyone, 'created_at')
+        return admin, trainer_rows, member_rows
+
+    def plans(self, count):
+        plans = []
+        for months in (PLAN_MONTHS * (count // len(PLAN_MONTHS) + 1))[:count]:
+            # Longer plans are cheaper per month
+            price = MONTHLY_PRICE * months * (1 - min(months, 12) / 60)
+            plans.append(MembershipPlan(
+                plan_name=f'Synthetic {months} month{"s" if months > 1 else ""}',
+                duration_months=months,
+                price=Decimal(round(price, -1)),
+                description='Generated for load testing.',
+                dodo_product_id=PLAN_PRODUCT_ID,
+            ))
+        return self._create(MembershipPlan, plans)
+
+    def subscriptions(self, members, plans):
+        """Back-to-back subscription histories with gaps, early renewals and cancellations"""
+        subscriptions = []
+        for member in members:
+            day = timezone.localdate(member.date_joined) + timedelta(days=self.random.randint(0, 14))
+            while day <= self.today:
+                plan = self.random.choice(plans)
+                end = day + timedelta(days=30 * plan.duration_months)
+                subscription = MemberSubscription(
+                    member=member, plan=plan, start_date=day, end_date=end, is_active=True,
+                )
+                if self.random.random() < 0.05:
+                    cancelled = self._day_between(day, min(end, self.today))
+                    subscription.is_active = False
+                    subscription.cancelled_at = self._moment(cancelled)
+                    end = cancelled
+                subscriptions.append(subscription)
+
+                roll = self.random.random()
+                if roll < 0.15:
+                    break                                                    # churned
+                elif roll < 0.25:
+                    day = end - timedelta(days=self.random.randint(1, 10))   # renewed early
+                elif roll < 0.75:
+                    day = end + timedelta(days=1)                            # renewed on time
+                else:
+                    day = end + timedelta(days=self.random.randint(2, 120))  # came back later
+        return self._create(MemberSubscription, subscriptions)
+
+    def private_classes(self, members, trainers, booking_rate=0.3):
+        classes = []
+        if not trainers:
+            return classes
+        for member in members:
+            if self.random.random() >= booking_rate:
+                continue
+            joined = timezone.localdate(member.date_joined)
+            for _ in range(self.random.randint(1, 3)):
+                start = self._day_between(joined, self.today + timedelta(days=30))
+                hours = self.random.choice((1, 1, 1, 2))
+                months = self.random.choice((1, 1, 2, 3))
+                booked = min(max(start - timedelta(days=self.random.randint(0, 10)), joined), self.today)
+                private_class = PrivateClass(
+                    member=member,
+                    trainer=self.random.choice(trainers),
+                    start_date=start,
+                    start_time=time(self.random.randint(6, 20)),
+                    duration_hours=hours,
+                    duration_months=months,
+                    is_active=self.random.random() >= 0.05,
+                )
+                private_class.price = Decimal(private_class.calculate_price())
+                private_class.created_at = self._moment(booked)
+                classes.append(private_class)
+        self._create(PrivateClass, classes)
+        self._restore(PrivateClass, classes, 'created_at')
+        return classes
+
+    def occurrences(self, classes):
+        """What sync_occurrences() would have written for each active class"""
+        batch = []
+        for private_class in classes:
+            if not private_class.is_active:
+                continue
+            end_time = private_class.end_time
+            for day in private_class.session_dates():
+                batch.append(ClassOccurrence(
+                    private_class=private_class,
+                    trainer_id=private_class.trainer_id,
+                    member_id=private_class.member_id,
+                    date=day,
+                    start_time=private_class.start_time,
+                    end_time=end_time,
+                ))
+                if len(batch) >= self.batch_size * 10:
+                    self._create(ClassOccurrence, batch)
+                    batch = []
+        self._create(ClassOccurrence, batch)
+
+    def _attempts(self, due, amount, **target):
+        """Payments for one purchase: maybe a failed or abandoned try, then the outcome"""
+        attempts = []
+        paid_on = max(due - timedelta(days=self.random.randint(0, 3)), self.first_day)
+        if self.random.random() < 0.1:
+            attempts.append(Payment(amount=amount, payment_method=self._method(), payment_status='Failed',
+                                    payment_date=self._moment(paid_on), **target))
+        if self.random.random() < 0.05:
+            attempts.append(Payment(amount=amount, payment_method=self._method(), payment_status='Cancelled',
+                                    payment_date=self._moment(paid_on), **target))
+        status = 'Pending' if paid_on >= self.today - timedelta(days=2) and self.random.random() < 0.5 else 'Completed'
+        attempts.append(Payment(amount=amount, payment_method=self._method(), payment_status=status,
+                                payment_date=self._moment(paid_on), **target))
+        return attempts
+
+    def payments(self, subscriptions, classes):
+        payments = []
+        for subscription in subscriptions:
+            payments += self._attempts(
+                subscription.start_date, subscription.plan.price,
+                member_subscription=subscription, payer_id=subscription.member_id,
+            )
+        for private_class in classes:
+            payments += self._attempts(
+                timezone.localdate(private_class.created_at), private_class.price,
+                private_class=private_class, payer_id=private_class.member_id,
+                trainer_id=private_class.trainer_id,
+            )
+        payments = [payment for payment in payments if timezone.localdate(payment.payment_date) <= self.today]
+        self._create(Payment, payments)
+        self._restore(Payment, payments, 'payment_date')
+
+    def weight_logs(self, members, logging_rate=0.6):
+        """A noisy drift towards each member's goal, logged every few days"""
+        batch = []
+        for member in members:
+            if self.random.random() >= logging_rate:
+                continue
+            day = timezone.localdate(member.date_joined)
+            weight = float(member.weight)
+            drift = self.random.uniform(-0.03, 0.02)
+            while day <= self.today:
+                weight = min(max(weight + drift + self.random.gauss(0, 0.4), 35), 200)
+                logged_at = self._moment(day)
+                log = WeightLog(user=member, date=day, weight=Decimal(f'{weight:.2f}'))
+                log.created_at = log.updated_at = logged_at
+                batch.append(log)
+                day += timedelta(days=self.random.choice((1, 2, 3, 7, 7, 14)))
+            if len(batch) >= self.batch_size * 10:
+                self._flush_logs(batch)
+                batch = []
+        self._flush_logs(batch)
+
+    def _flush_logs(self, logs):
+        self._create(WeightLog, logs)
+        self._restore(WeightLog, logs, 'created_at', 'updated_at')
+
+    # -------------------------
+    # Derived tables
+    # -------------------------
+    def rebuild_derived(self):
+        from accounts import progress
+        from accounts.kpis import invalidate_admin_kpis
+        from classes import utilization
+        from classes.availability import invalidate_availability
+        from membership import coverage, rollups
+
+        self.log("Rebuilding hourly utilization...")
+        utilization.rebuild()
+
+        self.log("Rebuilding daily rollups...")
+        first, last = rollups.source_date_range()
+        if first is not None:
+            for batch_start, batch_end in rollups.date_batches(first, last, 31):
+                rollups.rebuild_range(batch_start, batch_end)
+
+        self.log("Rebuilding progress summaries...")
+        logged = User.objects.filter(username__startswith=USERNAME_PREFIX, weight_logs__isnull=False).distinct()
+        for member in logged.iterator():
+            progress.rebuild(member)
+
+        # Only reaches other processes with a shared cache backend
+        coverage.invalidate()
+        invalidate_admin_kpis()
+        invalidate_availability()
+
+    def generate(self, members, trainers, plans):
+        with transaction.atomic():
+            self.log("Creating users...")
+            admin, trainer_rows, member_rows = self.users(members, trainers)
+            self.log("Creating plans and subscriptions...")
+            plan_rows = self.plans(plans)
+            subscriptions = self.subscriptions(member_rows, plan_rows)
+            self.log("Creating private classes...")
+            classes = self.private_classes(member_rows, trainer_rows)
+            self.occurrences(classes)
+            self.log("Creating payments...")
+            self.payments(subscriptions, classes)
+            self.log("Creating weight logs...")
+            self.weight_logs(member_rows)
+            self.rebuild_derived()
+        return self.counts
+
+
+def exists():
+    return User.objects.filter(username__startswith=USERNAME_PREFIX).exists()
+
+
+def flush():
+    """Delete everything a previous run created"""
+    with transaction.atomic():
+        synthetic = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        # Payments outlive their subscription/class (SET_NULL), so go first
+        Payment.objects.filter(payer__in=synthetic).delete()
+        deleted, _ = synthetic.delete()
+        MembershipPlan.objects.filter(dodo_product_id=PLAN_PRODUCT_ID).delete()
+    return deleted
@@ -2,8 +2,12 @@ from django.urls import path
 from .views import register, user_login, user_logout, home, password_reset, user_dashboard, profile_settings
 from .views import first_time_email, first_time_set_password
 from .views import admin_dashboard, trainer_list, trainer_add, trainer_edit, trainer_delete, member_list, member_add, member_edit, member_delete
+from .views import trainer_list_data, member_list_data, member_list_export
 from .views import trainer_dashboard, admin_reports, admin_reports_pdf, pay_pending_payment, cancel_payment
-from .views import track_progress, log_weight, delete_weight_log, weight_chart_data
+from .views import admin_reports_timeseries, admin_reports_coverage, admin_reports_pdf_job, admin_reports_pdf_status, admin_reports_pdf_download
+from .views import track_progress, log_weight, delete_weight_log, weight_chart_data, weight_log_export
+from .views import sync_weight_logs
+from .views import cohort_analytics_page, cohort_analytics_data
 
 urlpatterns = [
     path('register/', register, name='register'),
@@ -25,8 +29,10 @@ urlpatterns = [
     # Weight Tracking
     path('track-progress/', track_progress, name='track-progress'),
     path('log-weight/', log_weight, name='log-weight'),
+    path('api/weight-logs/sync/', sync_weight_logs, name='sync-weight-logs'),
     path('weight-log/<int:log_id>/delete/', delete_weight_log, name='delete-weight-log'),
     path('api/weight-chart-data/', weight_chart_data, name='weight-chart-data'),
+    path('track-progress/export/', weight_log_export, name='weight-log-export'),
 
     
     # Admin stuff
@@ -35,6 +41,7 @@ urlpatterns = [
 
     # Admin's trainer management
     path('admin-dashboard/trainers/', trainer_list, name='admin-trainers'),
+    path('admin-dashboard/trainers/data/', trainer_list_data, name='admin-trainers-data'),
     path('admin-dashboard/trainers/add/', trainer_add, name='admin-trainer-add'),
     path('admin-dashboard/trainers/edit/<int:trainer_id>/', trainer_edit, name='trainer-edit'),
     path('admin-dashboard/trainers/delete/<int:trainer_id>/', trainer_delete, name='trainer-delete'),
@@ -44,9 +51,18 @@ urlpatterns = [
     # path('admin-payments/', admin_dashboard, name='admin-payments'),
     path('admin-reports/', admin_reports, name='admin-reports'),
     path('admin-reports/pdf/', admin_reports_pdf, name='admin-reports-pdf'),
+    path('admin-reports/timeseries/', admin_reports_timeseries, name='admin-reports-timeseries'),
+    path('admin-reports/coverage/', admin_reports_coverage, name='admin-reports-coverage'),
+    path('analytics/cohorts/', cohort_analytics_page, name='cohort-analytics'),
+    path('analytics/cohorts/data/', cohort_analytics_data, name='cohort-analytics-data'),
+    path('admin-reports/pdf/jobs/', admin_reports_pdf_job, name='admin-reports-pdf-job'),
+    path('admin-reports/pdf/jobs/<str:job>/', admin_reports_pdf_status, name='admin-reports-pdf-status'),
+    path('admin-reports/pdf/jobs/<str:job>/download/', admin_reports_pdf_download, name='admin-reports-pdf-download'),
 
     # Admin's members management
     path('admin-dashboard/members/', member_list, name='admin-members'),
+    path('admin-dashboard/members/data/', member_list_data, name='admin-members-data'),
+    path('admin-dashboard/members/export/', member_list_export, name='admin-members-export'),
     path('admin-dashboard/members/add/', member_add, name='admin-members-add'),
     path('admin-dashboard/members/edit/<int:member_id>/', member_edit, name='admin-members-edit'),
     path('admin-dashboard/members/delete/<int:member_id>/', member_delete, name='admin-members-delete'),
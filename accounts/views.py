@@ -8,21 +8,36 @@ from django.contrib import messages
 from .models import User, WeightLog
 from django.utils import timezone
 from functools import wraps
+import json
 from membership.models import MemberSubscription, Payment, MembershipPlan
-from classes.models import PrivateClass
-from django.db.models import Sum, Count, Q
+from membership.timeline import SubscriptionTimeline
+from membership import coverage, occupancy, rollups
+from classes.models import PrivateClass, ClassOccurrence
+from classes import utilization
+from django.db.models import Sum, Count, Q, Min, Max, Avg
+from django.db.models.functions import TruncWeek, TruncMonth
 from django.shortcuts import render
 from django.contrib.auth.decorators import user_passes_test
-from datetime import date, timedelta, datetime
+from datetime import date, timedelta
 from django.template.loader import render_to_string
-from django.http import HttpResponse, JsonResponse
-from xhtml2pdf import pisa
+from django.http import FileResponse, Http404, JsonResponse
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.cache import cache_control
+from .kpis import get_admin_kpis
+from .roles import is_admin
+from . import pdf_reports
+from .datatables import datatables_response, filter_queryset
+from .exports import csv_response, stream_rows
+from .charts import lttb
+from . import weight_import, progress, cohorts
+from django.urls import reverse
+from django.utils.html import escape, format_html
 
 # Admin-only decorator
 def admin_required(view_func):
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
-        if request.user.is_authenticated and (request.user.role == 'Admin' or request.user.is_staff):
+        if is_admin(request.user):
             return view_func(request, *args, **kwargs)
         return redirect('user-dashboard')
     return wrapper
@@ -214,12 +229,7 @@ def user_dashboard(request):
     # -------------------------
     # Active subscription
     # -------------------------
-    active_subscription = MemberSubscription.objects.filter(
-        member=user,
-        is_active=True,
-        start_date__lte=today,
-        end_date__gte=today
-    ).order_by('-end_date').first()
+    active_subscription = SubscriptionTimeline.for_member(user).current(today)
     
     if active_subscription:
         days_remaining = (active_subscription.end_date - today).days
@@ -231,36 +241,35 @@ def user_dashboard(request):
     # -------------------------
     # Upcoming private classes
     # -------------------------
+    # Classes with at least one session from today on, with the next session date
     upcoming_classes = PrivateClass.objects.filter(
         member=user,
-        is_active=True,
-        start_date__gte=today
-    ).order_by('start_date', 'start_time')
+        occurrences__date__gte=today
+    ).annotate(
+        next_session=Min('occurrences__date')
+    ).select_related('trainer').order_by('next_session', 'start_time')
 
-    upcoming_bookings_count = upcoming_classes.count()
+    upcoming_bookings_count = len(upcoming_classes)
 
     # -------------------------
-    # Completed private classes
+    # Completed private class sessions
     # -------------------------
-    classes_attended = PrivateClass.objects.filter(
+    classes_attended = ClassOccurrence.objects.filter(
         member=user,
-        is_active=True,
-        start_date__lt=today
+        date__lt=today
     ).count()
 
     # -------------------------
     # Payments (subscriptions + private classes)
     # -------------------------
-    payments = Payment.objects.filter(
-        Q(member_subscription__member=user) |
-        Q(private_class__member=user)
-    ).order_by('-payment_date')
+    payments = Payment.objects.filter(payer=user).order_by('-payment_date')
 
-    # Payment stats (NO template sum filter ❌)
-    total_payments = sum(p.amount for p in payments)
-    paid_amount = sum(p.amount for p in payments if p.payment_status == 'Completed')
-    pending_amount = sum(p.amount for p in payments if p.payment_status == 'Pending')
-    failed_amount = sum(p.amount for p in payments if p.payment_status == 'Failed')
+    # Payment stats from one grouped query instead of walking every row
+    totals = payments.status_totals()
+    total_payments = totals['total']
+    paid_amount = totals['Completed']
+    pending_amount = totals['Pending']
+    failed_amount = totals['Failed']
 
     context = {
         'user': user,
@@ -348,37 +357,25 @@ def profile_settings(request):
 @login_required
 @admin_required
 def admin_dashboard(request):
-    # --- Users ---
-    total_users = User.objects.count()
-    active_members = User.objects.filter(role='Member', is_active=True).count()
-    total_trainers = User.objects.filter(role='Trainer', is_active=True).count()
-
-    # --- Membership / Subscriptions ---
-    active_subscriptions = MemberSubscription.objects.filter(is_active=True).count()
-
-    # --- Payments / Revenue ---
-    total_revenue = Payment.objects.filter(payment_status='Completed').aggregate(
-        total=Sum('amount')
-    )['total'] or 0
-
-    pending_payments = Payment.objects.filter(payment_status='Pending').count()
+    kpis = get_admin_kpis()
 
     # --- Recent activities ---
     recent_bookings = PrivateClass.objects.select_related('member', 'trainer').order_by('-created_at')[:5]
 
     recent_payments = Payment.objects.select_related(
-        'member_subscription__member', 'private_class'
+        'member_subscription__member', 'private_class__member'
     ).order_by('-payment_date')[:5]
 
     context = {
-        'total_users': total_users,
-        'active_members': active_members,
-        'total_trainers': total_trainers,
-        'active_subscriptions': active_subscriptions,
-        'total_revenue': total_revenue,
-        'pending_payments': pending_payments,
+        'total_users': kpis['total_users'],
+        'active_members': kpis['active_members'],
+        'total_trainers': kpis['total_trainers'],
+        'active_subscriptions': kpis['active_subscriptions'],
+        'total_revenue': kpis['total_revenue'],
+        'pending_payments': kpis['pending_payments'],
         'recent_bookings': recent_bookings,
         'recent_payments': recent_payments,
+        'occupancy': occupancy.current_count(),
     }
 
     return render(request, 'admin/dashboard.html', context)
@@ -392,24 +389,30 @@ def trainer_dashboard(request):
     # --- Fetch all classes for this trainer (like your working view) ---
     trainer_classes = PrivateClass.objects.filter(trainer=trainer).order_by('start_date', 'start_time')
 
+    # --- Sessions come from the materialized occurrences, so recurring classes
+    # show up on every day they meet, not only on their start_date ---
+    trainer_sessions = ClassOccurrence.objects.filter(trainer=trainer).select_related(
+        'private_class', 'member'
+    ).order_by('date', 'start_time')
+
     # --- Stats ---
     total_classes = trainer_classes.count()
-    classes_today_qs = trainer_classes.filter(start_date=today)
-    classes_today = classes_today_qs.count()
+    classes_today_qs = trainer_sessions.filter(date=today)
     unique_members = trainer_classes.values('member').distinct().count()
 
-    upcoming_classes_qs = trainer_classes.filter(start_date__gte=today, start_date__lte=today + timedelta(days=7))
+    upcoming_classes_qs = trainer_sessions.filter(date__gte=today, date__lte=today + timedelta(days=7))
 
     # --- Revenue ---
-    total_revenue = Payment.objects.filter(private_class__trainer=trainer, payment_status='Completed').aggregate(total=Sum('amount'))['total'] or 0
+    total_revenue = Payment.objects.filter(trainer=trainer, payment_status='Completed').aggregate(total=Sum('amount'))['total'] or 0
 
-    # --- Prepare classes for template safely ---
-    def prepare_session(session):
+    # --- Prepare sessions for template safely ---
+    def prepare_session(occurrence):
+        session = occurrence.private_class
         return {
-            'member': session.member or type('obj', (), {'full_name': 'Unknown Member'})(),
-            'start_date': session.start_date,
-            'start_time': session.start_time,
-            'end_time': session.end_time,
+            'member': occurrence.member or type('obj', (), {'full_name': 'Unknown Member'})(),
+            'start_date': occurrence.date,
+            'start_time': occurrence.start_time,
+            'end_time': occurrence.end_time,
             'duration_hours': session.duration_hours,
             'duration_months': session.duration_months,
             'price': session.price or 0,
@@ -418,6 +421,7 @@ def trainer_dashboard(request):
 
     today_classes = [prepare_session(s) for s in classes_today_qs]
     upcoming_classes = [prepare_session(s) for s in upcoming_classes_qs]
+    classes_today = len(today_classes)
 
     context = {
         'user': trainer,
@@ -427,6 +431,8 @@ def trainer_dashboard(request):
         'total_classes': total_classes,
         'unique_members': unique_members,
         'total_revenue': total_revenue,
+        'occupancy': occupancy.current_count(),
+        'heatmap': utilization.heatmap_context(trainer.id, today),
     }
 
     return render(request, 'trainer/dashboard.html', context)
@@ -436,8 +442,51 @@ def trainer_dashboard(request):
 @login_required
 @admin_required
 def trainer_list(request):
-    trainers = User.objects.filter(role='Trainer').order_by('-created_at')
-    return render(request, 'admin/trainer.html', {'trainers': trainers})
+    # Rows are loaded page by page from trainer_list_data
+    return render(request, 'admin/trainer.html')
+
+
+def _status_badge(is_active):
+    if is_active:
+        return format_html('<span class="badge badge-success">Active</span>')
+    return format_html('<span class="badge badge-danger">Inactive</span>')
+
+
+def _filter_active_status(queryset, value):
+    if value == 'Active':
+        return queryset.filter(is_active=True)
+    if value == 'Inactive':
+        return queryset.filter(is_active=False)
+    return queryset
+
+
+@login_required
+@admin_required
+def trainer_list_data(request):
+    """DataTables server-side endpoint for the trainer list"""
+    def render_row(trainer):
+        return [
+            escape(trainer.full_name),
+            escape(trainer.email),
+            _status_badge(trainer.is_active),
+            format_html(
+                '<a class="btn btn-sm" href="{}">Edit</a> '
+                '<a class="btn btn-sm btn-danger" href="{}" '
+                'onclick="return confirm(\'Are you sure you want to delete this trainer?\');">Delete</a>',
+                reverse('trainer-edit', args=[trainer.id]),
+                reverse('trainer-delete', args=[trainer.id]),
+            ),
+        ]
+
+    return datatables_response(
+        request,
+        User.objects.filter(role='Trainer'),
+        order_columns={0: ['first_name', 'last_name'], 1: ['email']},
+        default_ordering=['-created_at'],
+        search_fields=['first_name', 'last_name', 'email', 'username'],
+        render_row=render_row,
+        filters={'status': _filter_active_status},
+    )
 
 @login_required
 @admin_required
@@ -579,8 +628,8 @@ def trainer_delete(request, trainer_id):
 @login_required
 def pay_pending_payment(request, payment_id):
     """Handle payment for a pending payment record"""
-    from django_esewa import EsewaPayment
-    
+    from membership import gateways
+
     # Get the payment record
     payment = get_object_or_404(Payment, id=payment_id)
     
@@ -591,20 +640,13 @@ def pay_pending_payment(request, payment_id):
     
     # Create eSewa payment
     transaction_uuid = payment.uid
-    paymentEsewa = EsewaPayment(
-        product_code="EPAYTEST",
-        success_url=f"http://localhost:8000/payment/success/{transaction_uuid}/",
-        failure_url=f"http://localhost:8000/payment/failure/{transaction_uuid}/",
+    esewa_form = gateways.esewa.form(
+        transaction_uuid=transaction_uuid,
         amount=float(payment.amount),
-        tax_amount=0,
-        total_amount=float(payment.amount),
-        product_service_charge=0,
-        product_delivery_charge=0,
-        transaction_uuid=str(transaction_uuid),
+        success_url=request.build_absolute_uri(f"/payment/success/{transaction_uuid}/"),
+        failure_url=request.build_absolute_uri(f"/payment/failure/{transaction_uuid}/"),
     )
     
-    signature = paymentEsewa.create_signature()
-    
     # If membership payment, use membership checkout template
     if payment.member_subscription:
         if payment.member_subscription.member != request.user:
@@ -616,7 +658,8 @@ def pay_pending_payment(request, payment_id):
             'plan': plan,
             'subscription': payment.member_subscription,
             'payment': payment,
-            'form': paymentEsewa.generate_form()
+            'form': esewa_form,
+            'esewa_form_url': gateways.esewa.form_url(),
         }
         return render(request, 'membership/membership_checkout.html', context)
     
@@ -631,7 +674,8 @@ def pay_pending_payment(request, payment_id):
             'trainer': trainer,
             'private_class': payment.private_class,
             'payment': payment,
-            'form': paymentEsewa.generate_form()
+            'form': esewa_form,
+            'esewa_form_url': gateways.esewa.form_url(),
         }
         return render(request, 'classes/private_class_checkout.html', context)
     
@@ -648,10 +692,7 @@ def cancel_payment(request, payment_id):
     payment = get_object_or_404(Payment, id=payment_id)
     
     # Verify the payment belongs to the current user
-    if payment.member_subscription and payment.member_subscription.member != request.user:
-        messages.error(request, "You don't have permission to cancel this payment.")
-        return redirect('my-payments')
-    elif payment.private_class and payment.private_class.member != request.user:
+    if payment.payer_id != request.user.id:
         messages.error(request, "You don't have permission to cancel this payment.")
         return redirect('my-payments')
     
@@ -691,8 +732,82 @@ def cancel_payment(request, payment_id):
 @admin_required
 def member_list(request):
     """List all members"""
-    members = User.objects.filter(role='Member').order_by('-created_at')
-    return render(request, 'admin/members_list.html', {'members': members})
+    # Rows are loaded page by page from member_list_data
+    return render(request, 'admin/members_list.html')
+
+
+MEMBER_SEARCH_FIELDS = ['first_name', 'last_name', 'email', 'username', 'phone']
+
+
+@login_required
+@admin_required
+def member_list_data(request):
+    """DataTables server-side endpoint for the member list"""
+    def render_row(member):
+        start_date = member.membership_start_date
+        return [
+            escape(member.full_name),
+            escape(member.email),
+            escape(member.phone or '-'),
+            escape(member.age if member.age is not None else '-'),
+            start_date.strftime('%b %d, %Y') if start_date else '-',
+            _status_badge(member.is_active),
+            format_html(
+                '<a class="btn btn-sm btn-info" href="{}">Edit</a> '
+                '<a class="btn btn-sm btn-danger" href="{}" '
+                'onclick="return confirm(\'Are you sure you want to delete this member?\');">Delete</a>',
+                reverse('admin-members-edit', args=[member.id]),
+                reverse('admin-members-delete', args=[member.id]),
+            ),
+        ]
+
+    return datatables_response(
+        request,
+        User.objects.filter(role='Member'),
+        order_columns={0: ['first_name', 'last_name'], 1: ['email']},
+        default_ordering=['-created_at'],
+        search_fields=MEMBER_SEARCH_FIELDS,
+        render_row=render_row,
+        filters={'status': _filter_active_status},
+    )
+
+
+@login_required
+@admin_required
+def member_list_export(request):
+    """Stream the member list as CSV, with the list's filters and search applied"""
+    members, _ = filter_queryset(
+        request.GET,
+        User.objects.filter(role='Member'),
+        {'status': _filter_active_status},
+        MEMBER_SEARCH_FIELDS,
+    )
+    rows = members.order_by('-created_at', '-id').values_list(
+        'id', 'username', 'first_name', 'last_name', 'email', 'phone', 'gender', 'age',
+        'height', 'weight', 'fitness_goal', 'membership_start_date', 'is_active', 'created_at',
+        'progress__latest_weight', 'progress__ema_7', 'progress__slope', 'progress__goal_eta',
+    )
+
+    def lines():
+        for row in stream_rows(rows):
+            *fields, is_active, created_at, latest_weight, ema_7, slope, goal_eta = row
+            yield [
+                *fields,
+                'Active' if is_active else 'Inactive',
+                timezone.localtime(created_at).strftime('%Y-%m-%d %H:%M:%S'),
+                round(latest_weight, 2) if latest_weight is not None else None,
+                round(ema_7, 2) if ema_7 is not None else None,
+                round(slope * 7, 2) if slope is not None else None,
+                goal_eta,
+            ]
+
+    return csv_response(
+        f'members-{timezone.localdate().isoformat()}.csv',
+        ['ID', 'Username', 'First Name', 'Last Name', 'Email', 'Phone', 'Gender', 'Age',
+         'Height (cm)', 'Weight (kg)', 'Fitness Goal', 'Membership Start', 'Status', 'Joined',
+         'Latest Logged Weight (kg)', '7-Day Average (kg)', 'Trend (kg/week)', 'Goal ETA'],
+        lines(),
+    )
 
 
 @login_required
@@ -830,93 +945,201 @@ def member_delete(request, member_id):
 @login_required
 def admin_reports(request):
     today = date.today()
+    kpis = get_admin_kpis()
 
-    total_users = User.objects.count()
-    active_members = User.objects.filter(role='Member', is_active=True).count()
-    total_trainers = User.objects.filter(role='Trainer', is_active=True).count()
-    active_subscriptions = MemberSubscription.objects.filter(is_active=True).count()
-    expired_subscriptions = MemberSubscription.objects.filter(is_active=False).count()
-    total_classes = PrivateClass.objects.count()
-    active_sessions_today = PrivateClass.objects.filter(start_date=today, is_active=True).count()
-    upcoming_classes = PrivateClass.objects.filter(start_date__gte=today, start_date__lte=today + timedelta(days=7))
-    total_revenue = Payment.objects.filter(payment_status='Completed').aggregate(total=Sum('amount'))['total'] or 0
-    pending_payments = Payment.objects.filter(payment_status='Pending').count()
-    failed_payments = Payment.objects.filter(payment_status='Failed').count()
+    upcoming_classes = ClassOccurrence.objects.filter(date__gte=today, date__lte=today + timedelta(days=7))
     recent_bookings = PrivateClass.objects.select_related('member', 'trainer').order_by('-created_at')[:5]
-    recent_payments = Payment.objects.select_related('member_subscription__member', 'private_class').order_by('-payment_date')[:5]
+    recent_payments = Payment.objects.select_related('member_subscription__member', 'private_class__member').order_by('-payment_date')[:5]
+    # Whole gym unless a trainer is picked
+    heatmap_trainer = _chart_int(request.GET, 'heatmap_trainer', utilization.GYM, 0, 2 ** 31 - 1)
 
     context = {
+        **kpis,
         'today': today,
-        'total_users': total_users,
-        'active_members': active_members,
-        'total_trainers': total_trainers,
-        'active_subscriptions': active_subscriptions,
-        'expired_subscriptions': expired_subscriptions,
-        'total_classes': total_classes,
-        'active_sessions_today': active_sessions_today,
+        'trend_start': today - timedelta(days=29),
         'upcoming_classes': upcoming_classes,
-        'total_revenue': total_revenue,
-        'pending_payments': pending_payments,
-        'failed_payments': failed_payments,
         'recent_bookings': recent_bookings,
         'recent_payments': recent_payments,
+        'plans': MembershipPlan.objects.order_by('plan_name'),
+        'trainers': User.objects.filter(role='Trainer').order_by('first_name', 'last_name'),
+        'heatmap_trainer': heatmap_trainer,
+        'heatmap': utilization.heatmap_context(heatmap_trainer, today),
     }
 
     return render(request, 'admin/admin_reports.html', context)
 
 
+# Longest range the daily chart will return; longer ranges should use group=month
+MAX_TIMESERIES_DAYS = 731
+
+
+def _report_date(value, default):
+    try:
+        return date.fromisoformat(value) if value else default
+    except ValueError:
+        return default
+
+
+def _report_range(params):
+    """(start, end, group, error) for a report chart request"""
+    group = 'month' if params.get('group') == 'month' else 'day'
+    end = _report_date(params.get('end'), timezone.localdate())
+    start = _report_date(params.get('start'), end - timedelta(days=29))
+    if start > end:
+        return start, end, group, 'Start date must be before end date.'
+    if group == 'day' and (end - start).days >= MAX_TIMESERIES_DAYS:
+        return start, end, group, f'Daily charts cover at most {MAX_TIMESERIES_DAYS} days; group by month.'
+    if (end - start).days >= MAX_TIMESERIES_DAYS * 10:
+        return start, end, group, 'Choose a shorter date range.'
+    return start, end, group, None
+
+
+@admin_required
+@login_required
+def admin_reports_timeseries(request):
+    """Daily or monthly revenue and activity from the rollup tables, as JSON"""
+    start, end, group, error = _report_range(request.GET)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    source = source_id = None
+    for name in ('plan', 'trainer'):
+        value = request.GET.get(name, '')
+        if value.isdigit():
+            source, source_id = name, int(value)
+            break
+
+    data = rollups.timeseries(start, end, group, source, source_id)
+    return JsonResponse({'start': start.isoformat(), 'end': end.isoformat(), 'group': group, **data})
+
+
+@admin_required
+@login_required
+def admin_reports_coverage(request):
+    """Members covered and recognized / deferred subscription revenue, as JSON"""
+    start, end, group, error = _report_range(request.GET)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    data = coverage.coverage_report(start, end, group)
+    return JsonResponse({'start': start.isoformat(), 'end': end.isoformat(), 'group': group, **data})
+
+
 # =========================
-# Admin Reports PDF (xhtml2pdf)
+# Cohort Analytics
 # =========================
 @login_required
-@admin_required
-def admin_reports_pdf(request):
+def cohort_analytics_page(request):
+    """Cohort progress charts: admins pick any cohort, trainers see their own members"""
+    if not is_admin(request.user) and request.user.role != 'Trainer':
+        return redirect('user-dashboard')
+
+    context = {'is_admin': is_admin(request.user)}
+    if context['is_admin']:
+        context.update({
+            'trainers': User.objects.filter(role='Trainer').order_by('first_name', 'last_name'),
+            'plans': MembershipPlan.objects.order_by('plan_name'),
+            'signup_months': User.objects.filter(role='Member').dates('created_at', 'month', order='DESC'),
+        })
+    return render(request, 'admin/cohort_analytics.html', context)
+
+
+@login_required
+def cohort_analytics_data(request):
+    """JSON curves for ?kind=all|trainer|plan|signup&value=...&weeks=N"""
+    if is_admin(request.user):
+        kind = request.GET.get('kind', 'all')
+        value = request.GET.get('value', '')
+    elif request.user.role == 'Trainer':
+        kind, value = 'trainer', str(request.user.id)
+    else:
+        return JsonResponse({'error': 'Not allowed.'}, status=403)
+
+    weeks = _chart_int(request.GET, 'weeks', cohorts.DEFAULT_WEEKS, 1, cohorts.MAX_WEEKS)
+    try:
+        data = cohorts.cohort_analytics(kind, value, weeks)
+    except cohorts.CohortError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(data)
+
+
+# =========================
+# Admin Reports PDF (xhtml2pdf)
+# =========================
+def _admin_report_html():
+    """Render the report HTML; `now` is when the KPIs were computed so the
+    same data always renders (and hashes) the same"""
     today = date.today()
-    now = datetime.now()
-
-    # Queries
-    total_users = User.objects.count()
-    active_members = User.objects.filter(role='Member', is_active=True).count()
-    total_trainers = User.objects.filter(role='Trainer', is_active=True).count()
-    active_subscriptions = MemberSubscription.objects.filter(is_active=True).count()
-    expired_subscriptions = MemberSubscription.objects.filter(is_active=False).count()
-    total_classes = PrivateClass.objects.count()
-    active_sessions_today = PrivateClass.objects.filter(start_date=today, is_active=True).count()
-    upcoming_classes = PrivateClass.objects.filter(start_date__gte=today, start_date__lte=today + timedelta(days=7))
-    total_revenue = Payment.objects.filter(payment_status__iexact='Completed').aggregate(total=Sum('amount'))['total'] or 0
-    pending_payments = Payment.objects.filter(payment_status__iexact='Pending').count()
-    failed_payments = Payment.objects.filter(payment_status__iexact='Failed').count()
+    kpis = get_admin_kpis()
+
+    upcoming_classes = ClassOccurrence.objects.filter(date__gte=today, date__lte=today + timedelta(days=7))
     recent_bookings = PrivateClass.objects.select_related('member', 'trainer').order_by('-created_at')[:5]
-    recent_payments = Payment.objects.select_related('member_subscription__member', 'private_class').order_by('-payment_date')[:5]
+    recent_payments = Payment.objects.select_related('member_subscription__member', 'private_class__member').order_by('-payment_date')[:5]
 
     context = {
+        **kpis,
         'today': today,
-        'now': now,
-        'total_users': total_users,
-        'active_members': active_members,
-        'total_trainers': total_trainers,
-        'active_subscriptions': active_subscriptions,
-        'expired_subscriptions': expired_subscriptions,
-        'total_classes': total_classes,
-        'active_sessions_today': active_sessions_today,
+        'now': kpis['generated_at'],
         'upcoming_classes': upcoming_classes,
-        'total_revenue': total_revenue,
-        'pending_payments': pending_payments,
-        'failed_payments': failed_payments,
         'recent_bookings': recent_bookings,
         'recent_payments': recent_payments,
     }
 
-    html_string = render_to_string('admin/admin_reports_pdf.html', context)
+    return render_to_string('admin/admin_reports_pdf.html', context)
+
+
+def _report_job_json(job, job_status):
+    return JsonResponse({
+        'job': job,
+        'status': job_status,
+        'status_url': reverse('admin-reports-pdf-status', args=[job]),
+        'download_url': reverse('admin-reports-pdf-download', args=[job]),
+    })
+
+
+@login_required
+@admin_required
+def admin_reports_pdf(request):
+    """
+    Serve the current report PDF if it has been generated, otherwise queue it
+    and send the admin back to the reports page
+    """
+    job, job_status = pdf_reports.submit(_admin_report_html())
+    if job_status == 'ready':
+        return admin_reports_pdf_download(request, job)
+
+    messages.info(request, "The PDF report is being generated. Try the download again in a few seconds.")
+    return redirect('admin-reports')
+
+
+@login_required
+@admin_required
+@require_POST
+def admin_reports_pdf_job(request):
+    """Start (or reuse) the PDF job for the current report data"""
+    job, job_status = pdf_reports.submit(_admin_report_html())
+    return _report_job_json(job, job_status)
+
 
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="admin_report.pdf"'
+@login_required
+@admin_required
+def admin_reports_pdf_status(request, job):
+    if not pdf_reports.is_valid_job(job):
+        raise Http404
+    return _report_job_json(job, pdf_reports.status(job))
 
-    pisa_status = pisa.CreatePDF(html_string, dest=response)
-    if pisa_status.err:
-        return HttpResponse('Error generating PDF <pre>' + html_string + '</pre>')
 
-    return response
+@login_required
+@admin_required
+def admin_reports_pdf_download(request, job):
+    if not pdf_reports.is_valid_job(job):
+        raise Http404
+    path = pdf_reports.report_path(job)
+    try:
+        report = open(path, 'rb')
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(report, as_attachment=True, filename='admin_report.pdf', content_type='application/pdf')
 
 
 # ==========================================
@@ -933,10 +1156,12 @@ def track_progress(request):
     
     # Get weight logs for the last 90 days
     ninety_days_ago = today - timedelta(days=90)
-    weight_logs = WeightLog.objects.filter(
+    # BMI comes from the same query, and the list is loaded once for the
+    # table and the stats below
+    weight_logs = list(WeightLog.objects.filter(
         user=user,
         date__gte=ninety_days_ago
-    ).order_by('date')
+    ).with_bmi().order_by('date'))
     
     # Calculate stats
     stats = {
@@ -946,9 +1171,9 @@ def track_progress(request):
         'weight_change': None,
     }
     
-    if weight_logs.exists():
-        first_log = weight_logs.first()
-        latest_log = weight_logs.last()
+    if weight_logs:
+        first_log = weight_logs[0]
+        latest_log = weight_logs[-1]
         
         stats['first_weight'] = first_log.weight
         stats['latest_weight'] = latest_log.weight
@@ -958,12 +1183,31 @@ def track_progress(request):
     context = {
         'weight_logs': weight_logs,
         'stats': stats,
+        'progress': progress.for_user(user),
         'today': today,
     }
     
     return render(request, 'user/track_progress.html', context)
 
 
+@login_required
+def weight_log_export(request):
+    """Stream the logged-in user's full weight history as CSV"""
+    rows = WeightLog.objects.filter(user=request.user).with_bmi().order_by('date').values_list(
+        'date', 'weight', 'bmi_value', 'notes'
+    )
+
+    def lines():
+        for log_date, weight, bmi, notes in stream_rows(rows):
+            yield [log_date.isoformat(), weight, round(bmi, 1) if bmi is not None else None, notes]
+
+    return csv_response(
+        f'weight-log-{timezone.localdate().isoformat()}.csv',
+        ['Date', 'Weight (kg)', 'BMI', 'Notes'],
+        lines(),
+    )
+
+
 @login_required
 def log_weight(request):
     """
@@ -999,6 +1243,36 @@ def log_weight(request):
     return redirect('track-progress')
 
 
+@login_required
+@require_POST
+def sync_weight_logs(request):
+    """
+    Bulk add/update weight logs from a JSON body:
+    {"entries": [{"date": "2025-01-31", "weight": 72.4, "notes": ""}, ...]}
+
+    Returns a result per entry: created, updated, superseded (a later entry
+    in the same batch had the same date) or error.
+    """
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Body must be valid JSON.'}, status=400)
+
+    entries = payload.get('entries') if isinstance(payload, dict) else None
+    if not isinstance(entries, list):
+        return JsonResponse({'error': 'Expected an "entries" list.'}, status=400)
+    if len(entries) > weight_import.max_entries():
+        return JsonResponse({'error': f'At most {weight_import.max_entries()} entries per request.'}, status=400)
+
+    results = weight_import.import_weight_logs(request.user, entries)
+
+    summary = {status: 0 for status in ('created', 'updated', 'superseded', 'error')}
+    for result in results:
+        summary[result['status']] += 1
+
+    return JsonResponse({**summary, 'results': results})
+
+
 @login_required
 def delete_weight_log(request, log_id):
     """
@@ -1010,23 +1284,87 @@ def delete_weight_log(request, log_id):
     return redirect('track-progress')
 
 
+CHART_MAX_DAYS = 3650
+CHART_DEFAULT_POINTS = 200
+CHART_MAX_POINTS = 1000
+CHART_BUCKETS = {
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _chart_int(params, name, default, low, high):
+    try:
+        value = int(params.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    return max(low, min(value, high))
+
+
+def _weight_log_version(request):
+    """(last change, log count) for the user's weight logs, computed once per request"""
+    if not hasattr(request, '_weight_log_version'):
+        request._weight_log_version = WeightLog.objects.filter(user=request.user).aggregate(
+            last_modified=Max('updated_at'),
+            count=Count('id'),
+        )
+    return request._weight_log_version
+
+
+def _weight_chart_etag(request):
+    version = _weight_log_version(request)
+    if version['last_modified'] is None:
+        return None
+    # The window is relative to today, so the date is part of the version too
+    return '"{}-{}-{}-{}"'.format(
+        version['last_modified'].timestamp(),
+        version['count'],
+        date.today().isoformat(),
+        request.GET.urlencode(),
+    )
+
+
+def _weight_chart_last_modified(request):
+    return _weight_log_version(request)['last_modified']
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_weight_chart_etag, last_modified_func=_weight_chart_last_modified)
 def weight_chart_data(request):
     """
     API endpoint for chart data (JSON)
+
+    days: window size, capped at CHART_MAX_DAYS
+    bucket: day (raw logs), week or month (averages computed in SQL)
+    points: maximum number of points returned, reached with LTTB downsampling
     """
-    days = int(request.GET.get('days', 30))
-    today = date.today()
-    start_date = today - timedelta(days=days)
-    
-    weight_logs = WeightLog.objects.filter(
-        user=request.user,
-        date__gte=start_date
-    ).order_by('date')
-    
+    days = _chart_int(request.GET, 'days', 30, 1, CHART_MAX_DAYS)
+    points = _chart_int(request.GET, 'points', CHART_DEFAULT_POINTS, 3, CHART_MAX_POINTS)
+    bucket = request.GET.get('bucket', 'day')
+    if bucket not in CHART_BUCKETS:
+        bucket = 'day'
+
+    start_date = date.today() - timedelta(days=days)
+    weight_logs = WeightLog.objects.filter(user=request.user, date__gte=start_date)
+
+    if bucket == 'day':
+        rows = weight_logs.order_by('date').values_list('date', 'weight')
+    else:
+        rows = weight_logs.annotate(
+            period=CHART_BUCKETS[bucket]('date')
+        ).values('period').annotate(
+            average=Avg('weight')
+        ).order_by('period').values_list('period', 'average')
+
+    series = lttb([(day.toordinal(), float(weight)) for day, weight in rows], points)
+    label_format = '%b %Y' if bucket == 'month' else '%b %d'
+
     data = {
-        'labels': [log.date.strftime('%b %d') for log in weight_logs],
-        'weights': [float(log.weight) for log in weight_logs],
+        'bucket': bucket,
+        'labels': [date.fromordinal(x).strftime(label_format) for x, _ in series],
+        'dates': [date.fromordinal(x).isoformat() for x, _ in series],
+        'weights': [round(y, 2) for _, y in series],
     }
-    
-    return JsonResponse(data)
\ No newline at end of file
+
+    return JsonResponse(data)
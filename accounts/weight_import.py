@@ -0,0 +1,106 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+from .models import WeightLog
+from . import progress
+
+# Bulk weight log ingestion for scale / phone app syncs.
+#
+# A sync sends a list of {"date", "weight", "notes"} entries. The whole batch
+# is validated first, then the existing dates are looked up in one query and
+# everything is written with INSERT ... ON CONFLICT (user, date) DO UPDATE in
+# batches, instead of one update_or_create round trip per entry. The progress
+# summary is rebuilt once per batch.
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_BATCH_SIZE = 500
+MAX_WEIGHT = Decimal('999.99')  # WeightLog.weight is max_digits=5, decimal_places=2
+
+
+def max_entries():
+    return getattr(settings, 'WEIGHT_SYNC_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+
+def _validate(entry, today):
+    """Return (date, weight, notes, errors) for one raw entry"""
+    errors = []
+    if not isinstance(entry, dict):
+        return None, None, '', ['Entry must be an object.']
+
+    log_date = None
+    try:
+        log_date = date.fromisoformat(str(entry.get('date', '')))
+        if log_date > today:
+            errors.append('Date cannot be in the future.')
+    except ValueError:
+        errors.append('Date must be YYYY-MM-DD.')
+
+    weight = None
+    try:
+        weight = Decimal(str(entry.get('weight'))).quantize(Decimal('0.01'))
+        if not weight.is_finite() or weight <= 0 or weight > MAX_WEIGHT:
+            errors.append(f'Weight must be between 0 and {MAX_WEIGHT} kg.')
+    except (InvalidOperation, ValueError):
+        errors.append('Weight must be a number.')
+
+    notes = entry.get('notes') or ''
+    if not isinstance(notes, str):
+        errors.append('Notes must be text.')
+        notes = ''
+
+    return log_date, weight, notes, errors
+
+
+def import_weight_logs(user, entries, today=None):
+    """
+    Validate and upsert `entries` for `user`.
+    Returns one result dict per entry, in the order they were sent.
+    """
+    today = today or date.today()
+    results = []
+    valid = {}  # date -> index of the entry that will be written
+
+    for index, entry in enumerate(entries):
+        log_date, weight, notes, errors = _validate(entry, today)
+        if errors:
+            results.append({'index': index, 'status': 'error', 'errors': errors})
+            continue
+
+        # A later reading for the same day replaces an earlier one in the batch
+        if log_date in valid:
+            results[valid[log_date]]['status'] = 'superseded'
+        valid[log_date] = index
+        results.append({
+            'index': index,
+            'status': None,
+            'date': log_date.isoformat(),
+            'weight': str(weight),
+            'notes': notes,
+        })
+
+    if not valid:
+        return results
+
+    existing = set(WeightLog.objects.filter(user=user, date__in=list(valid)).values_list('date', flat=True))
+
+    logs = []
+    for log_date, index in valid.items():
+        result = results[index]
+        logs.append(WeightLog(user=user, date=log_date, weight=Decimal(result['weight']), notes=result.pop('notes')))
+        result['status'] = 'updated' if log_date in existing else 'created'
+
+    WeightLog.objects.bulk_create(
+        logs,
+        batch_size=getattr(settings, 'WEIGHT_SYNC_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        update_conflicts=True,
+        unique_fields=['user', 'date'],
+        update_fields=['weight', 'notes', 'updated_at'],
+    )
+    # bulk_create sends no post_save, so refresh the progress summary here
+    progress.rebuild(user)
+
+    for result in results:
+        result.pop('notes', None)
+    return results
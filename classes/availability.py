@@ -0,0 +1,158 @@
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ClassOccurrence
+
+# Trainer availability index.
+#
+# A PrivateClass meets every day from start_date until end_date at the same
+# time, so a trainer with long bookings has hundreds of busy intervals. The
+# index reads them from the materialized ClassOccurrence rows, turns them into
+# minute offsets, merges overlaps into disjoint sorted intervals and keeps the
+# result in the cache, so a booking check is a binary search per requested
+# session instead of a database query plus a Python loop. Any PrivateClass
+# change bumps the version key (see signals.py), which retires every cached
+# index at once.
+
+MINUTES_PER_DAY = 24 * 60
+CACHE_TIMEOUT = 60 * 60
+VERSION_KEY = 'trainer_availability_version'
+
+
+def _to_minutes(value):
+    """Minutes since 0001-01-01 00:00 for a datetime"""
+    return value.date().toordinal() * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+
+def _from_minutes(minutes):
+    day, minute_of_day = divmod(minutes, MINUTES_PER_DAY)
+    return datetime.combine(date.fromordinal(day), time(minute_of_day // 60, minute_of_day % 60))
+
+
+def gym_hours():
+    """Opening and closing hour used to bound free-slot searches"""
+    return getattr(settings, 'GYM_OPEN_HOUR', 6), getattr(settings, 'GYM_CLOSE_HOUR', 22)
+
+
+class TrainerAvailability:
+    def __init__(self, trainer_id, intervals):
+        self.trainer_id = trainer_id
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def build(cls, trainer_id, since=None, until=None):
+        """Load the trainer's busy intervals from `since` on (through `until`, if given)"""
+        since = since or date.today()
+        # Start a day early so sessions running past midnight into `since` count
+        rows = ClassOccurrence.objects.filter(trainer_id=trainer_id, date__gte=since - timedelta(days=1))
+        if until:
+            rows = rows.filter(date__lte=until)
+        rows = rows.values_list('date', 'start_time', 'end_time')
+
+        intervals = []
+        for day, start_time, end_time in rows:
+            start = _to_minutes(datetime.combine(day, start_time))
+            # end_time wraps past midnight for late sessions
+            length = (end_time.hour * 60 + end_time.minute - start_time.hour * 60 - start_time.minute) % MINUTES_PER_DAY
+            intervals.append((start, start + length))
+        return cls(trainer_id, intervals)
+
+    @classmethod
+    def for_trainer(cls, trainer_id):
+        """Cached index for the trainer, rebuilt after any PrivateClass change"""
+        version = cache.get_or_set(VERSION_KEY, _new_version, None)
+        key = f'trainer_availability:{version}:{trainer_id}:{date.today().isoformat()}'
+        index = cache.get(key)
+        if index is None:
+            index = cls.build(trainer_id)
+            cache.set(key, index, CACHE_TIMEOUT)
+        return index
+
+    def conflict(self, start, end):
+        """First busy interval overlapping [start, end) in minutes, or None"""
+        i = bisect_right(self.ends, start)
+        if i < len(self.starts) and self.starts[i] < end:
+            return self.starts[i], self.ends[i]
+        return None
+
+    def booking_conflict(self, start_date, start_time, duration_hours, duration_months):
+        """
+        Check every session of a prospective booking against the index.
+        Returns the first clash as (start, end) datetimes, or None if free.
+        """
+        end_date = start_date + relativedelta(months=duration_months)
+        start = _to_minutes(datetime.combine(start_date, start_time))
+        length = duration_hours * 60
+        for _ in range((end_date - start_date).days):
+            clash = self.conflict(start, start + length)
+            if clash:
+                return _from_minutes(clash[0]), _from_minutes(clash[1])
+            start += MINUTES_PER_DAY
+        return None
+
+    def free_slots(self, day, min_hours=1):
+        """Free (start, end) datetimes on `day` within gym hours, at least min_hours long"""
+        open_hour, close_hour = gym_hours()
+        day_start = day.toordinal() * MINUTES_PER_DAY
+        cursor = day_start + open_hour * 60
+        closing = day_start + close_hour * 60
+
+        slots = []
+        i = bisect_right(self.ends, cursor)
+        while cursor < closing:
+            if i < len(self.starts) and self.starts[i] < closing:
+                busy_start, busy_end = self.starts[i], self.ends[i]
+                i += 1
+            else:
+                busy_start, busy_end = closing, closing
+            if busy_start - cursor >= min_hours * 60:
+                slots.append((_from_minutes(cursor), _from_minutes(busy_start)))
+            cursor = max(cursor, busy_end)
+        return slots
+
+    def free_slots_for_week(self, day, min_hours=1):
+        """Free slots for each day of the Monday-to-Sunday week containing `day`"""
+        week_start = day - timedelta(days=day.weekday())
+        return [
+            (week_start + timedelta(days=offset), self.free_slots(week_start + timedelta(days=offset), min_hours))
+            for offset in range(7)
+        ]
+
+
+def booking_conflict(trainer_id, start_date, start_time, duration_hours, duration_months):
+    """
+    First clash for a booking about to be accepted, as (start, end) datetimes,
+    or None. The cached index lives in one process and can miss a booking
+    another worker just saved, so it only answers "busy" quickly; "free" is
+    confirmed against ClassOccurrence for the booking's span.
+    """
+    clash = TrainerAvailability.for_trainer(trainer_id).booking_conflict(
+        start_date, start_time, duration_hours, duration_months
+    )
+    if clash is None:
+        end_date = start_date + relativedelta(months=duration_months)
+        clash = TrainerAvailability.build(trainer_id, since=start_date, until=end_date).booking_conflict(
+            start_date, start_time, duration_hours, duration_months
+        )
+    return clash
+
+
+def _new_version():
+    return int(datetime.now().timestamp() * 1000)
+
+
+def invalidate_availability():
+    # A fresh timestamp rather than incr() so an evicted version key can never
+    # come back as a value an older cached index was stored under
+    cache.set(VERSION_KEY, _new_version(), None)
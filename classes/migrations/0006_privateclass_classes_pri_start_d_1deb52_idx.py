@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0005_privateclass_is_active_alter_privateclass_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='privateclass',
+            index=models.Index(fields=['start_date', 'start_time'], name='classes_pri_start_d_1deb52_idx'),
+        ),
+    ]
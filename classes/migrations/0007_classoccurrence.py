@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0006_privateclass_classes_pri_start_d_1deb52_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='member_occurrences', to=settings.AUTH_USER_MODEL)),
+                ('private_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='classes.privateclass')),
+                ('trainer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trainer_occurrences', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['date', 'start_time'],
+                'indexes': [models.Index(fields=['trainer', 'date'], name='classes_cla_trainer_b9db8e_idx'), models.Index(fields=['member', 'date'], name='classes_cla_member__78a5f9_idx'), models.Index(fields=['date'], name='classes_cla_date_058fc1_idx')],
+                'unique_together': {('private_class', 'date')},
+            },
+        ),
+    ]
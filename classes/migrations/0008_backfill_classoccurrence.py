@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def backfill_occurrences(apps, schema_editor):
+    PrivateClass = apps.get_model('classes', 'PrivateClass')
+    ClassOccurrence = apps.get_model('classes', 'ClassOccurrence')
+
+    batch = []
+    for private_class in PrivateClass.objects.filter(is_active=True).iterator(chunk_size=BATCH_SIZE):
+        end_time = (
+            datetime.combine(private_class.start_date, private_class.start_time)
+            + timedelta(hours=private_class.duration_hours)
+        ).time()
+        end_date = private_class.start_date + relativedelta(months=private_class.duration_months)
+
+        day = private_class.start_date
+        while day < end_date:
+            batch.append(ClassOccurrence(
+                private_class_id=private_class.id,
+                trainer_id=private_class.trainer_id,
+                member_id=private_class.member_id,
+                date=day,
+                start_time=private_class.start_time,
+                end_time=end_time,
+            ))
+            day += timedelta(days=1)
+
+            if len(batch) >= BATCH_SIZE:
+                ClassOccurrence.objects.bulk_create(batch)
+                batch = []
+
+    if batch:
+        ClassOccurrence.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0007_classoccurrence'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_occurrences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0008_backfill_classoccurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('trainer_id', models.PositiveIntegerField(default=0)),
+                ('minutes', models.PositiveIntegerField(default=0)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('trainer_id', 'date', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_hourly_bookings(apps, schema_editor):
+    ClassOccurrence = apps.get_model('classes', 'ClassOccurrence')
+    HourlyBooking = apps.get_model('classes', 'HourlyBooking')
+
+    totals = defaultdict(lambda: [0, 0])
+    slots = ClassOccurrence.objects.values_list('date', 'start_time', 'end_time', 'trainer_id').annotate(
+        count=Count('id')
+    ).order_by()
+    for day, start_time, end_time, trainer_id, count in slots.iterator(chunk_size=BATCH_SIZE):
+        start = datetime.combine(day, start_time)
+        minutes = ((end_time.hour * 60 + end_time.minute) - (start_time.hour * 60 + start_time.minute)) % (24 * 60)
+        end = start + timedelta(minutes=minutes)
+        hour_start = start.replace(minute=0, second=0, microsecond=0)
+        while hour_start < end:
+            hour_end = hour_start + timedelta(hours=1)
+            overlap = (min(end, hour_end) - max(start, hour_start)).seconds // 60
+            if overlap:
+                for scope in {0, trainer_id or 0}:
+                    entry = totals[(scope, hour_start.date(), hour_start.hour)]
+                    entry[0] += overlap * count
+                    entry[1] += count
+            hour_start = hour_end
+
+    HourlyBooking.objects.bulk_create(
+        [
+            HourlyBooking(trainer_id=scope, date=day, hour=hour, minutes=minutes, sessions=sessions)
+            for (scope, day, hour), (minutes, sessions) in totals.items()
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0009_hourlybooking'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_hourly_bookings, migrations.RunPython.noop),
+    ]
@@ -30,6 +30,11 @@ class PrivateClass(models.Model):
     # New field
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_date', 'start_time']),
+        ]
+
     def __str__(self):
         return f"{self.member} - {self.trainer} ({self.start_date} {self.start_time} for {self.duration_hours}h, {self.duration_months} months)"
 
@@ -43,6 +48,14 @@ class PrivateClass(models.Model):
     def end_date(self):
         return self.start_date + relativedelta(months=self.duration_months)
 
+    def session_dates(self):
+        """Every day the class meets: daily from start_date until end_date (exclusive)"""
+        day = self.start_date
+        end = self.end_date
+        while day < end:
+            yield day
+            day += timedelta(days=1)
+
     def calculate_price(self):
         base_rate_per_hour = 500
         experience_multiplier = 1.0
@@ -57,3 +70,55 @@ class PrivateClass(models.Model):
         if self.price is None and self.trainer is not None:
             self.price = self.calculate_price()
         super().save(*args, **kwargs)
+
+
+class ClassOccurrence(models.Model):
+    """
+    One scheduled session of a PrivateClass. Kept in sync with the class by
+    classes.occurrences.sync_occurrences so schedule questions ("today",
+    "next 7 days") are a single indexed range scan.
+    """
+    private_class = models.ForeignKey(PrivateClass, on_delete=models.CASCADE, related_name='occurrences')
+    trainer = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='trainer_occurrences'
+    )
+    member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='member_occurrences')
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        ordering = ['date', 'start_time']
+        unique_together = ['private_class', 'date']
+        indexes = [
+            models.Index(fields=['trainer', 'date']),
+            models.Index(fields=['member', 'date']),
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"{self.private_class_id} on {self.date} {self.start_time}-{self.end_time}"
+
+
+class HourlyBooking(models.Model):
+    """
+    Booked private class time per clock hour, per trainer and for the whole
+    gym (trainer_id 0). Maintained from occurrence syncs by
+    classes.utilization; heatmaps read these instead of the occurrences.
+    trainer_id is a plain id so rows outlive a deleted trainer.
+    """
+    date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    trainer_id = models.PositiveIntegerField(default=0)
+    minutes = models.PositiveIntegerField(default=0)
+    sessions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['trainer_id', 'date', 'hour']
+
+    def __str__(self):
+        return f"{self.date} {self.hour:02d}:00 trainer {self.trainer_id or 'all'}: {self.minutes} min"
@@ -0,0 +1,66 @@
+from .models import ClassOccurrence
+from . import utilization
+
+# Keeps the materialized ClassOccurrence rows of a PrivateClass in step with
+# the class itself. Called from the post_save signal, so creating, editing in
+# admin_private_class_edit, toggling and cancelling all go through here.
+# The hourly utilization rollups are moved along with the occurrences.
+
+BATCH_SIZE = 500
+
+
+def sync_occurrences(private_class):
+    """
+    Incrementally bring the class's occurrence rows up to date: drop days no
+    longer in the schedule, fix up changed times/trainer, add missing days.
+    Inactive classes have no occurrences.
+    """
+    existing = ClassOccurrence.objects.filter(private_class=private_class)
+    before = utilization.occurrence_rows(existing)
+
+    if not private_class.is_active:
+        existing.delete()
+        utilization.apply(before, [])
+        return
+
+    wanted = set(private_class.session_dates())
+    have = {row[0] for row in before}
+
+    stale = have - wanted
+    if stale:
+        existing.filter(date__in=stale).delete()
+
+    existing.exclude(
+        trainer_id=private_class.trainer_id,
+        member_id=private_class.member_id,
+        start_time=private_class.start_time,
+        end_time=private_class.end_time,
+    ).update(
+        trainer_id=private_class.trainer_id,
+        member_id=private_class.member_id,
+        start_time=private_class.start_time,
+        end_time=private_class.end_time,
+    )
+
+    missing = sorted(wanted - have)
+    if missing:
+        ClassOccurrence.objects.bulk_create(
+            [
+                ClassOccurrence(
+                    private_class=private_class,
+                    trainer_id=private_class.trainer_id,
+                    member_id=private_class.member_id,
+                    date=day,
+                    start_time=private_class.start_time,
+                    end_time=private_class.end_time,
+                )
+                for day in missing
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+    end_time = private_class.end_time
+    utilization.apply(before, [
+        (day, private_class.start_time, end_time, private_class.trainer_id, 1)
+        for day in sorted(wanted)
+    ])
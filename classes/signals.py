@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .availability import invalidate_availability
+from .models import PrivateClass
+from .occurrences import sync_occurrences
+from . import utilization
+
+
+@receiver(post_save, sender=PrivateClass)
+def sync_occurrences_on_save(sender, instance, **kwargs):
+    sync_occurrences(instance)
+
+
+@receiver(post_save, sender=PrivateClass)
+@receiver(post_delete, sender=PrivateClass)
+def invalidate_availability_on_change(sender, **kwargs):
+    invalidate_availability()
+
+
+@receiver(pre_delete, sender=PrivateClass)
+def remove_utilization_on_delete(sender, instance, **kwargs):
+    # The occurrences go with the class (CASCADE) without another sync
+    utilization.apply(utilization.occurrence_rows(instance.occurrences.all()), [])
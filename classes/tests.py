@@ -1,3 +1,72 @@
+from datetime import date, time, timedelta
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import User
+from .availability import TrainerAvailability
+from .models import PrivateClass
+
+
+class BookingAvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.trainer = User.objects.create_user(username='trainer', password='pass', role='Trainer')
+        self.member = User.objects.create_user(username='member', password='pass', role='Member')
+        self.start = date.today() + timedelta(days=7)
+        self.client.force_login(self.member)
+
+    def book(self, **overrides):
+        data = {
+            'start_date': self.start.isoformat(),
+            'start_time': '07:00',
+            'duration_hours': 1,
+            'duration_months': 1,
+            'demo_payment': 'true',
+        }
+        data.update(overrides)
+        return self.client.post(reverse('book-private-class-details', args=[self.trainer.id]), data)
+
+    def test_booking_is_rechecked_against_the_database(self):
+        # This process's cached index says the trainer is free...
+        self.assertIsNone(TrainerAvailability.for_trainer(self.trainer.id).booking_conflict(self.start, time(7), 1, 1))
+        # ...but another worker booked the slot, bumping only its own cache
+        other = User.objects.create_user(username='other', password='pass', role='Member')
+        with mock.patch('classes.signals.invalidate_availability'):
+            PrivateClass.objects.create(
+                member=other, trainer=self.trainer, start_date=self.start, start_time=time(7),
+                duration_hours=1, duration_months=1, price=500,
+            )
+
+        response = self.book()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(PrivateClass.objects.filter(member=self.member).exists())
+
+    def test_free_slot_is_booked(self):
+        response = self.book()
+
+        self.assertRedirects(response, reverse('my-booked-sessions'), fetch_redirect_response=False)
+        self.assertTrue(PrivateClass.objects.filter(member=self.member).exists())
+
+    def test_invalid_durations_rerender_the_form(self):
+        for overrides in ({'duration_months': 13}, {'duration_months': 'x'}, {'duration_hours': 4}, {'duration_hours': ''}):
+            response = self.book(**overrides)
+
+            self.assertEqual(response.status_code, 200, overrides)
+            self.assertContains(response, "Choose 1 to 3 hours a day for 1 to 12 months.")
+        self.assertFalse(PrivateClass.objects.filter(member=self.member).exists())
+
+    def test_lookups_outside_the_booking_window_are_rejected(self):
+        availability = reverse('trainer-availability', args=[self.trainer.id])
+        free_slots = reverse('trainer-free-slots', args=[self.trainer.id])
 
-# Create your tests here.
+        for url, params in (
+            (availability, {'start_date': '9999-12-20', 'start_time': '10:00', 'duration_months': 12}),
+            (availability, {'start_date': '2000-01-01', 'start_time': '10:00'}),
+            (free_slots, {'date': '9999-12-31'}),
+        ):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+        self.assertEqual(self.client.get(free_slots, {'date': self.start.isoformat()}).status_code, 200)
@@ -3,6 +3,8 @@ from . import views
 
 urlpatterns = [
     path('admin-dashboard/private-classes-list/', views.admin_private_classes_list, name='admin-private-classes-list'),
+    path('admin-dashboard/private-classes-list/data/', views.admin_private_classes_data, name='admin-private-classes-data'),
+    path('admin-dashboard/private-classes-list/export/', views.admin_private_classes_export, name='admin-private-classes-export'),
     path('admin-dashboard/private-classes/<int:pk>/edit/', views.admin_private_class_edit, name='admin-private-class-edit'),
     path('admin-dashboard/private-classes/<int:pk>/toggle/', views.admin_private_class_toggle, name='admin-private-class-toggle'),
 
@@ -14,7 +16,14 @@ urlpatterns = [
          views.book_private_class_details, 
          name='book-private-class-details'),
 
-    
+    # Availability lookups used by the booking form
+    path('book-private-class/<int:trainer_id>/availability/',
+         views.trainer_availability,
+         name='trainer-availability'),
+    path('book-private-class/<int:trainer_id>/free-slots/',
+         views.trainer_free_slots,
+         name='trainer-free-slots'),
+
     # # Payment page for booked class (to be implemented)
     # path('book-private-class/<int:private_class_id>/payment/', 
     #      views.payment_for_private_class, 
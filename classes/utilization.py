@@ -0,0 +1,177 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import ClassOccurrence, HourlyBooking
+
+# Hourly utilization rollups (HourlyBooking).
+#
+# Every occurrence covers a run of clock hours from its start to its end
+# time, possibly past midnight into the next day. Each hour it touches gets
+# the minutes booked in it and one session, once under the trainer and once
+# under trainer_id 0 for the whole gym. sync_occurrences() passes the
+# class's occurrences before and after each change to apply(), which writes
+# only the difference; a class whose schedule didn't change costs nothing.
+#
+# heatmap() reads a date range of buckets (at most days x 24 rows) and folds
+# them into a weekday x hour matrix with one NumPy scatter-add.
+
+GYM = 0
+BATCH_SIZE = 1000
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+# Heatmaps cover this many weeks before and after today
+HEATMAP_WEEKS = 4
+
+
+def _duration_minutes(start_time, end_time):
+    start = start_time.hour * 60 + start_time.minute
+    end = end_time.hour * 60 + end_time.minute
+    return (end - start) % (24 * 60)
+
+
+def _hour_slices(day, start_time, minutes):
+    """(date, hour, minutes in that hour) for a session starting at day/start_time"""
+    start = datetime.combine(day, start_time)
+    end = start + timedelta(minutes=minutes)
+    hour_start = start.replace(minute=0, second=0, microsecond=0)
+    while hour_start < end:
+        hour_end = hour_start + timedelta(hours=1)
+        overlap = (min(end, hour_end) - max(start, hour_start)).seconds // 60
+        if overlap:
+            yield hour_start.date(), hour_start.hour, overlap
+        hour_start = hour_end
+
+
+def buckets(rows):
+    """
+    {(trainer_id, date, hour): [minutes, sessions]} for occurrence rows of
+    (date, start_time, end_time, trainer_id, count)
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for day, start_time, end_time, trainer_id, count in rows:
+        for bucket_day, hour, minutes in _hour_slices(day, start_time, _duration_minutes(start_time, end_time)):
+            for scope in {GYM, trainer_id or GYM}:
+                entry = totals[(scope, bucket_day, hour)]
+                entry[0] += minutes * count
+                entry[1] += count
+    return totals
+
+
+def apply(old_rows, new_rows):
+    """Move the rollups from the `old_rows` occurrences to the `new_rows` ones"""
+    deltas = buckets(new_rows)
+    for key, (minutes, sessions) in buckets(old_rows).items():
+        entry = deltas[key]
+        entry[0] -= minutes
+        entry[1] -= sessions
+    deltas = {key: value for key, value in deltas.items() if value != [0, 0]}
+    if not deltas:
+        return
+
+    scopes = {scope for scope, _, _ in deltas}
+    days = [day for _, day, _ in deltas]
+    with transaction.atomic():
+        current = {
+            (row.trainer_id, row.date, row.hour): row
+            for row in HourlyBooking.objects.select_for_update().filter(
+                trainer_id__in=scopes, date__range=(min(days), max(days))
+            )
+            if (row.trainer_id, row.date, row.hour) in deltas
+        }
+        changed, emptied = [], []
+        for (scope, day, hour), (minutes, sessions) in deltas.items():
+            row = current.get((scope, day, hour)) or HourlyBooking(trainer_id=scope, date=day, hour=hour)
+            row.minutes = max(row.minutes + minutes, 0)
+            row.sessions = max(row.sessions + sessions, 0)
+            if row.sessions:
+                changed.append(row)
+            elif row.pk:
+                emptied.append(row.pk)
+
+        if emptied:
+            HourlyBooking.objects.filter(pk__in=emptied).delete()
+        HourlyBooking.objects.bulk_create(
+            changed,
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['trainer_id', 'date', 'hour'],
+            update_fields=['minutes', 'sessions'],
+        )
+
+
+def occurrence_rows(occurrences):
+    """Rows for apply() from a ClassOccurrence queryset"""
+    return [(*row, 1) for row in occurrences.values_list('date', 'start_time', 'end_time', 'trainer_id')]
+
+
+def rebuild():
+    """Recompute every bucket from ClassOccurrence (grouped, so one row per distinct slot)"""
+    rows = ClassOccurrence.objects.values_list('date', 'start_time', 'end_time', 'trainer_id').annotate(
+        count=Count('id')
+    ).order_by()
+    totals = buckets(rows.iterator(chunk_size=BATCH_SIZE))
+    with transaction.atomic():
+        HourlyBooking.objects.all().delete()
+        HourlyBooking.objects.bulk_create(
+            [
+                HourlyBooking(trainer_id=scope, date=day, hour=hour, minutes=minutes, sessions=sessions)
+                for (scope, day, hour), (minutes, sessions) in totals.items()
+            ],
+            batch_size=BATCH_SIZE,
+        )
+    return len(totals)
+
+
+# -------------------------
+# Heatmaps
+# -------------------------
+def heatmap(trainer_id=GYM, today=None, weeks=HEATMAP_WEEKS):
+    """
+    Average booked hours per weekday and clock hour, over `weeks` weeks
+    either side of today. Returns the 7x24 matrix and the window.
+    """
+    today = today or date.today()
+    start = today - timedelta(weeks=weeks)
+    end = today + timedelta(weeks=weeks) - timedelta(days=1)
+
+    rows = np.array(
+        HourlyBooking.objects.filter(trainer_id=trainer_id, date__range=(start, end)).values_list(
+            'date__week_day', 'hour', 'minutes'
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    matrix = np.zeros((7, 24))
+    # __week_day is 1 = Sunday .. 7 = Saturday; rotate to Monday first
+    np.add.at(matrix, ((rows[:, 0] + 5) % 7, rows[:, 1]), rows[:, 2] / 60)
+
+    # Every weekday occurs exactly `weeks * 2` times in the window
+    return matrix / (weeks * 2), start, end
+
+
+def heatmap_context(trainer_id=GYM, today=None):
+    """Template rows for classes/utilization_heatmap.html"""
+    matrix, start, end = heatmap(trainer_id, today)
+    open_hour = getattr(settings, 'GYM_OPEN_HOUR', 6)
+    close_hour = getattr(settings, 'GYM_CLOSE_HOUR', 22)
+    # Opening hours, widened to any hour that has bookings
+    used = np.flatnonzero(matrix.any(axis=0))
+    first = min(open_hour, used.min()) if used.size else open_hour
+    last = max(close_hour - 1, used.max()) if used.size else close_hour - 1
+    hours = list(range(first, last + 1))
+
+    peak = matrix.max()
+    rows = [
+        {
+            'label': label,
+            'cells': [
+                {'hours': round(float(matrix[weekday, hour]), 1), 'level': float(matrix[weekday, hour] / peak) if peak else 0}
+                for hour in hours
+            ],
+        }
+        for weekday, label in enumerate(WEEKDAYS)
+    ]
+    return {'hours': hours, 'rows': rows, 'start': start, 'end': end, 'peak': round(float(peak), 1)}
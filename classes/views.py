@@ -7,17 +7,20 @@ from datetime import datetime, timedelta
 from .models import PrivateClass
 from accounts.models import User  # Your custom User model
 from django.contrib.auth.decorators import login_required
-from membership.models import Payment 
+from membership.models import Payment, CheckoutIntent
 from django.db.models import Sum, Q
 from datetime import date
 from dateutil.relativedelta import relativedelta
-from django_esewa import EsewaPayment
 from django.views.decorators.http import require_http_methods
-from django.conf import settings
-import json
-import requests
+from asgiref.sync import sync_to_async
 import uuid
 from django.urls import reverse
+from django.utils.html import escape, format_html
+from accounts.datatables import datatables_response, filter_queryset
+from accounts.exports import csv_response, stream_rows
+from django.http import JsonResponse
+from .availability import TrainerAvailability, booking_conflict
+from membership import gateways, payments
 
 
 
@@ -33,14 +36,101 @@ def admin_private_classes_list(request):
     Admin view to list all member-created private classes.
     Admin can edit or delete, but not create new classes.
     """
-    private_classes = PrivateClass.objects.select_related('member', 'trainer').all().order_by('start_date', 'start_time')
-
+    # Rows are loaded page by page from admin_private_classes_data
     context = {
-        'private_classes': private_classes
+        'trainers': User.objects.filter(role='Trainer').order_by('first_name', 'last_name'),
+        'month_options': PrivateClass.objects.order_by('duration_months').values_list('duration_months', flat=True).distinct(),
     }
     return render(request, 'admin/private_classes_list.html', context)
 
 
+def _filter_class_status(queryset, value):
+    if value == 'Active':
+        return queryset.filter(is_active=True)
+    if value == 'Inactive':
+        return queryset.filter(is_active=False)
+    return queryset
+
+
+# Filters and search shared by the private classes list and its CSV export
+PRIVATE_CLASS_FILTERS = {
+    'trainer': lambda qs, value: qs.filter(trainer_id=value) if value.isdigit() else qs,
+    'months': lambda qs, value: qs.filter(duration_months=value) if value.isdigit() else qs,
+    'status': _filter_class_status,
+}
+PRIVATE_CLASS_SEARCH_FIELDS = ['member__first_name', 'member__last_name', 'trainer__first_name', 'trainer__last_name']
+
+
+@user_passes_test(admin_required)
+def admin_private_classes_data(request):
+    """DataTables server-side endpoint for the admin private classes list"""
+    def render_row(cls):
+        if cls.is_active:
+            status = format_html('<span class="badge badge-active">Active</span>')
+        else:
+            status = format_html('<span class="badge badge-inactive">Inactive</span>')
+        return [
+            escape(cls.member.get_full_name()),
+            escape(cls.trainer.get_full_name()) if cls.trainer else '-',
+            f"{cls.start_date.strftime('%b %d, %Y')} {cls.start_time.strftime('%H:%M')} - {cls.end_time.strftime('%H:%M')}",
+            cls.duration_hours,
+            cls.duration_months,
+            status,
+            format_html(
+                '<a class="btn btn-sm btn-info" href="{}">Edit</a> '
+                '<a class="btn btn-sm btn-warning" href="{}">{}</a>',
+                reverse('admin-private-class-edit', args=[cls.id]),
+                reverse('admin-private-class-toggle', args=[cls.id]),
+                'Deactivate' if cls.is_active else 'Activate',
+            ),
+        ]
+
+    return datatables_response(
+        request,
+        PrivateClass.objects.select_related('member', 'trainer'),
+        order_columns={2: ['start_date', 'start_time']},
+        default_ordering=['start_date', 'start_time'],
+        search_fields=PRIVATE_CLASS_SEARCH_FIELDS,
+        render_row=render_row,
+        filters=PRIVATE_CLASS_FILTERS,
+    )
+
+
+@user_passes_test(admin_required)
+def admin_private_classes_export(request):
+    """Stream the private classes as CSV, with the list's filters and search applied"""
+    classes, _ = filter_queryset(
+        request.GET,
+        PrivateClass.objects.all(),
+        PRIVATE_CLASS_FILTERS,
+        PRIVATE_CLASS_SEARCH_FIELDS,
+    )
+    classes = classes.select_related('member', 'trainer').order_by('start_date', 'start_time', 'id')
+
+    def lines():
+        for cls in stream_rows(classes):
+            yield [
+                cls.id,
+                cls.member.get_full_name(),
+                cls.trainer.get_full_name() if cls.trainer else '',
+                cls.start_date.isoformat(),
+                cls.end_date.isoformat(),
+                cls.start_time.strftime('%H:%M'),
+                cls.end_time.strftime('%H:%M'),
+                cls.duration_hours,
+                cls.duration_months,
+                cls.price,
+                'Active' if cls.is_active else 'Inactive',
+            ]
+
+    return csv_response(
+        f'private-classes-{date.today().isoformat()}.csv',
+        ['ID', 'Member', 'Trainer', 'Start Date', 'End Date', 'Start Time', 'End Time',
+         'Hours', 'Months', 'Price', 'Status'],
+        lines(),
+    )
+
+
 @user_passes_test(admin_required)
 def admin_private_class_edit(request, pk):
     """
@@ -119,11 +209,25 @@ def book_private_class_details(request, trainer_id):
     max_start_date = today + relativedelta(months=3)
 
     if request.method == "POST":
-        duration_hours = int(request.POST.get('duration_hours', 1))
-        duration_months = int(request.POST.get('duration_months', 1))
         start_date = request.POST.get('start_date')
         start_time = request.POST.get('start_time')
 
+        # Validate durations (1-3 hours a day, 1-12 months)
+        try:
+            duration_hours = int(request.POST.get('duration_hours', 1))
+            duration_months = int(request.POST.get('duration_months', 1))
+        except (TypeError, ValueError):
+            duration_hours = duration_months = 0
+        if not (1 <= duration_hours <= 3 and 1 <= duration_months <= 12):
+            messages.error(request, "Choose 1 to 3 hours a day for 1 to 12 months.")
+            return render(request, 'classes/book_private_class_details.html', {
+                'trainer': trainer,
+                'trainer_experience': getattr(trainer, 'experience_level', 0),
+                'base_rate': 500,
+                'start_date_min': today.isoformat(),
+                'start_date_max': max_start_date.isoformat(),
+            })
+
         # Validate date range (today through next 3 months, inclusive)
         try:
             start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
@@ -160,30 +264,19 @@ def book_private_class_details(request, trainer_id):
                 'start_date_max': max_start_date.isoformat(),
             })
 
-        requested_start = datetime.combine(start_date_obj, start_time_obj)
-        requested_end = requested_start + timedelta(hours=duration_hours)
-
-        existing_sessions = PrivateClass.objects.filter(
-            trainer=trainer,
-            start_date=start_date_obj,
-            is_active=True
-        )
-
-        for session in existing_sessions:
-            existing_start = datetime.combine(session.start_date, session.start_time)
-            existing_end = existing_start + timedelta(hours=session.duration_hours)
-            if requested_start < existing_end and requested_end > existing_start:
-                messages.error(
-                    request,
-                    "Trainer is already booked for that time range. Please pick a different time."
-                )
-                return render(request, 'classes/book_private_class_details.html', {
-                    'trainer': trainer,
-                    'trainer_experience': getattr(trainer, 'experience_level', 0),
-                    'base_rate': 500,
-                    'start_date_min': today.isoformat(),
-                    'start_date_max': max_start_date.isoformat(),
-                })
+        # Check every session of the booking span, not just the first day
+        if booking_conflict(trainer.id, start_date_obj, start_time_obj, duration_hours, duration_months):
+            messages.error(
+                request,
+                "Trainer is already booked for that time range. Please pick a different time."
+            )
+            return render(request, 'classes/book_private_class_details.html', {
+                'trainer': trainer,
+                'trainer_experience': getattr(trainer, 'experience_level', 0),
+                'base_rate': 500,
+                'start_date_min': today.isoformat(),
+                'start_date_max': max_start_date.isoformat(),
+            })
 
         # Calculate price
         temp_class = PrivateClass(
@@ -241,20 +334,11 @@ def book_private_class_details(request, trainer_id):
             'transaction_uuid': str(transaction_uuid)
         }
 
-        paymentEsewa = EsewaPayment(
-            product_code="EPAYTEST",
-            success_url=f"http://localhost:8000/private-class/success/{transaction_uuid}/",
-            failure_url=f"http://localhost:8000/private-class/failure/{transaction_uuid}/",
-            amount=float(calculated_price),
-            tax_amount=0,
-            total_amount=float(calculated_price),
-            product_service_charge=0,
-            product_delivery_charge=0,
-            transaction_uuid=str(transaction_uuid),
+        payments.start_private_class(
+            request.user, trainer, calculated_price, start_date_obj, start_time_obj,
+            duration_hours, duration_months, uid=transaction_uuid,
         )
-        
-        signature = paymentEsewa.create_signature()
-        
+
         # Get the session data for display
         pending_data = request.session['pending_private_class']
 
@@ -262,7 +346,13 @@ def book_private_class_details(request, trainer_id):
             'trainer': trainer,
             'price': calculated_price,
             'pending_data': pending_data,
-            'form': paymentEsewa.generate_form(),
+            'form': gateways.esewa.form(
+                transaction_uuid=transaction_uuid,
+                amount=float(calculated_price),
+                success_url=request.build_absolute_uri(reverse('private-class-success', args=[transaction_uuid])),
+                failure_url=request.build_absolute_uri(reverse('private-class-failure', args=[transaction_uuid])),
+            ),
+            'esewa_form_url': gateways.esewa.form_url(),
             'khalti_amount': int(float(calculated_price) * 100),
             'khalti_order_id': str(transaction_uuid),
             'khalti_order_name': f"Private class with {trainer.get_full_name()}",
@@ -287,10 +377,75 @@ def book_private_class_details(request, trainer_id):
     return render(request, 'classes/book_private_class_details.html', context)
 
 
+def _in_booking_window(day):
+    """Bookings start between today and three months ahead, as book_private_class_details enforces"""
+    today = date.today()
+    return today <= day <= today + relativedelta(months=3)
+
+
+@login_required
+def trainer_availability(request, trainer_id):
+    """
+    JSON: is the requested booking free for this trainer over its whole span?
+    Called by the booking form while the member edits date/time/duration.
+    """
+    trainer = get_object_or_404(User, id=trainer_id, role='Trainer')
+    try:
+        start_date_obj = datetime.strptime(request.GET.get('start_date', ''), '%Y-%m-%d').date()
+        start_time_obj = datetime.strptime(request.GET.get('start_time', ''), '%H:%M').time()
+        duration_hours = min(max(int(request.GET.get('duration_hours', 1)), 1), 3)
+        duration_months = min(max(int(request.GET.get('duration_months', 1)), 1), 12)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid booking parameters.'}, status=400)
+    if not _in_booking_window(start_date_obj):
+        return JsonResponse({'error': 'Start date must be between today and the next 3 months.'}, status=400)
+
+    availability = TrainerAvailability.for_trainer(trainer.id)
+    clash = availability.booking_conflict(start_date_obj, start_time_obj, duration_hours, duration_months)
+
+    return JsonResponse({
+        'available': clash is None,
+        'conflict': {
+            'date': clash[0].date().isoformat(),
+            'start': clash[0].strftime('%H:%M'),
+            'end': clash[1].strftime('%H:%M'),
+        } if clash else None,
+    })
+
+
+@login_required
+def trainer_free_slots(request, trainer_id):
+    """JSON: free slots for the trainer for each day of the week containing ?date="""
+    trainer = get_object_or_404(User, id=trainer_id, role='Trainer')
+    try:
+        day = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        day = date.today()
+    if not _in_booking_window(day):
+        return JsonResponse({'error': 'Date must be between today and the next 3 months.'}, status=400)
+    try:
+        min_hours = min(max(int(request.GET.get('duration_hours', 1)), 1), 3)
+    except ValueError:
+        min_hours = 1
+
+    availability = TrainerAvailability.for_trainer(trainer.id)
+    days = [
+        {
+            'date': slot_day.isoformat(),
+            'slots': [
+                {'start': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')}
+                for start, end in slots
+            ],
+        }
+        for slot_day, slots in availability.free_slots_for_week(day, min_hours)
+    ]
+    return JsonResponse({'week_start': days[0]['date'], 'days': days})
+
+
 @login_required
 def my_booked_sessions(request):
     # Fetch all private classes booked by this user, ordered by date and time
-    sessions = PrivateClass.objects.filter(member=request.user).order_by('start_date', 'start_time')
+    sessions = PrivateClass.objects.filter(member=request.user).select_related('trainer').order_by('start_date', 'start_time')
     return render(request, 'user/my_booked_sessions.html', {'sessions': sessions})
 
 
@@ -316,7 +471,10 @@ def trainer_private_classes(request):
     trainer = request.user
 
     # All classes for this trainer
-    trainer_classes = PrivateClass.objects.filter(trainer=trainer).order_by('start_date', 'start_time')
+    # Member progress summaries come along in the same query
+    trainer_classes = PrivateClass.objects.filter(trainer=trainer).select_related(
+        'member', 'member__progress'
+    ).order_by('start_date', 'start_time')
 
     # Stats
     total_sessions = trainer_classes.count()
@@ -324,7 +482,7 @@ def trainer_private_classes(request):
     upcoming_classes = trainer_classes.filter(start_date__gte=date.today())
 
     # Revenue from payments for this trainer's private classes
-    payments = Payment.objects.filter(private_class__trainer=trainer, payment_status='Completed')
+    payments = Payment.objects.filter(trainer=trainer, payment_status='Completed')
     total_revenue = payments.aggregate(total=Sum('amount'))['total'] or 0
 
     context = {
@@ -341,69 +499,36 @@ def trainer_private_classes(request):
 # ===============================
 # Private Class Payment Handlers
 # ===============================
+# Async like the membership ones, so waiting on a gateway holds no worker,
+# and settled through membership/payments.py the same way
 
-def private_class_success(request, uid):
+async def private_class_success(request, uid):
     """Handle successful private class payment via eSewa"""
-    # Get pending private class data from session
-    pending_data = request.session.get('pending_private_class')
-    if not pending_data or pending_data.get('transaction_uuid') != str(uid):
+    intent = await payments.aget_intent(uid, await request.auser())
+    if intent is None or intent.kind != CheckoutIntent.PRIVATE_CLASS:
         messages.error(request, "Invalid or expired payment session.")
         return redirect('book-private-class')
-    
-    # Get trainer
-    trainer = get_object_or_404(User, id=pending_data['trainer_id'], role='Trainer')
-    
-    paymentEsewa = EsewaPayment(
-        product_code="EPAYTEST",
-        success_url=f"http://localhost:8000/private-class/success/{uid}/",
-        failure_url=f"http://localhost:8000/private-class/failure/{uid}/",
-        amount=float(pending_data['price']),
-        tax_amount=0,
-        total_amount=float(pending_data['price']),
-        product_service_charge=0,
-        product_delivery_charge=0,
-        transaction_uuid=str(uid),
-    )
-    signature = paymentEsewa.create_signature()
-    
-    if paymentEsewa.is_completed(dev=True):
-        start_date_obj = datetime.strptime(pending_data['start_date'], '%Y-%m-%d').date()
-        start_time_obj = datetime.strptime(pending_data['start_time'], '%H:%M').time()
 
-        # NOW create the private class and payment records
-        private_class = PrivateClass.objects.create(
-            member=request.user,
-            trainer=trainer,
-            start_date=start_date_obj,
-            start_time=start_time_obj,
-            duration_hours=pending_data['duration_hours'],
-            duration_months=pending_data['duration_months'],
-            price=pending_data['price'],
-            is_active=True
-        )
-        
-        payment = Payment.objects.create(
-            uid=uid,
-            private_class=private_class,
-            amount=pending_data['price'],
-            tax_amount=0,
-            service_charge=0,
-            delivery_charge=0,
-            payment_method='Esewa',
-            payment_status='Completed'
-        )
-        
-        # Clear session data
-        del request.session['pending_private_class']
-        
-        context = {
-            'payment': payment,
-            'private_class': private_class,
-        }
-        messages.success(request, f"Private class booking confirmed: {private_class.trainer.get_full_name()}")
-        return render(request, "classes/private_class_success.html", context)
-    
-    return redirect('private-class-failure', uid)
+    try:
+        intent = await payments.asettle(intent, 'esewa')
+    except gateways.GatewayError:
+        messages.error(request, "eSewa verification failed. Please try again.")
+        return redirect('private-class-failure', uid)
+
+    if intent.status != CheckoutIntent.COMPLETED:
+        return redirect('private-class-failure', uid)
+
+    # Clear session data
+    await request.session.apop('pending_private_class', None)
+
+    payment = await payments.areceipt(intent)
+    private_class = payment.private_class
+    context = {
+        'payment': payment,
+        'private_class': private_class,
+    }
+    messages.success(request, f"Private class booking confirmed: {private_class.trainer.get_full_name()}")
+    return await sync_to_async(render)(request, "classes/private_class_success.html", context)
 
 
 def private_class_failure(request, uid):
@@ -421,154 +546,69 @@ def private_class_failure(request, uid):
 
 @login_required
 @require_http_methods(["POST"])
-def khalti_initiate_private_class(request):
+async def khalti_initiate_private_class(request):
     return_url = request.POST.get('return_url')
     if not return_url:
         messages.error(request, "Missing Khalti return URL.")
         return redirect('book-private-class')
 
-    base_url = (
-        "https://khalti.com/api/v2/"
-        if getattr(settings, 'KHALTI_ENV', 'sandbox') == 'production'
-        else "https://dev.khalti.com/api/v2/"
-    )
-    url = f"{base_url}epayment/initiate/"
     website_url = request.POST.get('website_url') or request.build_absolute_uri('/')
-    amount = request.POST.get('amount')
-    purchase_order_id = request.POST.get('purchase_order_id')
     purchase_order_name = request.POST.get('purchase_order_name') or 'Private Class'
 
-    if not getattr(settings, 'KHALTI_SECRET_KEY', ''):
+    if not gateways.khalti.configured:
         messages.error(request, "Khalti secret key is not configured.")
         return redirect('book-private-class')
 
-    try:
-        amount_value = int(amount)
-    except (TypeError, ValueError):
-        messages.error(request, "Invalid Khalti amount.")
-        return redirect('book-private-class')
-
-    payload = json.dumps({
-        "return_url": return_url,
-        "website_url": website_url,
-        "amount": amount_value,
-        "purchase_order_id": purchase_order_id,
-        "purchase_order_name": purchase_order_name,
-        "customer_info": {
-            "name": request.user.get_full_name() or request.user.username,
-            "email": request.user.email or "",
-            "phone": getattr(request.user, 'phone', '') or ""
-        }
-    })
-
-    headers = {
-        'Authorization': f"Key {settings.KHALTI_SECRET_KEY}",
-        'Content-Type': 'application/json',
-    }
-
-    try:
-        response = requests.request("POST", url, headers=headers, data=payload, timeout=15)
-    except requests.RequestException:
-        messages.error(request, "Khalti initiate failed. Please try again.")
-        return redirect('book-private-class')
-
-    if response.status_code != 200:
-        messages.error(request, "Khalti initiate failed. Please try again.")
+    # The amount comes from the checkout, not from the posted form
+    user = await request.auser()
+    intent = await payments.aget_intent(request.POST.get('purchase_order_id'), user)
+    if intent is None or intent.status != CheckoutIntent.PENDING:
+        messages.error(request, "Invalid or expired payment session.")
         return redirect('book-private-class')
 
     try:
-        new_res = response.json()
-    except ValueError:
+        pidx, payment_url = await gateways.khalti.ainitiate(
+            return_url=return_url,
+            website_url=website_url,
+            amount=int(intent.amount * 100),
+            purchase_order_id=str(intent.uid),
+            purchase_order_name=purchase_order_name,
+            customer=user,
+        )
+    except gateways.GatewayError:
         messages.error(request, "Khalti initiate failed. Please try again.")
         return redirect('book-private-class')
 
-    payment_url = new_res.get('payment_url')
-    if not payment_url:
-        messages.error(request, "Khalti response missing payment URL.")
-        return redirect('book-private-class')
-
+    await payments.achoose_provider(intent, 'khalti', pidx)
     return redirect(payment_url)
 
 
 @login_required
 @require_http_methods(["GET"])
-def khalti_return_private_class(request, uid):
-    pending_data = request.session.get('pending_private_class')
-    if not pending_data or pending_data.get('transaction_uuid') != str(uid):
+async def khalti_return_private_class(request, uid):
+    intent = await payments.aget_intent(uid, await request.auser())
+    if intent is None or intent.kind != CheckoutIntent.PRIVATE_CLASS:
         messages.error(request, "Invalid or expired payment session.")
         return redirect('book-private-class')
 
-    pidx = request.GET.get('pidx')
-    if not pidx:
-        messages.error(request, "Missing Khalti payment reference. Please try again.")
-        return redirect('private-class-failure', uid)
-
-    url = "https://a.khalti.com/api/v2/epayment/lookup/"
-    headers = {
-        'Authorization': f"Key {settings.KHALTI_SECRET_KEY}",
-        'Content-Type': 'application/json',
-    }
-    data = json.dumps({'pidx': pidx})
-
-    try:
-        res = requests.request('POST', url, headers=headers, data=data, timeout=15)
-    except requests.RequestException:
-        messages.error(request, "Khalti verification failed. Please try again.")
-        return redirect('private-class-failure', uid)
-
-    if res.status_code != 200:
-        messages.error(request, "Khalti verification failed. Please try again.")
-        return redirect('private-class-failure', uid)
-
+    # Khalti sends back the pidx that was paid, which needn't be the latest one started
     try:
-        new_res = res.json()
-    except ValueError:
+        intent = await payments.asettle(intent, 'khalti', request.GET.get('pidx'))
+    except gateways.GatewayError:
         messages.error(request, "Khalti verification failed. Please try again.")
         return redirect('private-class-failure', uid)
 
-    status = (new_res.get('status') or '').lower()
-    if status != 'completed':
-        messages.error(request, "Khalti payment verification failed. Please try again.")
-        return redirect('private-class-failure', uid)
-
-    expected_amount = int(float(pending_data['price']) * 100)
-    if 'total_amount' in new_res and int(new_res.get('total_amount') or 0) != expected_amount:
-        messages.error(request, "Khalti payment amount mismatch. Please contact support.")
+    if intent.status != CheckoutIntent.COMPLETED:
+        messages.error(request, intent.failure_reason or "Khalti payment verification failed. Please try again.")
         return redirect('private-class-failure', uid)
 
-    if 'purchase_order_id' in new_res and str(new_res.get('purchase_order_id')) != str(uid):
-        messages.error(request, "Khalti payment reference mismatch. Please contact support.")
-        return redirect('private-class-failure', uid)
-
-    trainer = get_object_or_404(User, id=pending_data['trainer_id'], role='Trainer')
-    start_date_obj = datetime.strptime(pending_data['start_date'], '%Y-%m-%d').date()
-    start_time_obj = datetime.strptime(pending_data['start_time'], '%H:%M').time()
-
-    private_class = PrivateClass.objects.create(
-        member=request.user,
-        trainer=trainer,
-        start_date=start_date_obj,
-        start_time=start_time_obj,
-        duration_hours=pending_data['duration_hours'],
-        duration_months=pending_data['duration_months'],
-        price=pending_data['price'],
-        is_active=True
-    )
-    payment = Payment.objects.create(
-        uid=uid,
-        private_class=private_class,
-        amount=pending_data['price'],
-        tax_amount=0,
-        service_charge=0,
-        delivery_charge=0,
-        payment_method='Khalti',
-        payment_status='Completed'
-    )
-    del request.session['pending_private_class']
+    await request.session.apop('pending_private_class', None)
 
+    payment = await payments.areceipt(intent)
+    private_class = payment.private_class
     context = {
         'payment': payment,
         'private_class': private_class,
     }
     messages.success(request, f"Private class booking confirmed: {private_class.trainer.get_full_name()}")
-    return render(request, "classes/private_class_success.html", context)
\ No newline at end of file
+    return await sync_to_async(render)(request, "classes/private_class_success.html", context)
@@ -0,0 +1,227 @@
+import atexit
+import threading
+from datetime import date
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max
+
+from accounts.models import User
+from .models import CheckIn, MemberSubscription
+
+# Door check-ins.
+#
+# A member's QR code is their id signed with SECRET_KEY, so a scan can be
+# verified without a database lookup. Whether they may enter is answered from
+# a per-process index of today's covered members (member id -> last covered
+# day and display name), built with one grouped query per day. When a
+# subscription changes, the member's id is appended to a change log in the
+# cache; each process replays the entries it hasn't seen yet and re-reads
+# just those members, falling back to a full rebuild if it has fallen too far
+# behind. With LocMemCache that log is per-process, so run a shared cache
+# when serving from several workers.
+#
+# Check-ins are buffered in memory and written with bulk_create once
+# CHECKIN_BATCH_SIZE have queued up or CHECKIN_FLUSH_SECONDS have passed.
+# A process that dies uncleanly loses at most that buffer.
+
+TOKEN_SALT = 'membership.checkin'
+VERSION_KEY = 'checkin_index:version'
+CHANGE_KEY = 'checkin_index:change:{}'
+CHANGE_TIMEOUT = 60 * 60
+# Replaying more changes than this is slower than rebuilding
+MAX_REPLAY = 200
+
+
+# -------------------------
+# QR tokens
+# -------------------------
+def member_token(member):
+    return signing.Signer(salt=TOKEN_SALT).sign(str(member.pk))
+
+
+def member_id_from_token(token):
+    """The member id a scanned code was issued for, or None if it's not ours"""
+    try:
+        value = signing.Signer(salt=TOKEN_SALT).unsign(str(token).strip())
+    except signing.BadSignature:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+# -------------------------
+# Active membership index
+# -------------------------
+def _covered_members(today, member_ids=None):
+    """{member id: (last covered day, name)} for members with a started, unexpired subscription"""
+    subscriptions = MemberSubscription.objects.filter(
+        is_active=True,
+        start_date__lte=today,
+        end_date__gte=today,
+    )
+    if member_ids is not None:
+        subscriptions = subscriptions.filter(member_id__in=member_ids)
+    rows = subscriptions.values_list(
+        'member_id', 'member__first_name', 'member__last_name', 'member__username'
+    ).annotate(until=Max('end_date')).order_by()
+    return {
+        member_id: (until, f"{first_name} {last_name}".strip() or username)
+        for member_id, first_name, last_name, username, until in rows
+    }
+
+
+def member_changed(member_id):
+    """Record that a member's subscriptions changed, for every process's index"""
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+        version = 1
+    cache.set(CHANGE_KEY.format(version), member_id, CHANGE_TIMEOUT)
+
+
+class ActiveMembershipIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._version = 0
+        self._members = {}
+
+    def _rebuild(self, today, version):
+        self._members = _covered_members(today)
+        self._day = today
+        self._version = version
+
+    def _replay(self, version):
+        keys = [CHANGE_KEY.format(v) for v in range(self._version + 1, version + 1)]
+        changed = cache.get_many(keys)
+        if len(changed) < len(keys):
+            # Some entries expired; we can't tell which members they were
+            return False
+        member_ids = set(changed.values())
+        fresh = _covered_members(self._day, member_ids)
+        for member_id in member_ids:
+            if member_id in fresh:
+                self._members[member_id] = fresh[member_id]
+            else:
+                self._members.pop(member_id, None)
+        self._version = version
+        return True
+
+    def _sync(self, today):
+        version = cache.get(VERSION_KEY, 0)
+        if self._day == today and version == self._version:
+            return
+        with self._lock:
+            if self._day != today or version < self._version or version - self._version > MAX_REPLAY:
+                self._rebuild(today, version)
+            elif version != self._version and not self._replay(version):
+                self._rebuild(today, version)
+
+    def lookup(self, member_id, today=None):
+        """(last covered day, name) if the member may enter today, else None"""
+        today = today or date.today()
+        self._sync(today)
+        return self._members.get(member_id)
+
+    def __len__(self):
+        return len(self._members)
+
+
+index = ActiveMembershipIndex()
+
+
+# -------------------------
+# Buffered writer
+# -------------------------
+class CheckInWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'CHECKIN_BATCH_SIZE', 50)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'CHECKIN_FLUSH_SECONDS', 2)
+
+    def add(self, checkin):
+        with self._lock:
+            self._pending.append(checkin)
+            if len(self._pending) < self.batch_size:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.interval, self._flush_from_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            batch = self._take()
+        self._write(batch)
+
+    def _take(self):
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._lock:
+            batch = self._take()
+        self._write(batch)
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # Timer threads get their own connection; don't leak it
+            connection.close()
+
+    def _write(self, batch):
+        if batch:
+            CheckIn.objects.bulk_create(batch, batch_size=self.batch_size)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+writer = CheckInWriter()
+atexit.register(writer.flush)
+
+
+# -------------------------
+# Scanning
+# -------------------------
+def scan(token, scanned_by=None, today=None):
+    """
+    Check a scanned code. Returns a result dict with 'allowed', and queues a
+    CheckIn for recognised members whether or not they were let in.
+    """
+    member_id = member_id_from_token(token)
+    if member_id is None:
+        return {'allowed': False, 'reason': 'Unrecognised code.'}
+
+    entry = index.lookup(member_id, today)
+    if entry is not None:
+        valid_until, name = entry
+        result = {'allowed': True, 'member': name, 'valid_until': valid_until.isoformat()}
+    else:
+        # Rare path: turned away, so look the member up for the desk
+        member = User.objects.filter(pk=member_id).only('first_name', 'last_name', 'username').first()
+        if member is None:
+            return {'allowed': False, 'reason': 'Unrecognised code.'}
+        name = f"{member.first_name} {member.last_name}".strip() or member.username
+        result = {'allowed': False, 'member': name, 'reason': 'No active membership today.'}
+
+    writer.add(CheckIn(
+        member_id=member_id,
+        scanned_by_id=getattr(scanned_by, 'pk', None),
+        allowed=result['allowed'],
+    ))
+    return result
@@ -0,0 +1,255 @@
+from datetime import date, datetime
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import MemberSubscription, Payment
+
+# Membership coverage and deferred revenue.
+#
+# Every subscription is loaded once into flat NumPy arrays of day ordinals.
+# Members covered per day comes from a difference array: +1 on the day a
+# coverage interval starts, -1 on the day after it ends, then a cumulative
+# sum. A member's overlapping subscriptions (early renewals) are merged first
+# so they are counted once.
+#
+# A completed subscription payment is earned evenly over the subscription's
+# term, start_date through end_date inclusive (as in SubscriptionTimeline).
+# The same difference-array trick spreads each payment's daily rate over its
+# days; if the subscription is cancelled early, the unearned remainder is
+# recognized on the cancellation day. Deferred revenue is everything billed
+# so far minus everything recognized so far. Payments for subscriptions
+# without an end date, and private class payments, are earned on the day
+# they are paid.
+#
+# The daily series are computed once and cached until a payment or
+# subscription changes (see signals.py); each request only slices them.
+
+CACHE_KEY = 'membership_coverage'
+CACHE_VERSION_KEY = 'membership_coverage:version'
+CACHE_TIMEOUT = 60 * 60 * 6
+FETCH_CHUNK_SIZE = 20000
+
+
+def _ordinal(day):
+    return day.toordinal()
+
+
+def _fetch(rows, columns):
+    """Stream `rows` into one NumPy array per (converter, dtype) column"""
+    chunks = [[] for _ in columns]
+    buffer = []
+
+    def flush():
+        if buffer:
+            for i, (convert, dtype) in enumerate(columns):
+                chunks[i].append(np.fromiter((convert(row[i]) for row in buffer), dtype=dtype, count=len(buffer)))
+            buffer.clear()
+
+    for row in rows.iterator(chunk_size=FETCH_CHUNK_SIZE):
+        buffer.append(row)
+        if len(buffer) >= FETCH_CHUNK_SIZE:
+            flush()
+    flush()
+    return [np.concatenate(parts) if parts else np.empty(0, dtype=dtype) for parts, (_, dtype) in zip(chunks, columns)]
+
+
+# -------------------------
+# Loading
+# -------------------------
+NO_DAY = -1
+
+
+def _day_or_none(value):
+    if value is None:
+        return NO_DAY
+    if isinstance(value, datetime):
+        value = timezone.localdate(value)
+    return value.toordinal()
+
+
+def load_subscriptions():
+    """(id, member id, start, end, cancelled) arrays, sorted by id; missing days are NO_DAY"""
+    rows = MemberSubscription.objects.order_by('id').values_list(
+        'id', 'member_id', 'start_date', 'end_date', 'cancelled_at'
+    )
+    return _fetch(rows, [
+        (int, np.int64),
+        (int, np.int64),
+        (_ordinal, np.int64),
+        (_day_or_none, np.int64),
+        (_day_or_none, np.int64),
+    ])
+
+
+def load_payments():
+    """(subscription id or 0, paid day, amount) arrays for completed payments"""
+    rows = Payment.objects.filter(payment_status='Completed').order_by().values_list(
+        'member_subscription_id', 'payment_date', 'amount'
+    )
+    return _fetch(rows, [
+        (lambda value: value or 0, np.int64),
+        (_day_or_none, np.int64),
+        (float, np.float64),
+    ])
+
+
+# -------------------------
+# Sweeps
+# -------------------------
+def _spread(origin, length, starts, stops, values):
+    """Per-day sum of `values`, each added on every day in [start, stop)"""
+    diff = np.zeros(length + 1, dtype=np.float64)
+    np.add.at(diff, starts - origin, values)
+    np.add.at(diff, stops - origin, -values)
+    return np.cumsum(diff[:-1])
+
+
+def _merge_intervals(members, starts, stops):
+    """Union each member's [start, stop) intervals so overlaps count once"""
+    order = np.lexsort((starts, members))
+    members, starts, stops = members[order], starts[order], stops[order]
+
+    # Running max of stop within each member: offset every member's values
+    # above the previous member's so one accumulate never crosses members
+    group = np.concatenate(([0], np.cumsum(members[1:] != members[:-1])))
+    span = int(stops.max() - starts.min()) + 1
+    offset = group * span - starts.min()
+    reach = np.maximum.accumulate(stops + offset) - offset
+
+    new_run = np.ones(members.size, dtype=bool)
+    new_run[1:] = (group[1:] != group[:-1]) | (starts[1:] > reach[:-1])
+    run_ids = np.cumsum(new_run) - 1
+    run_starts = starts[new_run]
+    run_stops = np.zeros(run_starts.size, dtype=np.int64)
+    np.maximum.at(run_stops, run_ids, reach)
+    return run_starts, run_stops
+
+
+def compute_coverage(subscriptions, payments, today=None):
+    """
+    Daily series from the arrays returned by load_subscriptions() and
+    load_payments(). Returns None when there is nothing to report.
+    """
+    sub_ids, members, starts, ends, cancelled = subscriptions
+    pay_subs, paid_days, amounts = payments
+    if sub_ids.size == 0 and pay_subs.size == 0:
+        return None
+    today = (today or timezone.localdate()).toordinal()
+
+    # Coverage runs through end_date (open-ended subscriptions: through
+    # today), or stops early on the day the subscription was cancelled.
+    # Inactive rows with no cancelled_at (deactivated before it existed)
+    # have no known cancellation day, so they are not cut
+    has_end = ends != NO_DAY
+    stops = np.where(has_end, ends + 1, np.maximum(today + 1, starts))
+    cut = (cancelled != NO_DAY) & (cancelled < stops)
+    stops = np.where(cut, np.maximum(cancelled, starts), stops)
+    covering = stops > starts
+
+    # Payments for a subscription with a term are earned over that term
+    if sub_ids.size:
+        position = np.minimum(np.searchsorted(sub_ids, pay_subs), sub_ids.size - 1)
+        matched = (pay_subs != 0) & (sub_ids[position] == pay_subs) & has_end[position]
+        sub_start, sub_end, sub_stop = starts[position], ends[position], stops[position]
+    else:
+        matched = np.zeros(pay_subs.size, dtype=bool)
+        sub_start = sub_end = sub_stop = paid_days
+    term_start = np.where(matched, sub_start, paid_days)
+    term_end = np.where(matched, np.maximum(sub_end + 1, sub_start + 1), paid_days + 1)
+    earn_stop = np.where(matched, np.clip(sub_stop, term_start, term_end), term_end)
+
+    bounds = [values for values in (starts, stops, paid_days, term_end) if values.size]
+    origin = int(min(values.min() for values in bounds))
+    length = int(max(values.max() for values in bounds)) - origin + 1
+
+    members_covered = np.zeros(length)
+    if covering.any():
+        run_starts, run_stops = _merge_intervals(members[covering], starts[covering], stops[covering])
+        members_covered = _spread(origin, length, run_starts, run_stops, np.ones(run_starts.size))
+
+    rate = amounts / (term_end - term_start)
+    recognized = _spread(origin, length, term_start, earn_stop, rate)
+    # Cancelled early: what was left of the term is earned on the cancellation day
+    np.add.at(recognized, earn_stop - origin, rate * (term_end - earn_stop))
+
+    billed = np.bincount(paid_days - origin, weights=amounts, minlength=length)
+    deferred = np.cumsum(billed) - np.cumsum(recognized)
+
+    return {
+        'origin': origin,
+        'members': np.rint(members_covered).astype(np.int64),
+        'billed': billed,
+        'recognized': recognized,
+        'deferred': deferred,
+    }
+
+
+# -------------------------
+# Cached reports
+# -------------------------
+def invalidate():
+    """Drop the cached series; called when a payment or subscription changes"""
+    try:
+        cache.incr(CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(CACHE_VERSION_KEY, 1, None)
+
+
+def _series():
+    version = cache.get_or_set(CACHE_VERSION_KEY, 0, None)
+    key = f'{CACHE_KEY}:{version}'
+    series = cache.get(key)
+    if series is None:
+        series = compute_coverage(load_subscriptions(), load_payments()) or {}
+        cache.set(key, series, CACHE_TIMEOUT)
+    return series
+
+
+def _month_key(ordinal):
+    day = date.fromordinal(int(ordinal))
+    return day.year * 12 + day.month - 1
+
+
+def coverage_report(start, end, group='day'):
+    """
+    Members covered, revenue billed / recognized and the deferred balance
+    from `start` to `end` inclusive, per day or per month. For months,
+    members and deferred are the values on the month's last day in range.
+    """
+    days = np.arange(start.toordinal(), end.toordinal() + 1)
+    series = _series()
+    members = np.zeros(days.size)
+    billed = np.zeros(days.size)
+    recognized = np.zeros(days.size)
+    deferred = np.zeros(days.size)
+
+    if series:
+        index = days - series['origin']
+        inside = (index >= 0) & (index < series['billed'].size)
+        members[inside] = series['members'][index[inside]]
+        billed[inside] = series['billed'][index[inside]]
+        recognized[inside] = series['recognized'][index[inside]]
+        deferred[inside] = series['deferred'][index[inside]]
+        # The balance carries past the last day anything happened
+        deferred[index >= series['deferred'].size] = series['deferred'][-1]
+
+    if group == 'month':
+        months = np.array([_month_key(day) for day in days])
+        first = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+        last = np.r_[first[1:] - 1, days.size - 1]
+        labels = [date.fromordinal(int(days[i])).replace(day=1) for i in first]
+        members, deferred = members[last], deferred[last]
+        billed = np.add.reduceat(billed, first)
+        recognized = np.add.reduceat(recognized, first)
+    else:
+        labels = [date.fromordinal(int(day)) for day in days]
+
+    return {
+        'labels': [label.isoformat() for label in labels],
+        'members': [int(value) for value in members],
+        'billed': [round(float(value), 2) for value in billed],
+        'recognized': [round(float(value), 2) for value in recognized],
+        'deferred': [round(float(value), 2) for value in deferred],
+    }
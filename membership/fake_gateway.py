@@ -0,0 +1,367 @@
+import base64
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+from django.utils import timezone
+
+# A local stand-in for the Khalti, eSewa and Dodo APIs, for end-to-end
+# checkout testing without the real sandboxes. Point the app at it with
+# PAYMENT_GATEWAY_URL (see settings). It serves:
+#
+#   /khalti/api/v2/epayment/initiate/   POST  start a payment -> pidx, payment_url
+#   /khalti/api/v2/epayment/lookup/     POST  status of a pidx
+#   /khalti/pay/<pidx>/                 GET   "the member pays" -> back to return_url
+#   /esewa/api/epay/main/v2/form        POST  the checkout form -> success/failure URL
+#   /esewa/api/epay/transaction/status/ GET   status of a transaction_uuid
+#   /dodo/checkouts                     POST  create a checkout session
+#   /dodo/checkouts/<id>                GET   session status
+#   /dodo/pay/<id>/                     GET   "the member pays" -> back to return_url
+#
+# API calls (not the pages a browser is sent to) wait `latency` seconds plus
+# up to `jitter`, and answer 503 with probability `error_rate`. Payments are
+# declined (member cancels) with probability `decline_rate`. Everything is
+# kept in memory and lost when the server stops.
+#
+# With webhooks configured, paying (or declining) a Khalti or Dodo payment
+# also POSTs a signed notification to the app, from a background thread,
+# the way the real gateways notify the merchant.
+
+ESEWA_TEST_SECRET = '8gBm/:&EnhH.1/q'
+KHALTI_MIN_AMOUNT = 1000  # paisa
+
+
+def esewa_signature(fields, names, secret=ESEWA_TEST_SECRET):
+    message = ','.join(f"{name}={fields[name]}" for name in names)
+    digest = hmac.new(secret.encode(), message.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def khalti_webhook_headers(body, secret):
+    return {'X-Khalti-Signature': hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()}
+
+
+def dodo_webhook_headers(body, secret):
+    """Standard Webhooks headers, signed with a whsec_<base64 key> secret"""
+    webhook_id = f"msg_{uuid.uuid4().hex[:24]}"
+    timestamp = str(int(time.time()))
+    key = base64.b64decode(secret.removeprefix('whsec_'))
+    digest = hmac.new(key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+    return {
+        'webhook-id': webhook_id,
+        'webhook-timestamp': timestamp,
+        'webhook-signature': f"v1,{base64.b64encode(digest).decode()}",
+    }
+
+
+class GatewayState:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, decline_rate=0.0, seed=None, webhooks=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.khalti = {}
+        self.esewa = {}
+        self.dodo = {}
+        self.requests = Counter()
+        # {'khalti' | 'dodo': (url, secret)}
+        self.webhooks = webhooks or {}
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def delay(self):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    def notify(self, provider, payload):
+        """Send a signed webhook to the app in the background, if one is configured for `provider`"""
+        if provider not in self.webhooks:
+            return
+        url, secret = self.webhooks[provider]
+        body = json.dumps(payload).encode()
+        sign = khalti_webhook_headers if provider == 'khalti' else dodo_webhook_headers
+        headers = {'Content-Type': 'application/json', **sign(body, secret)}
+
+        def send():
+            self.delay()
+            try:
+                with urlopen(Request(url, data=body, headers=headers, method='POST'), timeout=10) as response:
+                    status = response.status
+            except URLError as error:
+                status = getattr(error, 'code', 'unreachable')
+            with self.lock:
+                self.requests[f'{provider} webhook ({status})'] += 1
+
+        threading.Thread(target=send, daemon=True).start()
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeGateway/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    # -------------------------
+    # Plumbing
+    # -------------------------
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_body(self):
+        # Always drain the body, or the next request on a kept-alive connection breaks
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+
+    def _json_body(self):
+        try:
+            return json.loads(self.body or b'{}')
+        except ValueError:
+            return None
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, data):
+        self._send(status, json.dumps(data).encode())
+
+    def _redirect(self, url):
+        self._send(302, headers={'Location': url}, content_type='text/plain')
+
+    def _api(self, endpoint):
+        """Simulated network latency and outages for server-to-server calls; True = carry on"""
+        self.state.requests[endpoint] += 1
+        self.state.delay()
+        if self.state.roll(self.state.error_rate):
+            self.state.requests[f'{endpoint} (503)'] += 1
+            self._json(503, {'detail': 'Service temporarily unavailable.'})
+            return False
+        return True
+
+    def _route(self, method):
+        path = urlsplit(self.path).path
+        for route_method, prefix, handler in self.ROUTES:
+            if method == route_method and path.startswith(prefix):
+                return handler(self, path[len(prefix):].strip('/'))
+        self._json(404, {'detail': 'Not found.'})
+
+    def do_GET(self):
+        self._read_body()
+        self._route('GET')
+
+    def do_POST(self):
+        self._read_body()
+        self._route('POST')
+
+    # -------------------------
+    # Khalti
+    # -------------------------
+    def khalti_initiate(self, _):
+        if not self._api('khalti initiate'):
+            return
+        if not self.headers.get('Authorization', '').startswith('Key '):
+            return self._json(401, {'detail': 'Invalid token.', 'status_code': 401})
+        data = self._json_body()
+        if data is None:
+            return self._json(400, {'detail': 'Invalid JSON.', 'error_key': 'validation_error'})
+        missing = [name for name in ('return_url', 'website_url', 'amount', 'purchase_order_id', 'purchase_order_name')
+                   if not data.get(name)]
+        if missing:
+            return self._json(400, {**{name: ['This field is required.'] for name in missing},
+                                    'error_key': 'validation_error'})
+        if int(data['amount']) < KHALTI_MIN_AMOUNT:
+            return self._json(400, {'amount': ['Amount should be greater than Rs. 10, that is 1000 paisa.'],
+                                    'error_key': 'validation_error'})
+
+        pidx = uuid.uuid4().hex[:22]
+        with self.state.lock:
+            self.state.khalti[pidx] = {**data, 'status': 'Initiated', 'transaction_id': None}
+        self._json(200, {
+            'pidx': pidx,
+            'payment_url': f"{self.server.base_url}/khalti/pay/{pidx}/",
+            'expires_at': (timezone.now() + timedelta(minutes=30)).isoformat(),
+            'expires_in': 1800,
+        })
+
+    def khalti_pay(self, pidx):
+        payment = self.state.khalti.get(pidx)
+        if payment is None:
+            return self._json(404, {'detail': 'Not found.'})
+        declined = self.state.roll(self.state.decline_rate)
+        payment['status'] = 'User canceled' if declined else 'Completed'
+        payment['transaction_id'] = None if declined else uuid.uuid4().hex[:22]
+        params = {
+            'pidx': pidx,
+            'status': payment['status'],
+            'amount': payment['amount'],
+            'total_amount': payment['amount'],
+            'purchase_order_id': payment['purchase_order_id'],
+            'purchase_order_name': payment['purchase_order_name'],
+        }
+        if not declined:
+            params.update(transaction_id=payment['transaction_id'], txnId=payment['transaction_id'], mobile='98XXXXX904')
+        self.state.notify('khalti', {**params, 'total_amount': int(payment['amount'])})
+        self._redirect(f"{payment['return_url']}{'&' if '?' in payment['return_url'] else '?'}{urlencode(params)}")
+
+    def khalti_lookup(self, _):
+        if not self._api('khalti lookup'):
+            return
+        data = self._json_body() or {}
+        payment = self.state.khalti.get(data.get('pidx'))
+        if payment is None:
+            return self._json(404, {'detail': 'Not found.', 'error_key': 'validation_error'})
+        self._json(200, {
+            'pidx': data['pidx'],
+            'total_amount': int(payment['amount']),
+            'status': payment['status'],
+            'transaction_id': payment['transaction_id'],
+            'fee': 0,
+            'refunded': False,
+        })
+
+    # -------------------------
+    # eSewa
+    # -------------------------
+    def esewa_form(self, _):
+        fields = {name: values[0] for name, values in parse_qs(self.body.decode()).items()}
+        names = fields.get('signed_field_names', '').split(',')
+        if not all(name in fields for name in names) or esewa_signature(fields, names) != fields.get('signature'):
+            return self._send(400, b'Invalid payload signature.', content_type='text/plain')
+
+        declined = self.state.roll(self.state.decline_rate)
+        status = 'CANCELED' if declined else 'COMPLETE'
+        with self.state.lock:
+            self.state.esewa[fields['transaction_uuid']] = {'status': status, 'total_amount': fields['total_amount']}
+        if declined:
+            return self._redirect(fields['failure_url'])
+
+        response = {
+            'transaction_code': uuid.uuid4().hex[:7].upper(),
+            'status': status,
+            'total_amount': fields['total_amount'],
+            'transaction_uuid': fields['transaction_uuid'],
+            'product_code': fields['product_code'],
+            'signed_field_names': 'transaction_code,status,total_amount,transaction_uuid,product_code,signed_field_names',
+        }
+        response['signature'] = esewa_signature(response, response['signed_field_names'].split(','))
+        data = base64.b64encode(json.dumps(response).encode()).decode()
+        success_url = fields['success_url']
+        self._redirect(f"{success_url}{'&' if '?' in success_url else '?'}{urlencode({'data': data})}")
+
+    def esewa_status(self, _):
+        if not self._api('esewa status'):
+            return
+        query = {name: values[0] for name, values in parse_qs(urlsplit(self.path).query).items()}
+        transaction = self.state.esewa.get(query.get('transaction_uuid'))
+        self._json(200, {
+            'product_code': query.get('product_code'),
+            'transaction_uuid': query.get('transaction_uuid'),
+            'total_amount': query.get('total_amount'),
+            'status': transaction['status'] if transaction else 'NOT_FOUND',
+            'ref_id': None,
+        })
+
+    # -------------------------
+    # Dodo
+    # -------------------------
+    def dodo_create(self, _):
+        if not self._api('dodo create'):
+            return
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._json(401, {'code': 'UNAUTHORIZED', 'message': 'Missing API key.'})
+        data = self._json_body()
+        if not data or not data.get('product_cart'):
+            return self._json(422, {'code': 'INVALID_REQUEST', 'message': 'product_cart is required.'})
+
+        session_id = f"cks_{uuid.uuid4().hex[:24]}"
+        with self.state.lock:
+            self.state.dodo[session_id] = {
+                'return_url': data.get('return_url') or '',
+                'metadata': data.get('metadata') or {},
+                'created_at': timezone.now().isoformat(),
+                'payment_id': None,
+                'payment_status': None,
+            }
+        self._json(200, {'session_id': session_id, 'checkout_url': f"{self.server.base_url}/dodo/pay/{session_id}/"})
+
+    def dodo_retrieve(self, session_id):
+        if not self._api('dodo retrieve'):
+            return
+        session = self.state.dodo.get(session_id)
+        if session is None:
+            return self._json(404, {'code': 'NOT_FOUND', 'message': 'Checkout session not found.'})
+        self._json(200, {
+            'id': session_id,
+            'created_at': session['created_at'],
+            'payment_id': session['payment_id'],
+            'payment_status': session['payment_status'],
+        })
+
+    def dodo_pay(self, session_id):
+        session = self.state.dodo.get(session_id)
+        if session is None:
+            return self._json(404, {'code': 'NOT_FOUND', 'message': 'Checkout session not found.'})
+        declined = self.state.roll(self.state.decline_rate)
+        session['payment_status'] = 'failed' if declined else 'succeeded'
+        session['payment_id'] = f"pay_{uuid.uuid4().hex[:24]}"
+        self.state.notify('dodo', {
+            'business_id': 'bus_fake',
+            'type': 'payment.failed' if declined else 'payment.succeeded',
+            'timestamp': timezone.now().isoformat(),
+            'data': {
+                'payload_type': 'Payment',
+                'payment_id': session['payment_id'],
+                'checkout_session_id': session_id,
+                'status': session['payment_status'],
+                'metadata': session['metadata'],
+            },
+        })
+        params = urlencode({'payment_id': session['payment_id'], 'status': session['payment_status']})
+        return_url = session['return_url']
+        self._redirect(f"{return_url}{'&' if '?' in return_url else '?'}{params}")
+
+    ROUTES = [
+        ('POST', '/khalti/api/v2/epayment/initiate', khalti_initiate),
+        ('POST', '/khalti/api/v2/epayment/lookup', khalti_lookup),
+        ('GET', '/khalti/pay', khalti_pay),
+        ('POST', '/esewa/api/epay/main/v2/form', esewa_form),
+        ('GET', '/esewa/api/epay/transaction/status', esewa_status),
+        ('POST', '/dodo/checkouts', dodo_create),
+        ('GET', '/dodo/checkouts', dodo_retrieve),
+        ('GET', '/dodo/pay', dodo_pay),
+    ]
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, state, verbose=False):
+        super().__init__(address, GatewayHandler)
+        self.state = state
+        self.verbose = verbose
+        host, port = self.server_address[:2]
+        self.base_url = f"http://{host}:{port}"
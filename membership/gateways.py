@@ -0,0 +1,475 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+import numpy as np
+import requests
+from django.conf import settings
+from django.utils.html import format_html_join
+from requests.adapters import HTTPAdapter
+
+# Payment gateways, shared by membership and private class checkouts.
+#
+# One provider object per gateway (khalti, esewa, dodo below) lives for the
+# whole process. Each keeps a requests.Session whose connection pool holds
+# up to PAYMENT_GATEWAY_POOL_SIZE keep-alive connections, so a checkout
+# reuses an open TLS connection instead of handshaking again, and every call
+# gets the (connect, read) PAYMENT_GATEWAY_TIMEOUT. The Dodo SDK client
+# (which pools over httpx) is created on first use, not at import.
+#
+# Each call also has an async twin (ainitiate, alookup, ais_completed, ...)
+# for the async checkout views, which goes through an httpx.AsyncClient (or
+# AsyncDodoPayments) with the same pool size and timeouts. An async client
+# belongs to the event loop it was made on. Under ASGI the server's loop
+# lives as long as the worker, so trainwise/asgi.py calls
+# keep_async_clients_open() and each loop keeps one client with its
+# connections open. Under WSGI every async view runs on a fresh loop that
+# is gone after the request, so each call opens a client and closes it
+# when done; the clients share one SSL context to keep that cheap.
+#
+# Every call is timed per (provider, operation) in `metrics`; failures are
+# counted and logged on the 'trainwise.gateways' logger. The numbers are
+# per process.
+#
+# Where the gateways live comes from settings (KHALTI_API_URL,
+# ESEWA_FORM_URL, ESEWA_STATUS_URL, DODO_PAYMENTS_BASE_URL), so the whole
+# checkout can run against the stand-in from `manage.py fake_gateway`.
+
+logger = logging.getLogger('trainwise.gateways')
+
+# eSewa's published test secret, used when ESEWA_SECRET_KEY is empty
+ESEWA_TEST_SECRET = '8gBm/:&EnhH.1/q'
+ESEWA_SIGNED_FIELDS = ('total_amount', 'transaction_uuid', 'product_code')
+
+
+class GatewayError(Exception):
+    """A gateway call failed: network error, timeout, or an error response"""
+
+    def __init__(self, provider, operation, message, status=None):
+        super().__init__(f"{provider} {operation}: {message}")
+        self.provider = provider
+        self.operation = operation
+        self.status = status
+
+
+# -------------------------
+# Metrics
+# -------------------------
+class OperationStats:
+    def __init__(self, window):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, duration, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total += duration
+        self.slowest = max(self.slowest, duration)
+        self.recent.append(duration)
+
+    def as_dict(self):
+        recent = np.array(self.recent) * 1000 if self.recent else np.zeros(1)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'error_rate': round(self.errors / self.calls, 4) if self.calls else 0,
+            'mean_ms': round(self.total * 1000 / self.calls, 1) if self.calls else 0,
+            'p50_ms': round(float(np.percentile(recent, 50)), 1),
+            'p95_ms': round(float(np.percentile(recent, 95)), 1),
+            'max_ms': round(self.slowest * 1000, 1),
+        }
+
+
+class GatewayMetrics:
+    """Call counts, errors and latency per (provider, operation); percentiles over the last `window` calls"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, provider, operation, duration, failed=False):
+        with self._lock:
+            stats = self._stats.get((provider, operation))
+            if stats is None:
+                stats = self._stats[(provider, operation)] = OperationStats(self.window)
+            stats.add(duration, failed)
+
+    def snapshot(self):
+        with self._lock:
+            items = sorted(self._stats.items())
+            snapshot = {}
+            for (provider, operation), stats in items:
+                snapshot.setdefault(provider, {})[operation] = stats.as_dict()
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+metrics = GatewayMetrics()
+
+
+def _timeout():
+    """PAYMENT_GATEWAY_TIMEOUT as (connect, read)"""
+    return getattr(settings, 'PAYMENT_GATEWAY_TIMEOUT', (3.05, 10))
+
+
+def _pool_size():
+    return getattr(settings, 'PAYMENT_GATEWAY_POOL_SIZE', 10)
+
+
+def _httpx_timeout():
+    connect, read = _timeout()
+    return httpx.Timeout(read, connect=connect)
+
+
+@functools.cache
+def _ssl_context():
+    return httpx.create_ssl_context()
+
+
+def _async_http_client():
+    pool_size = _pool_size()
+    return httpx.AsyncClient(
+        verify=_ssl_context(),
+        timeout=_httpx_timeout(),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+    )
+
+
+_keep_async_clients = False
+
+
+def keep_async_clients_open():
+    """Keep one async client per event loop; only for long-lived loops (ASGI)"""
+    global _keep_async_clients
+    _keep_async_clients = True
+
+
+def _failed(provider, operation, started, error):
+    """Record and log a call that raised, and raise it again as GatewayError"""
+    metrics.record(provider, operation, time.perf_counter() - started, failed=True)
+    logger.warning("%s %s failed: %s", provider, operation, error)
+    raise GatewayError(provider, operation, str(error) or type(error).__name__) from error
+
+
+# -------------------------
+# Providers
+# -------------------------
+class PaymentGateway:
+    """Base for HTTP gateways: one pooled session, strict timeouts, timed calls"""
+    name = None
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def timeout(self):
+        return _timeout()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    # No automatic retries: a payment call may not be safe to repeat
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_pool_size(), max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    @asynccontextmanager
+    async def async_client(self):
+        """The running loop's httpx.AsyncClient, or one for this call only"""
+        if _keep_async_clients:
+            loop = asyncio.get_running_loop()
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = _async_http_client()
+            yield client
+            return
+        async with _async_http_client() as client:
+            yield client
+
+    def _request(self, operation, method, url, **kwargs):
+        """Make a timed call; returns the response or raises GatewayError"""
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as error:
+            _failed(self.name, operation, started, error)
+        return self._checked(operation, response, started)
+
+    async def _arequest(self, operation, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            async with self.async_client() as client:
+                response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as error:
+            _failed(self.name, operation, started, error)
+        return self._checked(operation, response, started)
+
+    def _checked(self, operation, response, started):
+        failed = response.status_code >= 400
+        metrics.record(self.name, operation, time.perf_counter() - started, failed=failed)
+        if failed:
+            logger.warning("%s %s returned %s: %s", self.name, operation, response.status_code, response.text[:200])
+            raise GatewayError(self.name, operation, f"HTTP {response.status_code}", status=response.status_code)
+        return response
+
+    def _json(self, operation, method, url, **kwargs):
+        return self._decoded(operation, self._request(operation, method, url, **kwargs))
+
+    async def _ajson(self, operation, method, url, **kwargs):
+        return self._decoded(operation, await self._arequest(operation, method, url, **kwargs))
+
+    def _decoded(self, operation, response):
+        try:
+            return response.json()
+        except ValueError as error:
+            raise GatewayError(self.name, operation, "invalid JSON in response") from error
+
+
+class KhaltiGateway(PaymentGateway):
+    name = 'khalti'
+
+    def url(self, path):
+        return f"{settings.KHALTI_API_URL.rstrip('/')}/{path.lstrip('/')}"
+
+    @property
+    def configured(self):
+        return bool(getattr(settings, 'KHALTI_SECRET_KEY', ''))
+
+    def _headers(self):
+        return {'Authorization': f"Key {settings.KHALTI_SECRET_KEY}"}
+
+    def _initiate_payload(self, return_url, website_url, amount, purchase_order_id, purchase_order_name, customer):
+        return {
+            'return_url': return_url,
+            'website_url': website_url,
+            'amount': amount,
+            'purchase_order_id': purchase_order_id,
+            'purchase_order_name': purchase_order_name,
+            'customer_info': {
+                'name': customer.get_full_name() or customer.username,
+                'email': customer.email or '',
+                'phone': getattr(customer, 'phone', '') or '',
+            },
+        }
+
+    def _started(self, data):
+        if not data.get('pidx') or not data.get('payment_url'):
+            raise GatewayError(self.name, 'initiate', "response missing pidx or payment URL")
+        return data['pidx'], data['payment_url']
+
+    def initiate(self, *, return_url, website_url, amount, purchase_order_id, purchase_order_name, customer):
+        """Start a payment; returns (pidx, URL to send the member to)"""
+        payload = self._initiate_payload(
+            return_url, website_url, amount, purchase_order_id, purchase_order_name, customer
+        )
+        return self._started(
+            self._json('initiate', 'POST', self.url('epayment/initiate/'), headers=self._headers(), json=payload)
+        )
+
+    async def ainitiate(self, *, return_url, website_url, amount, purchase_order_id, purchase_order_name, customer):
+        payload = self._initiate_payload(
+            return_url, website_url, amount, purchase_order_id, purchase_order_name, customer
+        )
+        return self._started(
+            await self._ajson('initiate', 'POST', self.url('epayment/initiate/'), headers=self._headers(), json=payload)
+        )
+
+    def lookup(self, pidx):
+        """The payment's status record (status, total_amount, ...)"""
+        return self._json('lookup', 'POST', self.url('epayment/lookup/'), headers=self._headers(), json={'pidx': pidx})
+
+    async def alookup(self, pidx):
+        return await self._ajson(
+            'lookup', 'POST', self.url('epayment/lookup/'), headers=self._headers(), json={'pidx': pidx}
+        )
+
+
+class EsewaGateway(PaymentGateway):
+    name = 'esewa'
+
+    def __init__(self):
+        super().__init__()
+        self._mac = None
+        self._mac_secret = None
+
+    @property
+    def product_code(self):
+        return getattr(settings, 'ESEWA_MERCHANT_CODE', '') or 'EPAYTEST'
+
+    def sign(self, fields, names=ESEWA_SIGNED_FIELDS):
+        """Base64 HMAC-SHA256 of 'name=value,...', as eSewa expects"""
+        secret = getattr(settings, 'ESEWA_SECRET_KEY', '') or ESEWA_TEST_SECRET
+        if self._mac is None or self._mac_secret != secret:
+            # Keying HMAC is the costly part; copy the keyed state per message
+            self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+            self._mac_secret = secret
+        mac = self._mac.copy()
+        mac.update(','.join(f"{name}={fields[name]}" for name in names).encode())
+        return base64.b64encode(mac.digest()).decode()
+
+    def form_url(self):
+        return settings.ESEWA_FORM_URL
+
+    def form(self, *, transaction_uuid, amount, success_url, failure_url):
+        """Hidden inputs for the checkout form that posts to form_url()"""
+        fields = {
+            'amount': amount,
+            'tax_amount': 0,
+            'total_amount': amount,
+            'transaction_uuid': str(transaction_uuid),
+            'product_code': self.product_code,
+            'product_service_charge': 0,
+            'product_delivery_charge': 0,
+            'success_url': success_url,
+            'failure_url': failure_url,
+            'signed_field_names': ','.join(ESEWA_SIGNED_FIELDS),
+        }
+        fields['signature'] = self.sign(fields)
+        return format_html_join('', '<input type="hidden" name="{}" value="{}">', fields.items())
+
+    def _status_params(self, transaction_uuid, amount):
+        return {
+            'product_code': self.product_code,
+            'total_amount': amount,
+            'transaction_uuid': str(transaction_uuid),
+        }
+
+    def is_completed(self, transaction_uuid, amount):
+        """Whether eSewa has the transaction as COMPLETE"""
+        params = self._status_params(transaction_uuid, amount)
+        return self._json('status', 'GET', settings.ESEWA_STATUS_URL, params=params).get('status') == 'COMPLETE'
+
+    async def ais_completed(self, transaction_uuid, amount):
+        params = self._status_params(transaction_uuid, amount)
+        data = await self._ajson('status', 'GET', settings.ESEWA_STATUS_URL, params=params)
+        return data.get('status') == 'COMPLETE'
+
+
+class DodoGateway:
+    """Dodo checkout sessions through the SDK, whose client is built on first use"""
+    name = 'dodo'
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _client_options(self):
+        return {
+            'bearer_token': os.environ.get("DODO_PAYMENTS_API_KEY"),
+            'environment': "test_mode",
+            'base_url': settings.DODO_PAYMENTS_BASE_URL,
+            'timeout': _httpx_timeout(),
+            'max_retries': 0,
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from dodopayments import DodoPayments
+                    self._client = DodoPayments(**self._client_options())
+        return self._client
+
+    def _new_async_client(self):
+        from dodopayments import AsyncDodoPayments
+        return AsyncDodoPayments(**self._client_options(), http_client=_async_http_client())
+
+    @asynccontextmanager
+    async def async_client(self):
+        """The running loop's AsyncDodoPayments, or one for this call only"""
+        if _keep_async_clients:
+            loop = asyncio.get_running_loop()
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = self._new_async_client()
+            yield client
+            return
+        client = self._new_async_client()
+        try:
+            yield client
+        finally:
+            await client.close()
+
+    def _call(self, operation, function, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            _failed(self.name, operation, started, error)
+        metrics.record(self.name, operation, time.perf_counter() - started)
+        return result
+
+    async def _acall(self, operation, call):
+        """Like _call, with `call` taking the async client and returning the awaitable"""
+        started = time.perf_counter()
+        try:
+            async with self.async_client() as client:
+                result = await call(client)
+        except Exception as error:
+            _failed(self.name, operation, started, error)
+        metrics.record(self.name, operation, time.perf_counter() - started)
+        return result
+
+    def create_checkout(self, *, product_id, return_url, metadata=None):
+        """(session id, checkout URL) for one unit of `product_id`; metadata comes back in webhooks"""
+        session = self._call(
+            'create_checkout', self.client.checkout_sessions.create,
+            product_cart=[{'product_id': product_id, 'quantity': 1}],
+            return_url=return_url,
+            metadata=metadata,
+        )
+        return session.session_id, session.checkout_url
+
+    async def acreate_checkout(self, *, product_id, return_url, metadata=None):
+        session = await self._acall('create_checkout', lambda client: client.checkout_sessions.create(
+            product_cart=[{'product_id': product_id, 'quantity': 1}],
+            return_url=return_url,
+            metadata=metadata,
+        ))
+        return session.session_id, session.checkout_url
+
+    def payment_status(self, session_id):
+        """The session's payment status as a lowercase string ('succeeded', 'failed', ...) or ''"""
+        return self._status(self._call('retrieve_checkout', self.client.checkout_sessions.retrieve, session_id))
+
+    async def apayment_status(self, session_id):
+        return self._status(
+            await self._acall('retrieve_checkout', lambda client: client.checkout_sessions.retrieve(session_id))
+        )
+
+    def _status(self, session):
+        status = getattr(session, 'payment_status', None) or getattr(session, 'status', None)
+        status = getattr(status, 'value', status)
+        return str(status).lower() if status else ''
+
+
+khalti = KhaltiGateway()
+esewa = EsewaGateway()
+dodo = DodoGateway()
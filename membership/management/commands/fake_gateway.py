@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from membership.fake_gateway import GatewayServer, GatewayState
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for the Khalti, eSewa and Dodo APIs (set PAYMENT_GATEWAY_URL to use it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=0, help="Delay added to every API call")
+        parser.add_argument('--jitter-ms', type=float, default=0, help="Up to this much extra random delay")
+        parser.add_argument('--error-rate', type=float, default=0, help="Share of API calls answered with 503 (0-1)")
+        parser.add_argument('--decline-rate', type=float, default=0, help="Share of payments the member cancels (0-1)")
+        parser.add_argument('--seed', type=int, help="Seed for reproducible errors and declines")
+        parser.add_argument('--webhook-url', help="Where the app runs (e.g. http://127.0.0.1:8000), to send "
+                                                  "it signed Khalti/Dodo webhooks with the *_WEBHOOK_SECRET settings")
+        parser.add_argument('--verbose', action='store_true', help="Log every request")
+
+    def handle(self, *args, **options):
+        for name in ('error_rate', 'decline_rate'):
+            if not 0 <= options[name] <= 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be between 0 and 1.")
+        if options['latency_ms'] < 0 or options['jitter_ms'] < 0:
+            raise CommandError("--latency-ms and --jitter-ms can't be negative.")
+
+        webhooks = {}
+        if options['webhook_url']:
+            base_url = options['webhook_url'].rstrip('/')
+            for provider, secret in (('khalti', settings.KHALTI_WEBHOOK_SECRET), ('dodo', settings.DODO_WEBHOOK_SECRET)):
+                if secret:
+                    webhooks[provider] = (f"{base_url}{reverse(f'{provider}-webhook')}", secret)
+                else:
+                    self.stderr.write(f"{provider.upper()}_WEBHOOK_SECRET is not set; no {provider} webhooks.")
+
+        state = GatewayState(
+            latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'],
+            seed=options['seed'],
+            webhooks=webhooks,
+        )
+        server = GatewayServer((options['host'], options['port']), state, verbose=options['verbose'])
+        self.stdout.write(self.style.SUCCESS(f"Fake payment gateway on {server.base_url}"))
+        self.stdout.write(f"Run the app with PAYMENT_GATEWAY_URL={server.base_url}. Ctrl+C to stop.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            for endpoint, count in sorted(state.requests.items()):
+                self.stdout.write(f"  {endpoint}: {count}")
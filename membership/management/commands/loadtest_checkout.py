@@ -0,0 +1,229 @@
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import numpy as np
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve, reverse
+
+from accounts import synthetic
+from accounts.models import User
+from membership.models import MembershipPlan
+
+# Drives complete membership purchases against a running server: log in,
+# open the checkout page, submit the chosen gateway's form and follow the
+# redirects through the gateway and back to the app's return view. Meant to
+# run against the fake gateway (PAYMENT_GATEWAY_URL) and a throwaway
+# database, since every completed checkout creates a real subscription.
+
+PROVIDERS = ('khalti', 'esewa', 'dodo')
+# Where a paid checkout ends up: the view that verified it and rendered the receipt
+RETURN_VIEWS = {'khalti': 'khalti-return-membership', 'esewa': 'success', 'dodo': 'dodo-payment-return'}
+PERCENTILES = (50, 90, 95, 99)
+
+
+class FormParser(HTMLParser):
+    """Every <form> on a page as {'action': ..., 'fields': {name: value}}"""
+
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self.forms.append({'action': attrs.get('action') or '', 'fields': {}})
+        elif tag == 'input' and self.forms and attrs.get('name'):
+            self.forms[-1]['fields'][attrs['name']] = attrs.get('value') or ''
+
+
+def _forms(html):
+    parser = FormParser()
+    parser.feed(html)
+    return parser.forms
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = np.array(values) * 1000
+    return {f'p{p}': round(float(np.percentile(values, p)), 1) for p in PERCENTILES}
+
+
+class Command(BaseCommand):
+    help = "Run concurrent membership checkouts end to end against a running server and report throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="Where the app is running")
+        parser.add_argument('--provider', choices=PROVIDERS + ('mixed',), default='khalti')
+        parser.add_argument('--checkouts', type=int, default=100, help="Total checkouts to attempt")
+        parser.add_argument('--concurrency', type=int, default=10, help="Members checking out at once")
+        parser.add_argument('--plan', type=int, help="Plan id (default: the cheapest plan Khalti accepts)")
+        parser.add_argument('--password', default='synthetic', help="Password of the synthetic members")
+        parser.add_argument('--output', help="Also write the report to this JSON file")
+
+    def handle(self, *args, **options):
+        if options['checkouts'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--checkouts and --concurrency must be at least 1.")
+        base_url = options['base_url'].rstrip('/')
+
+        plans = MembershipPlan.objects.filter(price__gte=10).order_by('price')
+        plan = plans.filter(pk=options['plan']).first() if options['plan'] else plans.first()
+        if plan is None:
+            raise CommandError("No membership plan to buy (Khalti needs at least Rs. 10).")
+
+        # One member per worker: the pending checkout lives in the session
+        members = list(
+            User.objects.filter(role='Member', username__startswith=synthetic.USERNAME_PREFIX)
+            .order_by('pk').values_list('username', flat=True)[:options['concurrency']]
+        )
+        if len(members) < options['concurrency']:
+            raise CommandError(
+                f"Need {options['concurrency']} synthetic members, found {len(members)}. "
+                "Run generate_synthetic_data first."
+            )
+
+        providers = itertools.cycle(PROVIDERS if options['provider'] == 'mixed' else (options['provider'],))
+        jobs = iter([(index, next(providers)) for index in range(options['checkouts'])])
+        lock = threading.Lock()
+        results = []
+
+        def next_job():
+            with lock:
+                return next(jobs, None)
+
+        def worker(username):
+            session = requests.Session()
+            try:
+                self.login(session, base_url, username, options['password'])
+            except Exception as error:
+                return [{'provider': None, 'outcome': 'error', 'error': f'login failed: {error}'}]
+            done = []
+            while (job := next_job()) is not None:
+                done.append(self.checkout(session, base_url, plan, job[1]))
+            return done
+
+        self.stdout.write(
+            f"{options['checkouts']} {options['provider']} checkout(s) of '{plan.plan_name}' "
+            f"with {options['concurrency']} member(s) against {base_url}..."
+        )
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for done in pool.map(worker, members):
+                results.extend(done)
+        elapsed = time.perf_counter() - started
+
+        report = self.report(results, elapsed, options)
+        for line in self.summary(report):
+            self.stdout.write(line)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Wrote {options['output']}.")
+
+    # -------------------------
+    # One member
+    # -------------------------
+    def login(self, session, base_url, username, password):
+        login_url = f"{base_url}{reverse('login')}"
+        page = session.get(login_url, timeout=30)
+        token = next(
+            (form['fields']['csrfmiddlewaretoken'] for form in _forms(page.text)
+             if 'csrfmiddlewaretoken' in form['fields']),
+            session.cookies.get('csrftoken', ''),
+        )
+        response = session.post(
+            login_url,
+            data={'username': username, 'password': password, 'csrfmiddlewaretoken': token},
+            timeout=30,
+        )
+        if urlsplit(response.url).path == reverse('login'):
+            raise RuntimeError(f"could not log in as {username}")
+
+    def checkout(self, session, base_url, plan, provider):
+        result = {'provider': provider}
+        started = time.perf_counter()
+        try:
+            purchase_url = f"{base_url}{reverse('purchase-membership', args=[plan.pk])}"
+            page = session.post(
+                purchase_url,
+                data={'csrfmiddlewaretoken': session.cookies.get('csrftoken', '')},
+                timeout=30,
+            )
+            page.raise_for_status()
+            result['checkout_page'] = time.perf_counter() - started
+
+            form = self.gateway_form(_forms(page.text), provider)
+            paid = time.perf_counter()
+            response = session.post(urljoin(page.url, form['action']), data=form['fields'], timeout=60)
+            result['payment'] = time.perf_counter() - paid
+
+            path = urlsplit(response.url).path
+            try:
+                view = resolve(path).url_name
+            except Resolver404:
+                view = None
+            if response.status_code == 200 and view == RETURN_VIEWS[provider]:
+                result['outcome'] = 'completed'
+            else:
+                result.update(outcome='failed', error=f"ended on {view or path} ({response.status_code})")
+        except Exception as error:
+            result.update(outcome='error', error=str(error))
+        result['total'] = time.perf_counter() - started
+        return result
+
+    def gateway_form(self, forms, provider):
+        routes = {
+            'khalti': reverse('khalti-initiate-membership'),
+            'dodo': reverse('dodo-payment-checkout'),
+        }
+        for form in forms:
+            action = urlsplit(form['action']).path
+            if provider == 'esewa' and 'transaction_uuid' in form['fields']:
+                return form
+            if provider in routes and action == routes[provider]:
+                return form
+        raise RuntimeError(f"no {provider} form on the checkout page")
+
+    # -------------------------
+    # Reporting
+    # -------------------------
+    def report(self, results, elapsed, options):
+        completed = [result for result in results if result['outcome'] == 'completed']
+        errors = {}
+        for result in results:
+            if result.get('error'):
+                errors[result['error']] = errors.get(result['error'], 0) + 1
+        return {
+            'base_url': options['base_url'],
+            'provider': options['provider'],
+            'concurrency': options['concurrency'],
+            'attempted': len(results),
+            'completed': len(completed),
+            'failed': sum(result['outcome'] == 'failed' for result in results),
+            'errors': sum(result['outcome'] == 'error' for result in results),
+            'elapsed_s': round(elapsed, 2),
+            'completed_per_s': round(len(completed) / elapsed, 2) if elapsed else 0,
+            'latency_ms': {
+                'checkout': _percentiles([result['total'] for result in completed]),
+                'checkout_page': _percentiles([result['checkout_page'] for result in completed]),
+                'payment': _percentiles([result['payment'] for result in completed]),
+            },
+            'error_messages': dict(sorted(errors.items(), key=lambda item: -item[1])[:10]),
+        }
+
+    def summary(self, report):
+        yield self.style.SUCCESS(
+            f"{report['completed']}/{report['attempted']} completed in {report['elapsed_s']} s "
+            f"({report['completed_per_s']} checkouts/s); {report['failed']} failed, {report['errors']} error(s)"
+        )
+        for step, percentiles in report['latency_ms'].items():
+            if percentiles:
+                yield f"  {step:14} " + '  '.join(f"{name} {value:8.1f} ms" for name, value in percentiles.items())
+        for message, count in report['error_messages'].items():
+            yield f"  {count}x {message}"
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from membership import payments
+
+
+class Command(BaseCommand):
+    help = "Settle the checkouts behind queued payment webhooks, in batches (--loop to keep draining)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Events taken per batch")
+        parser.add_argument('--max-attempts', type=int, default=payments.MAX_ATTEMPTS,
+                            help="Give up on an event after this many tries")
+        parser.add_argument('--loop', action='store_true', help="Keep running, polling for new events")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to wait when the inbox is empty")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['max_attempts'] < 1:
+            raise CommandError("--batch-size and --max-attempts must be at least 1.")
+
+        total_events = total_settled = 0
+        while True:
+            events, settled = payments.process_inbox(options['batch_size'], options['max_attempts'])
+            total_events += events
+            total_settled += settled
+            if events:
+                self.stdout.write(f"{events} event(s), {settled} checkout(s) settled")
+            # A full batch means there is probably more waiting
+            if events == options['batch_size']:
+                continue
+            if not options['loop']:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
+
+        backlog = payments.inbox_backlog(options['max_attempts'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {total_events} event(s), settled {total_settled} checkout(s); "
+            f"{backlog['waiting']} waiting, {backlog['given_up']} given up."
+        ))
@@ -0,0 +1,44 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from membership import rollups
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+
+
+class Command(BaseCommand):
+    help = "Recompute the DailyRevenue / DailyActivity rollups from payments, subscriptions and classes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD); defaults to the oldest source row")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD); defaults to the newest source row")
+        parser.add_argument('--batch-days', type=int, default=31, help="Days recomputed per transaction")
+
+    def handle(self, *args, **options):
+        first, last = rollups.source_date_range()
+        start = _parse_date(options['start']) if options['start'] else first
+        end = _parse_date(options['end']) if options['end'] else last
+        if start is None or end is None:
+            self.stdout.write("Nothing to rebuild.")
+            return
+        if start > end:
+            raise CommandError("--start must not be after --end.")
+        if options['batch_days'] < 1:
+            raise CommandError("--batch-days must be at least 1.")
+
+        revenue_rows = activity_days = 0
+        for batch_start, batch_end in rollups.date_batches(start, end, options['batch_days']):
+            rows, days = rollups.rebuild_range(batch_start, batch_end)
+            revenue_rows += rows
+            activity_days += days
+            self.stdout.write(f"{batch_start} .. {batch_end}: {rows} revenue row(s), {days} activity day(s)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt rollups from {start} to {end}: {revenue_rows} revenue row(s), {activity_days} activity day(s)."
+        ))
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0006_privateclass_classes_pri_start_d_1deb52_idx'),
+        ('membership', '0006_alter_membershipplan_dodo_product_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_date'], name='membership__payment_58d71f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_status', 'payment_date'], name='membership__payment_918d07_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_method', 'payment_date'], name='membership__payment_f2ef4c_idx'),
+        ),
+    ]
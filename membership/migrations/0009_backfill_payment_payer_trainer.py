@@ -0,0 +1,38 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_payer_and_trainer(apps, schema_editor):
+    Payment = apps.get_model('membership', 'Payment')
+
+    last_id = 0
+    while True:
+        batch = list(
+            Payment.objects.filter(id__gt=last_id)
+            .select_related('member_subscription', 'private_class')
+            .order_by('id')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        for payment in batch:
+            if payment.member_subscription_id:
+                payment.payer_id = payment.member_subscription.member_id
+            elif payment.private_class_id:
+                payment.payer_id = payment.private_class.member_id
+                payment.trainer_id = payment.private_class.trainer_id
+
+        Payment.objects.bulk_update(batch, ['payer', 'trainer'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0008_payment_payer_trainer'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_payer_and_trainer, migrations.RunPython.noop),
+    ]
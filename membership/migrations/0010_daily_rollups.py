@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0009_backfill_payment_payer_trainer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('subscriptions_started', models.IntegerField(default=0)),
+                ('subscriptions_ended', models.IntegerField(default=0)),
+                ('subscriptions_cancelled', models.IntegerField(default=0)),
+                ('classes_booked', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='membersubscription',
+            name='cancelled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(max_length=50)),
+                ('source', models.CharField(choices=[('plan', 'Membership Plan'), ('trainer', 'Private Class Trainer')], max_length=10)),
+                ('source_id', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('payments', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['source', 'source_id', 'date'], name='membership__source_a46d5f_idx')],
+                'unique_together': {('date', 'payment_method', 'source', 'source_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:51
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def give_duplicate_uids_new_ones(apps, schema_editor):
+    # Keep the oldest payment's uid; the rest get fresh ones before uid turns unique
+    Payment = apps.get_model('membership', 'Payment')
+    duplicated = (
+        Payment.objects.values('uid').annotate(n=Count('id')).filter(n__gt=1).values_list('uid', flat=True)
+    )
+    for uid in list(duplicated):
+        for payment in Payment.objects.filter(uid=uid).order_by('id')[1:]:
+            payment.uid = uuid.uuid4()
+            payment.save(update_fields=['uid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0012_occupancy_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(give_duplicate_uids_new_ones, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=10)),
+                ('event_id', models.CharField(max_length=100)),
+                ('event_type', models.CharField(blank=True, max_length=50)),
+                ('checkout_uid', models.UUIDField(blank=True, null=True)),
+                ('provider_reference', models.CharField(blank=True, max_length=100)),
+                ('payload', models.JSONField(default=dict)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('attempted_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='membership__process_43d467_idx')],
+                'unique_together': {('provider', 'event_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CheckoutIntent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('kind', models.CharField(choices=[('membership', 'Membership'), ('private_class', 'Private Class')], max_length=20)),
+                ('details', models.JSONField(default=dict)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('provider', models.CharField(blank=True, max_length=10)),
+                ('provider_reference', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('failure_reason', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finalized_at', models.DateTimeField(blank=True, null=True)),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkout_intents', to=settings.AUTH_USER_MODEL)),
+                ('payment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='checkout_intent', to='membership.payment')),
+                ('plan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='membership.membershipplan')),
+                ('trainer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='membership__status_3f69f1_idx')],
+            },
+        ),
+    ]
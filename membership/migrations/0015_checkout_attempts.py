@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0013_checkout_intents_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=10)),
+                ('reference', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('intent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='membership.checkoutintent')),
+            ],
+            options={
+                'unique_together': {('provider', 'reference')},
+            },
+        ),
+    ]
@@ -29,17 +29,37 @@ class MemberSubscription(models.Model):
     start_date = models.DateField()
     end_date = models.DateField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    # When the subscription was deactivated, for the daily cancellation rollup
+    cancelled_at = models.DateTimeField(null=True, blank=True)
 
     def save(self, *args, **kwargs):
         # Automatically calculate end_date based on plan duration
         if self.plan and not self.end_date:
             start = self.start_date or timezone.now().date()
             self.end_date = start + timedelta(days=30 * self.plan.duration_months)
+        if self.is_active:
+            self.cancelled_at = None
+        elif self.cancelled_at is None:
+            self.cancelled_at = timezone.now()
         super().save(*args, **kwargs)
 
 # ---------------------------
 # Payments (Can be for subscriptions or private classes)
 # ---------------------------
+class PaymentQuerySet(models.QuerySet):
+    def status_totals(self):
+        """
+        Sum of amount per payment_status plus the overall total, from a single
+        GROUP BY query. Statuses with no payments come back as 0.
+        """
+        totals = {status: 0 for status, _ in Payment.PAYMENT_STATUS_CHOICES}
+        rows = self.order_by().values('payment_status').annotate(total=models.Sum('amount'))
+        for row in rows:
+            totals[row['payment_status']] = row['total'] or 0
+        totals['total'] = sum(totals.values())
+        return totals
+
+
 class Payment(models.Model):
     PAYMENT_STATUS_CHOICES = (
         ('Pending', 'Pending'),
@@ -53,7 +73,8 @@ class Payment(models.Model):
         ('Online', 'Online'),
     )
 
-    uid = models.UUIDField(default=uuid.uuid4, editable=False)
+    # Unique: the checkout's transaction id, so a payment can only be recorded once
+    uid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     member_subscription = models.ForeignKey(MemberSubscription, on_delete=models.SET_NULL, null=True, blank=True)
     private_class = models.ForeignKey(PrivateClass, on_delete=models.SET_NULL, null=True, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -64,6 +85,247 @@ class Payment(models.Model):
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='Pending')
     payment_date = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized from member_subscription.member / private_class.member and
+    # private_class.trainer so per-user and per-trainer lookups hit one index
+    # instead of OR-ing across two joins
+    payer = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='payments'
+    )
+    trainer = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='trainer_payments'
+    )
+
+    objects = PaymentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['payment_date']),
+            models.Index(fields=['payment_status', 'payment_date']),
+            models.Index(fields=['payment_method', 'payment_date']),
+            models.Index(fields=['payer', 'payment_date']),
+            models.Index(fields=['trainer', 'payment_status']),
+        ]
+
     def __str__(self):
         target = self.member_subscription or self.private_class
         return f"{target} - {self.payment_status} - {self.amount}"
+
+    def save(self, *args, **kwargs):
+        # Keep the denormalized payer/trainer keys filled in
+        if self.member_subscription_id and self.payer_id is None:
+            self.payer_id = self.member_subscription.member_id
+        elif self.private_class_id:
+            if self.payer_id is None:
+                self.payer_id = self.private_class.member_id
+            if self.trainer_id is None:
+                self.trainer_id = self.private_class.trainer_id
+        super().save(*args, **kwargs)
+
+
+# ---------------------------
+# Daily rollups (maintained by membership/rollups.py)
+# ---------------------------
+class DailyRevenue(models.Model):
+    """
+    Completed payment totals per day and payment method, split by what was
+    paid for: a membership plan or a trainer's private class. source_id is a
+    plain id rather than a foreign key so history survives deleting a plan or
+    trainer; 0 means unknown.
+    """
+    SOURCE_CHOICES = (
+        ('plan', 'Membership Plan'),
+        ('trainer', 'Private Class Trainer'),
+    )
+
+    date = models.DateField()
+    payment_method = models.CharField(max_length=50)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    source_id = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    payments = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['date', 'payment_method', 'source', 'source_id']
+        indexes = [
+            models.Index(fields=['source', 'source_id', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.payment_method} {self.source}:{self.source_id} - {self.amount}"
+
+
+class DailyActivity(models.Model):
+    """Subscription and class counts per day"""
+    date = models.DateField(unique=True)
+    subscriptions_started = models.IntegerField(default=0)
+    subscriptions_ended = models.IntegerField(default=0)
+    subscriptions_cancelled = models.IntegerField(default=0)
+    classes_booked = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.date}: +{self.subscriptions_started} / -{self.subscriptions_ended} subscriptions"
+
+
+# ---------------------------
+# Door check-ins (written in batches by membership/checkins.py)
+# ---------------------------
+class CheckIn(models.Model):
+    member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='checkins')
+    scanned_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='scanned_checkins'
+    )
+    checked_in_at = models.DateTimeField(default=timezone.now)
+    # False when the member was turned away (no active subscription)
+    allowed = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['checked_in_at']),
+            models.Index(fields=['member', 'checked_in_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.member} @ {self.checked_in_at:%Y-%m-%d %H:%M}"
+
+
+# ---------------------------
+# Occupancy (entry/exit events behind the live headcount, see occupancy.py)
+# ---------------------------
+class OccupancyEvent(models.Model):
+    ENTRY = 'in'
+    EXIT = 'out'
+    KIND_CHOICES = (
+        (ENTRY, 'Entry'),
+        (EXIT, 'Exit'),
+    )
+    SOURCE_DESK = 'desk'
+    SOURCE_DEVICE = 'device'
+    SOURCE_CHOICES = (
+        (SOURCE_DESK, 'Front desk'),
+        (SOURCE_DEVICE, 'Door device'),
+    )
+
+    kind = models.CharField(max_length=3, choices=KIND_CHOICES)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default=SOURCE_DESK)
+    member = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='occupancy_events')
+    recorded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} @ {self.created_at:%Y-%m-%d %H:%M}"
+
+
+# ---------------------------
+# Checkouts and the payment webhook inbox (see membership/payments.py)
+# ---------------------------
+class CheckoutIntent(models.Model):
+    """
+    A checkout the member has started: what they are buying and for how much,
+    stored before they leave for the gateway so the purchase can be finalized
+    from a webhook even if the browser never comes back. uid is the
+    transaction id given to the gateway and becomes the Payment's uid.
+    """
+    MEMBERSHIP = 'membership'
+    PRIVATE_CLASS = 'private_class'
+    KIND_CHOICES = (
+        (MEMBERSHIP, 'Membership'),
+        (PRIVATE_CLASS, 'Private Class'),
+    )
+    PENDING = 'pending'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    )
+
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='checkout_intents')
+    plan = models.ForeignKey(MembershipPlan, on_delete=models.SET_NULL, null=True, blank=True)
+    trainer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Start date, and for private classes start time and durations
+    details = models.JSONField(default=dict)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Filled in once the member picks a gateway: Khalti's pidx, Dodo's session id
+    provider = models.CharField(max_length=10, blank=True)
+    provider_reference = models.CharField(max_length=100, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    failure_reason = models.CharField(max_length=255, blank=True)
+    payment = models.OneToOneField(
+        'Payment',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='checkout_intent'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    finalized_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} checkout {self.uid} - {self.status}"
+
+
+class CheckoutAttempt(models.Model):
+    """
+    A payment started for a checkout at a gateway. A member can start
+    several (double submit, back button, second tab) and pay any of them,
+    so a reference the gateway sends back is accepted if it is one of these.
+    """
+    intent = models.ForeignKey(CheckoutIntent, on_delete=models.CASCADE, related_name='attempts')
+    provider = models.CharField(max_length=10)
+    reference = models.CharField(max_length=100)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['provider', 'reference']
+
+    def __str__(self):
+        return f"{self.provider} {self.reference} for {self.intent.uid}"
+
+
+class WebhookEvent(models.Model):
+    """
+    A payment notification as received, after its signature checked out.
+    Processed in batches by `manage.py process_payment_inbox`; a replayed
+    delivery has the same (provider, event_id) and is dropped on arrival.
+    """
+    provider = models.CharField(max_length=10)
+    event_id = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=50, blank=True)
+    # Whichever of the two the notification carried, to find the checkout by
+    checkout_uid = models.UUIDField(null=True, blank=True)
+    provider_reference = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    attempted_at = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        unique_together = ['provider', 'event_id']
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type or 'event'} {self.event_id}"
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import OccupancyEvent
+
+# Live gym occupancy.
+#
+# Staff (or a door device) record entry/exit events. Each event is stored as
+# an OccupancyEvent and applied to a per-day headcount counter in the cache,
+# so reading the current headcount never touches the database. If the counter
+# is missing (cache restarted, new day), it is recomputed from today's events.
+#
+# Dashboards subscribe over Server-Sent Events. Every event loop runs one
+# broadcaster task that polls the counter and pushes changes into the queue
+# of each open stream, so open connections cost a queue each, not a thread or
+# a cache read per second.
+
+COUNTER_KEY = 'occupancy:{}'
+COUNTER_TIMEOUT = 60 * 60 * 48
+
+
+def _counter_key(day=None):
+    return COUNTER_KEY.format((day or timezone.localdate()).isoformat())
+
+
+def _count_from_events(day):
+    totals = OccupancyEvent.objects.filter(created_at__date=day).aggregate(
+        entries=Count('id', filter=Q(kind=OccupancyEvent.ENTRY)),
+        exits=Count('id', filter=Q(kind=OccupancyEvent.EXIT)),
+    )
+    return max(totals['entries'] - totals['exits'], 0)
+
+
+def current_count(day=None):
+    """People in the gym right now"""
+    day = day or timezone.localdate()
+    count = cache.get(_counter_key(day))
+    if count is None:
+        count = _count_from_events(day)
+        cache.add(_counter_key(day), count, COUNTER_TIMEOUT)
+    return max(count, 0)
+
+
+def record(kind, recorded_by=None, member=None, source=OccupancyEvent.SOURCE_DESK):
+    """Store one entry/exit event and apply it to the headcount; returns the new count"""
+    event = OccupancyEvent.objects.create(
+        kind=kind,
+        recorded_by=recorded_by,
+        member=member,
+        source=source,
+    )
+    day = timezone.localdate(event.created_at)
+    key = _counter_key(day)
+    try:
+        count = cache.incr(key, 1 if kind == OccupancyEvent.ENTRY else -1)
+    except ValueError:
+        # No counter yet; the recount already includes this event
+        cache.add(key, _count_from_events(day), COUNTER_TIMEOUT)
+        count = cache.get(key, 0)
+    if count < 0:
+        # More exits than entries (missed scans); don't show a negative headcount
+        cache.set(key, 0, COUNTER_TIMEOUT)
+        count = 0
+    return count
+
+
+def snapshot():
+    return {
+        'count': current_count(),
+        'updated_at': timezone.now().isoformat(),
+    }
+
+
+# -------------------------
+# Server-Sent Events
+# -------------------------
+def poll_interval():
+    return getattr(settings, 'OCCUPANCY_POLL_SECONDS', 1)
+
+
+class Broadcaster:
+    """Fans headcount changes out to every open stream on one event loop"""
+
+    def __init__(self):
+        self.listeners = set()
+        self.count = None
+        self.task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=1)
+        self.listeners.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.listeners.discard(queue)
+
+    def _push(self, state):
+        for queue in self.listeners:
+            # A slow client only needs the latest value
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(state)
+
+    async def _run(self):
+        while self.listeners:
+            state = await sync_to_async(snapshot)()
+            if state['count'] != self.count:
+                self.count = state['count']
+                self._push(state)
+            await asyncio.sleep(poll_interval())
+        self.count = None
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def _broadcaster():
+    loop = asyncio.get_running_loop()
+    if loop not in _broadcasters:
+        _broadcasters[loop] = Broadcaster()
+    return _broadcasters[loop]
+
+
+def _event(state):
+    return f"event: occupancy\ndata: {json.dumps(state)}\n\n"
+
+
+async def stream():
+    """Async iterator of SSE messages: the current state, then every change"""
+    broadcaster = _broadcaster()
+    queue = broadcaster.subscribe()
+    keepalive = getattr(settings, 'OCCUPANCY_KEEPALIVE_SECONDS', 20)
+    try:
+        state = await sync_to_async(snapshot)()
+        sent = state['count']
+        yield "retry: 3000\n" + _event(state)
+        while True:
+            try:
+                state = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                # Comment line so proxies don't close an idle connection
+                yield ": keepalive\n\n"
+                continue
+            if state['count'] != sent:
+                sent = state['count']
+                yield _event(state)
+    finally:
+        broadcaster.unsubscribe(queue)
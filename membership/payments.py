@@ -0,0 +1,508 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import User
+from classes.availability import booking_conflict
+from classes.models import PrivateClass
+from . import gateways
+from .models import CheckoutAttempt, CheckoutIntent, MemberSubscription, Payment, WebhookEvent
+
+# Finalizing paid checkouts.
+#
+# Starting a checkout writes a CheckoutIntent: who is buying what, for how
+# much. The purchase itself (a MemberSubscription or PrivateClass plus its
+# Payment) is only created by apply(), once the gateway confirms payment,
+# from whichever of these gets there first:
+#
+#   - the member's browser coming back to a return view, which settles the
+#     intent if it is still pending and otherwise just reads it;
+#   - a webhook, checked and stored in the WebhookEvent inbox by
+#     ingest_khalti() / ingest_dodo() and settled by process_inbox()
+#     (`manage.py process_payment_inbox`), so closing the tab after paying
+#     doesn't lose the purchase.
+#
+# Either way the gateway's status API has the final say, not the
+# notification. apply() locks the intent's row and records the Payment under
+# the intent's uid, which is unique, so duplicate, replayed or racing
+# notifications can't create a second subscription.
+#
+# A member can start several payments for one checkout (double submit, back
+# button, another gateway). Each is recorded as a CheckoutAttempt, and the
+# payment a return or webhook names is the one checked, as long as it was
+# started for this checkout.
+
+logger = logging.getLogger('trainwise.payments')
+
+PAYMENT_METHODS = {'esewa': 'Esewa', 'khalti': 'Khalti', 'dodo': 'Online Payment (Dodo)'}
+KHALTI_FAILED = {'user canceled', 'expired', 'refunded', 'partially refunded'}
+DODO_FAILED = {'failed', 'cancelled'}
+SLOT_TAKEN_REASON = (
+    "The trainer was booked for that time while you were paying. "
+    "Your payment will be refunded; please contact support."
+)
+# Dodo deliveries older than this (seconds) are refused as replays
+DODO_WEBHOOK_TOLERANCE = 300
+MAX_ATTEMPTS = 5
+# Seconds before an event whose checkout couldn't be settled is tried again
+RETRY_AFTER = 60
+
+
+def _uuid_or_none(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# -------------------------
+# Checkout intents
+# -------------------------
+def start_membership(member, plan, start_date, uid=None):
+    return CheckoutIntent.objects.create(
+        uid=uid or uuid.uuid4(),
+        kind=CheckoutIntent.MEMBERSHIP,
+        member=member,
+        plan=plan,
+        amount=plan.price,
+        details={'start_date': start_date.isoformat()},
+    )
+
+
+def start_private_class(member, trainer, price, start_date, start_time, duration_hours, duration_months, uid=None):
+    return CheckoutIntent.objects.create(
+        uid=uid or uuid.uuid4(),
+        kind=CheckoutIntent.PRIVATE_CLASS,
+        member=member,
+        trainer=trainer,
+        amount=price,
+        details={
+            'start_date': start_date.isoformat(),
+            'start_time': start_time.strftime('%H:%M'),
+            'duration_hours': duration_hours,
+            'duration_months': duration_months,
+        },
+    )
+
+
+async def aget_intent(uid, member):
+    """The member's checkout with this uid, or None"""
+    if not member.is_authenticated:
+        return None
+    try:
+        return await CheckoutIntent.objects.aget(uid=uid, member=member)
+    except (CheckoutIntent.DoesNotExist, ValidationError):
+        return None
+
+
+async def achoose_provider(intent, provider, reference=''):
+    """Record the gateway the member went to (and its reference for the payment) while still pending"""
+    intent.provider, intent.provider_reference = provider, reference
+    await CheckoutIntent.objects.filter(pk=intent.pk, status=CheckoutIntent.PENDING).aupdate(
+        provider=provider, provider_reference=reference
+    )
+    if reference:
+        await CheckoutAttempt.objects.aget_or_create(provider=provider, reference=reference, defaults={'intent': intent})
+
+
+def _issued(intent, provider, reference):
+    # Only references started for this checkout: Khalti's lookup doesn't say which order a pidx paid for
+    return CheckoutAttempt.objects.filter(intent=intent, provider=provider, reference=reference)
+
+
+def _attempt(intent, provider, reference):
+    """The (provider, reference) to verify; a reference not started for this intent falls back to the latest"""
+    provider = provider or intent.provider
+    if reference and (
+        (provider, reference) == (intent.provider, intent.provider_reference)
+        or _issued(intent, provider, reference).exists()
+    ):
+        return provider, reference
+    return provider, _reference_for(intent, provider)
+
+
+async def areceipt(intent):
+    """A completed intent's Payment, with what it paid for"""
+    return await Payment.objects.select_related(
+        'member_subscription__plan', 'private_class__trainer'
+    ).aget(pk=intent.payment_id)
+
+
+# -------------------------
+# Verifying and finalizing
+# -------------------------
+def _khalti_outcome(intent, data):
+    status = (data.get('status') or '').lower()
+    if status == 'completed':
+        if 'total_amount' in data and int(data.get('total_amount') or 0) != int(intent.amount * 100):
+            return CheckoutIntent.FAILED, "Khalti payment amount mismatch. Please contact support."
+        if 'purchase_order_id' in data and str(data.get('purchase_order_id')) != str(intent.uid):
+            return CheckoutIntent.FAILED, "Khalti payment reference mismatch. Please contact support."
+        return CheckoutIntent.COMPLETED, ''
+    if status in KHALTI_FAILED:
+        return CheckoutIntent.FAILED, "Khalti payment was not completed."
+    return CheckoutIntent.PENDING, ''
+
+
+def _esewa_outcome(completed):
+    return (CheckoutIntent.COMPLETED if completed else CheckoutIntent.PENDING), ''
+
+
+def _dodo_outcome(status):
+    if status == 'succeeded':
+        return CheckoutIntent.COMPLETED, ''
+    if status in DODO_FAILED:
+        return CheckoutIntent.FAILED, "Payment not completed. Please try again."
+    return CheckoutIntent.PENDING, ''
+
+
+def _reference_for(intent, provider):
+    # The reference recorded belongs to intent.provider's payment
+    return intent.provider_reference if provider == intent.provider else ''
+
+
+def verify(intent, provider=None, reference=None):
+    """
+    (status, failure reason) for the intent according to `provider`'s
+    gateway, by default the one it last went to, about `reference`, by
+    default the latest payment started there; raises GatewayError
+    """
+    provider = provider or intent.provider
+    reference = reference or _reference_for(intent, provider)
+    if provider == 'khalti' and reference:
+        return _khalti_outcome(intent, gateways.khalti.lookup(reference))
+    if provider == 'esewa':
+        return _esewa_outcome(gateways.esewa.is_completed(intent.uid, float(intent.amount)))
+    if provider == 'dodo' and reference:
+        return _dodo_outcome(gateways.dodo.payment_status(reference))
+    return CheckoutIntent.PENDING, ''
+
+
+async def averify(intent, provider=None, reference=None):
+    provider = provider or intent.provider
+    reference = reference or _reference_for(intent, provider)
+    if provider == 'khalti' and reference:
+        return _khalti_outcome(intent, await gateways.khalti.alookup(reference))
+    if provider == 'esewa':
+        return _esewa_outcome(await gateways.esewa.ais_completed(intent.uid, float(intent.amount)))
+    if provider == 'dodo' and reference:
+        return _dodo_outcome(await gateways.dodo.apayment_status(reference))
+    return CheckoutIntent.PENDING, ''
+
+
+class SlotTaken(Exception):
+    """The private class's slot was booked by someone else before payment completed"""
+
+
+def _create_purchase(intent):
+    details = intent.details
+    payment_fields = {
+        'uid': intent.uid,
+        'amount': intent.amount,
+        'tax_amount': 0,
+        'service_charge': 0,
+        'delivery_charge': 0,
+        'payment_method': PAYMENT_METHODS.get(intent.provider, intent.provider),
+        'payment_status': 'Completed',
+    }
+    if intent.kind == CheckoutIntent.MEMBERSHIP:
+        subscription = MemberSubscription.objects.create(
+            member_id=intent.member_id,
+            plan=intent.plan,
+            start_date=date.fromisoformat(details['start_date']),
+            is_active=True,
+        )
+        return Payment.objects.create(member_subscription=subscription, **payment_fields)
+
+    # Another worker, or a payment that took a while, may have taken the slot
+    # since checkout started. Locking the trainer's row serializes bookings
+    # for them, so two paid checkouts can't both pass this check.
+    start_date = date.fromisoformat(details['start_date'])
+    start_time = datetime.strptime(details['start_time'], '%H:%M').time()
+    User.objects.select_for_update().filter(pk=intent.trainer_id).exists()
+    clash = booking_conflict(
+        intent.trainer_id, start_date, start_time, details['duration_hours'], details['duration_months']
+    )
+    if clash:
+        raise SlotTaken(f"trainer {intent.trainer_id} is booked {clash[0]:%Y-%m-%d %H:%M}-{clash[1]:%H:%M}")
+
+    private_class = PrivateClass.objects.create(
+        member_id=intent.member_id,
+        trainer=intent.trainer,
+        start_date=start_date,
+        start_time=start_time,
+        duration_hours=details['duration_hours'],
+        duration_months=details['duration_months'],
+        price=intent.amount,
+        is_active=True,
+    )
+    return Payment.objects.create(private_class=private_class, **payment_fields)
+
+
+def apply(intent_id, status, reason='', provider=None, reference=None):
+    """
+    Settle a pending intent as `status`, creating the purchase if it was
+    paid. Does nothing to a completed intent, so it is safe to call again
+    for the same payment; a failed one can still be completed.
+
+    `provider` and `reference` name the payment that gave the status when
+    it isn't the one the intent last went to (the member tried Khalti, then
+    paid with eSewa, or paid the first of two Khalti payments they started):
+    only its confirmed payment counts, and the intent is switched over to
+    it. Returns the intent.
+    """
+    if status == CheckoutIntent.PENDING:
+        return CheckoutIntent.objects.get(pk=intent_id)
+
+    with transaction.atomic():
+        intent = CheckoutIntent.objects.select_for_update().select_related('plan', 'trainer').get(pk=intent_id)
+        # A failed checkout can still be paid by another payment the member started
+        if intent.status == CheckoutIntent.COMPLETED or (
+            intent.status == CheckoutIntent.FAILED and status != CheckoutIntent.COMPLETED
+        ):
+            return intent
+        provider = provider or intent.provider
+        reference = reference or _reference_for(intent, provider)
+        if (provider, reference) != (intent.provider, intent.provider_reference):
+            # Another payment's failure says nothing about the latest one
+            if status != CheckoutIntent.COMPLETED:
+                return intent
+            intent.provider, intent.provider_reference = provider, reference
+        if status == CheckoutIntent.COMPLETED:
+            # A payment with this uid may already exist; link it rather than record a second one
+            intent.payment = Payment.objects.filter(uid=intent.uid).first()
+            if intent.payment is None:
+                try:
+                    with transaction.atomic():
+                        intent.payment = _create_purchase(intent)
+                except IntegrityError:
+                    intent.payment = Payment.objects.get(uid=intent.uid)
+                except SlotTaken as clash:
+                    status, reason = CheckoutIntent.FAILED, SLOT_TAKEN_REASON
+                    logger.error("checkout %s paid via %s but %s; needs a refund", intent.uid, provider, clash)
+        intent.failure_reason = '' if status == CheckoutIntent.COMPLETED else reason[:255]
+        intent.status = status
+        intent.finalized_at = timezone.now()
+        intent.save(update_fields=[
+            'status', 'payment', 'failure_reason', 'finalized_at', 'provider', 'provider_reference'
+        ])
+    logger.info("checkout %s %s via %s", intent.uid, status, intent.provider or '-')
+    return intent
+
+
+def _is_settled(intent, provider, reference):
+    # A failed intent is only worth asking about again for a different payment
+    return intent.status == CheckoutIntent.FAILED and (provider, reference) == (
+        intent.provider, intent.provider_reference
+    )
+
+
+def settle(intent, provider=None, reference=None):
+    """
+    Ask the gateway about a pending intent and apply the answer; raises
+    GatewayError. `provider` and `reference` are the gateway and payment a
+    return or webhook came from, if known.
+    """
+    if intent.status == CheckoutIntent.COMPLETED:
+        return intent
+    provider, reference = _attempt(intent, provider, reference)
+    if _is_settled(intent, provider, reference):
+        return intent
+    status, reason = verify(intent, provider, reference)
+    return apply(intent.pk, status, reason, provider, reference)
+
+
+async def asettle(intent, provider=None, reference=None):
+    """settle() for the async return views: a settled intent costs no gateway call"""
+    if intent.status == CheckoutIntent.COMPLETED:
+        return intent
+    provider, reference = await sync_to_async(_attempt)(intent, provider, reference)
+    if _is_settled(intent, provider, reference):
+        return intent
+    status, reason = await averify(intent, provider, reference)
+    return await sync_to_async(apply)(intent.pk, status, reason, provider, reference)
+
+
+# -------------------------
+# Webhook inbox
+# -------------------------
+def verify_khalti_signature(headers, body):
+    """Hex HMAC-SHA256 of the raw body with KHALTI_WEBHOOK_SECRET, in X-Khalti-Signature"""
+    secret = getattr(settings, 'KHALTI_WEBHOOK_SECRET', '')
+    supplied = headers.get('X-Khalti-Signature', '')
+    if not secret or not supplied:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(supplied.lower(), expected)
+
+
+def verify_dodo_signature(headers, body, now=None):
+    """Standard Webhooks: base64 HMAC-SHA256 of '<id>.<timestamp>.<body>' keyed with the whsec_ secret"""
+    secret = getattr(settings, 'DODO_WEBHOOK_SECRET', '')
+    webhook_id = headers.get('webhook-id', '')
+    timestamp = headers.get('webhook-timestamp', '')
+    signatures = headers.get('webhook-signature', '')
+    if not (secret and webhook_id and timestamp and signatures):
+        return False
+    try:
+        sent = int(timestamp)
+        key = base64.b64decode(secret.removeprefix('whsec_'))
+    except ValueError:
+        return False
+    if abs((now or time.time()) - sent) > DODO_WEBHOOK_TOLERANCE:
+        return False
+    signed = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+    # Space-separated "v1,<signature>" entries, one per active secret
+    return any(
+        hmac.compare_digest(entry.partition(',')[2], expected)
+        for entry in signatures.split() if entry.startswith('v1,')
+    )
+
+
+def _store(provider, event_id, event_type, payload, checkout_uid=None, provider_reference=''):
+    _, created = WebhookEvent.objects.get_or_create(
+        provider=provider,
+        event_id=event_id[:100],
+        defaults={
+            'event_type': event_type[:50],
+            'checkout_uid': checkout_uid,
+            'provider_reference': provider_reference[:100],
+            'payload': payload,
+        },
+    )
+    return created
+
+
+def ingest_khalti(headers, body):
+    """
+    Store a verified Khalti notification ({pidx, status, purchase_order_id,
+    ...}, like the return URL's query). Returns False for a repeat delivery;
+    raises ValueError if the body isn't one.
+    """
+    payload = json.loads(body)
+    if not isinstance(payload, dict) or not payload.get('pidx'):
+        raise ValueError("Khalti notification without a pidx.")
+    # Khalti sends no delivery id; identical bodies are the same notification
+    event_id = headers.get('X-Khalti-Event-Id') or hashlib.sha256(body).hexdigest()
+    return _store(
+        'khalti', event_id, str(payload.get('status') or ''), payload,
+        checkout_uid=_uuid_or_none(payload.get('purchase_order_id')),
+        provider_reference=str(payload['pidx']),
+    )
+
+
+def ingest_dodo(headers, body):
+    """
+    Store a verified Dodo payment.* webhook; other event types are
+    acknowledged and dropped. Returns whether a new event was stored;
+    raises ValueError if the body isn't a webhook.
+    """
+    payload = json.loads(body)
+    if not isinstance(payload, dict) or not isinstance(payload.get('data'), dict):
+        raise ValueError("Dodo webhook without data.")
+    event_type = str(payload.get('type') or '')
+    if not event_type.startswith('payment.'):
+        return False
+    data = payload['data']
+    return _store(
+        'dodo', headers.get('webhook-id', ''), event_type, payload,
+        checkout_uid=_uuid_or_none((data.get('metadata') or {}).get('checkout_uid')),
+        provider_reference=str(data.get('checkout_session_id') or ''),
+    )
+
+
+def process_inbox(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    """
+    Settle the checkouts behind the oldest unprocessed inbox events: one
+    gateway check per checkout however many events name it. Events whose
+    check failed, or whose payment the gateway still reports as pending,
+    are tried again RETRY_AFTER seconds later, up to max_attempts. Returns
+    (events taken, checkouts settled).
+    """
+    now = timezone.now()
+    due = Q(attempted_at__isnull=True) | Q(attempted_at__lte=now - timedelta(seconds=RETRY_AFTER))
+    events = list(
+        WebhookEvent.objects.filter(due, processed_at__isnull=True, attempts__lt=max_attempts)
+        .order_by('id')[:batch_size]
+    )
+    if not events:
+        return 0, 0
+
+    uids = {event.checkout_uid for event in events if event.checkout_uid}
+    references = {event.provider_reference for event in events if event.provider_reference}
+    intents = {
+        intent.pk: intent
+        for intent in CheckoutIntent.objects.filter(
+            Q(uid__in=uids) | Q(provider_reference__in=references) | Q(attempts__reference__in=references)
+        ).distinct()
+    }
+    by_uid, payments_of = {}, {}
+    for intent in intents.values():
+        by_uid[intent.uid] = intent
+        if intent.provider_reference:
+            payments_of[(intent.provider, intent.provider_reference)] = intent
+    for attempt in CheckoutAttempt.objects.filter(intent__in=intents):
+        payments_of[(attempt.provider, attempt.reference)] = intents[attempt.intent_id]
+
+    # One gateway check per payment the events name, e.g. each Khalti pidx the member started
+    groups = {}
+    for event in events:
+        payment = (event.provider, event.provider_reference)
+        intent = by_uid.get(event.checkout_uid) or payments_of.get(payment)
+        event.attempts += 1
+        event.attempted_at = now
+        if intent is not None and payments_of.get(payment) is not intent:
+            # Without a reference it is about the latest payment at that gateway
+            if not event.provider_reference and event.provider == intent.provider:
+                payment = (intent.provider, intent.provider_reference)
+            else:
+                intent = None
+        if intent is None:
+            event.processed_at, event.error = now, "No matching checkout."
+            continue
+        groups.setdefault((intent.pk, payment), []).append(event)
+
+    settled = 0
+    for (intent_pk, (provider, reference)), payment_events in groups.items():
+        intent, error = intents[intent_pk], ''
+        # Already completed (usually by the member's browser): nothing to ask the gateway
+        if intent.status != CheckoutIntent.COMPLETED:
+            before = intent.status
+            try:
+                intent = intents[intent_pk] = settle(intent, provider, reference)
+            except gateways.GatewayError as failure:
+                error = str(failure)
+            else:
+                if intent.status == CheckoutIntent.PENDING:
+                    error = "Gateway still reports the payment as pending."
+                elif intent.status != before:
+                    settled += 1
+        for event in payment_events:
+            event.error = error[:255]
+            if not error:
+                event.processed_at = now
+
+    WebhookEvent.objects.bulk_update(events, ['attempts', 'attempted_at', 'processed_at', 'error'])
+    return len(events), settled
+
+
+def inbox_backlog(max_attempts=MAX_ATTEMPTS):
+    """Unprocessed inbox events: still to try, and given up on"""
+    unprocessed = WebhookEvent.objects.filter(processed_at__isnull=True)
+    return {
+        'waiting': unprocessed.filter(attempts__lt=max_attempts).count(),
+        'given_up': unprocessed.filter(attempts__gte=max_attempts).count(),
+    }
@@ -0,0 +1,297 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from classes.models import PrivateClass
+from .models import Payment, MemberSubscription, DailyRevenue, DailyActivity
+
+# Daily revenue and activity rollups.
+#
+# Every Payment, MemberSubscription and PrivateClass remembers the state it
+# was loaded with (see signals.py). When it is saved or deleted, its old
+# contribution to the rollups is subtracted and the new one added, with F()
+# increments so concurrent writers don't lose updates. rebuild_range()
+# recomputes a date range from the source tables with grouped aggregates and
+# is used by the rebuild_rollups command.
+#
+# Revenue is dated by payment_date and only counts Completed payments.
+# Subscriptions count as started on start_date, ended on end_date and
+# cancelled on the day they were deactivated; classes count on the day they
+# were booked. Days are in the current time zone.
+
+ACTIVITY_FIELDS = ('subscriptions_started', 'subscriptions_ended', 'subscriptions_cancelled', 'classes_booked')
+
+
+def _local_date(value):
+    return timezone.localdate(value) if value is not None else None
+
+
+# -------------------------
+# Instance state
+# -------------------------
+PAYMENT_STATE_FIELDS = ('payment_status', 'payment_date', 'payment_method', 'amount', 'member_subscription_id', 'trainer_id')
+SUBSCRIPTION_STATE_FIELDS = ('start_date', 'end_date', 'cancelled_at')
+CLASS_STATE_FIELDS = ('created_at',)
+
+
+def snapshot(instance, fields):
+    """The tracked field values, or None if any of them was deferred"""
+    deferred = instance.get_deferred_fields()
+    if any(field in deferred for field in fields):
+        return None
+    return tuple(getattr(instance, field) for field in fields)
+
+
+def stored_state(instance, fields):
+    """Tracked values as currently stored in the database"""
+    return type(instance).objects.filter(pk=instance.pk).values_list(*fields).first()
+
+
+# -------------------------
+# Contributions
+# -------------------------
+def _payment_contribution(state):
+    """{revenue key: (amount, payments)} for one payment state"""
+    if state is None:
+        return {}
+    status, paid_at, method, amount, subscription_id, trainer_id = state
+    if status != 'Completed' or paid_at is None:
+        return {}
+    if subscription_id:
+        plan_id = MemberSubscription.objects.filter(pk=subscription_id).values_list('plan_id', flat=True).first()
+        key = (_local_date(paid_at), method, 'plan', plan_id or 0)
+    else:
+        key = (_local_date(paid_at), method, 'trainer', trainer_id or 0)
+    return {key: (amount, 1)}
+
+
+def _subscription_contribution(state):
+    if state is None:
+        return {}
+    start_date, end_date, cancelled_at = state
+    counts = defaultdict(int)
+    if start_date:
+        counts[(start_date, 'subscriptions_started')] += 1
+    if end_date:
+        counts[(end_date, 'subscriptions_ended')] += 1
+    if cancelled_at:
+        counts[(_local_date(cancelled_at), 'subscriptions_cancelled')] += 1
+    return counts
+
+
+def _class_contribution(state):
+    if state is None or state[0] is None:
+        return {}
+    return {(_local_date(state[0]), 'classes_booked'): 1}
+
+
+# -------------------------
+# Applying deltas
+# -------------------------
+def _apply_revenue(deltas):
+    for (day, method, source, source_id), (amount, payments) in deltas.items():
+        if not amount and not payments:
+            continue
+        lookup = {'date': day, 'payment_method': method, 'source': source, 'source_id': source_id}
+        DailyRevenue.objects.bulk_create([DailyRevenue(**lookup)], ignore_conflicts=True)
+        DailyRevenue.objects.filter(**lookup).update(
+            amount=F('amount') + amount,
+            payments=F('payments') + payments,
+        )
+
+
+def _apply_activity(deltas):
+    by_day = defaultdict(dict)
+    for (day, field), count in deltas.items():
+        if count:
+            by_day[day][field] = count
+    for day, fields in by_day.items():
+        DailyActivity.objects.bulk_create([DailyActivity(date=day)], ignore_conflicts=True)
+        DailyActivity.objects.filter(date=day).update(**{field: F(field) + count for field, count in fields.items()})
+
+
+def payment_changed(old_state, new_state):
+    if old_state == new_state:
+        return
+    deltas = defaultdict(lambda: (0, 0))
+    for key, (amount, payments) in _payment_contribution(old_state).items():
+        total, count = deltas[key]
+        deltas[key] = (total - amount, count - payments)
+    for key, (amount, payments) in _payment_contribution(new_state).items():
+        total, count = deltas[key]
+        deltas[key] = (total + amount, count + payments)
+    with transaction.atomic():
+        _apply_revenue(deltas)
+
+
+def _counts_changed(old, new):
+    deltas = defaultdict(int)
+    for key, count in old.items():
+        deltas[key] -= count
+    for key, count in new.items():
+        deltas[key] += count
+    with transaction.atomic():
+        _apply_activity(deltas)
+
+
+def subscription_changed(old_state, new_state):
+    if old_state != new_state:
+        _counts_changed(_subscription_contribution(old_state), _subscription_contribution(new_state))
+
+
+def class_changed(old_state, new_state):
+    if old_state != new_state:
+        _counts_changed(_class_contribution(old_state), _class_contribution(new_state))
+
+
+# -------------------------
+# Rebuild
+# -------------------------
+def source_date_range():
+    """First and last day any source row falls on, or (None, None)"""
+    bounds = [
+        *Payment.objects.filter(payment_status='Completed').aggregate(
+            Min('payment_date'), Max('payment_date')
+        ).values(),
+        *MemberSubscription.objects.aggregate(
+            Min('start_date'), Max('start_date'),
+            Min('end_date'), Max('end_date'),
+            Min('cancelled_at'), Max('cancelled_at'),
+        ).values(),
+        *PrivateClass.objects.aggregate(Min('created_at'), Max('created_at')).values(),
+    ]
+    days = [_local_date(value) if isinstance(value, datetime) else value for value in bounds if value is not None]
+    if not days:
+        return None, None
+    return min(days), max(days)
+
+
+def rebuild_range(start, end):
+    """Recompute every rollup row from `start` to `end` inclusive"""
+    payments = Payment.objects.filter(
+        payment_status='Completed',
+        payment_date__date__gte=start,
+        payment_date__date__lte=end,
+    ).annotate(day=TruncDate('payment_date'))
+
+    revenue = []
+    plan_rows = payments.filter(member_subscription__isnull=False).values(
+        'day', 'payment_method', source_key=F('member_subscription__plan_id')
+    ).annotate(total=Sum('amount'), count=Count('id'))
+    trainer_rows = payments.filter(member_subscription__isnull=True).values(
+        'day', 'payment_method', source_key=F('trainer_id')
+    ).annotate(total=Sum('amount'), count=Count('id'))
+    for source, rows in (('plan', plan_rows), ('trainer', trainer_rows)):
+        for row in rows.order_by():
+            revenue.append(DailyRevenue(
+                date=row['day'],
+                payment_method=row['payment_method'],
+                source=source,
+                source_id=row['source_key'] or 0,
+                amount=row['total'],
+                payments=row['count'],
+            ))
+    revenue = _merge_revenue(revenue)
+
+    activity = defaultdict(lambda: dict.fromkeys(ACTIVITY_FIELDS, 0))
+    subscriptions = MemberSubscription.objects.all()
+    for field, rows in (
+        ('subscriptions_started', subscriptions.filter(start_date__range=(start, end)).values(day=F('start_date'))),
+        ('subscriptions_ended', subscriptions.filter(end_date__range=(start, end)).values(day=F('end_date'))),
+        ('subscriptions_cancelled', subscriptions.filter(
+            cancelled_at__date__gte=start, cancelled_at__date__lte=end
+        ).values(day=TruncDate('cancelled_at'))),
+        ('classes_booked', PrivateClass.objects.filter(
+            created_at__date__gte=start, created_at__date__lte=end
+        ).values(day=TruncDate('created_at'))),
+    ):
+        for row in rows.annotate(count=Count('id')).order_by():
+            activity[row['day']][field] += row['count']
+
+    with transaction.atomic():
+        DailyRevenue.objects.filter(date__range=(start, end)).delete()
+        DailyActivity.objects.filter(date__range=(start, end)).delete()
+        DailyRevenue.objects.bulk_create(revenue)
+        DailyActivity.objects.bulk_create([DailyActivity(date=day, **counts) for day, counts in activity.items()])
+
+    return len(revenue), len(activity)
+
+
+def _merge_revenue(rows):
+    # Rows whose plan/trainer was deleted share source_id 0; fold them together
+    merged = {}
+    for row in rows:
+        key = (row.date, row.payment_method, row.source, row.source_id)
+        if key in merged:
+            merged[key].amount += row.amount
+            merged[key].payments += row.payments
+        else:
+            merged[key] = row
+    return list(merged.values())
+
+
+def date_batches(start, end, days):
+    """(batch_start, batch_end) pairs covering start..end inclusive"""
+    while start <= end:
+        batch_end = min(start + timedelta(days=days - 1), end)
+        yield start, batch_end
+        start = batch_end + timedelta(days=1)
+
+
+# -------------------------
+# Reading
+# -------------------------
+def _periods(start, end, group):
+    if group == 'month':
+        period = start.replace(day=1)
+        while period <= end:
+            yield period
+            period = (period + timedelta(days=32)).replace(day=1)
+    else:
+        for offset in range((end - start).days + 1):
+            yield start + timedelta(days=offset)
+
+
+def timeseries(start, end, group='day', source=None, source_id=None):
+    """
+    Revenue per payment method and activity counts per day (or month) from
+    `start` to `end` inclusive, zero-filled. `source`/`source_id` restrict the
+    revenue to one plan or trainer.
+    """
+    period = TruncMonth('date') if group == 'month' else F('date')
+    revenue = DailyRevenue.objects.filter(date__range=(start, end))
+    if source:
+        revenue = revenue.filter(source=source, source_id=source_id)
+    revenue = revenue.values('payment_method', period=period).annotate(
+        total=Sum('amount'), count=Sum('payments'),
+    ).order_by()
+    activity = DailyActivity.objects.filter(date__range=(start, end)).values(period=period).annotate(
+        **{field: Sum(field) for field in ACTIVITY_FIELDS}
+    ).order_by()
+
+    periods = list(_periods(start, end, group))
+    index = {day: i for i, day in enumerate(periods)}
+    by_method = {}
+    payments = [0] * len(periods)
+    for row in revenue:
+        i = index[row['period']]
+        amounts = by_method.setdefault(row['payment_method'], [0.0] * len(periods))
+        amounts[i] += float(row['total'])
+        payments[i] += row['count']
+
+    counts = {field: [0] * len(periods) for field in ACTIVITY_FIELDS}
+    for row in activity:
+        i = index[row['period']]
+        for field in ACTIVITY_FIELDS:
+            counts[field][i] += row[field]
+
+    return {
+        'labels': [day.isoformat() for day in periods],
+        'revenue': {method: [round(v, 2) for v in amounts] for method, amounts in sorted(by_method.items())},
+        'payments': payments,
+        **counts,
+    }
@@ -0,0 +1,82 @@
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from classes.models import PrivateClass
+from .models import Payment, MemberSubscription
+from . import checkins, coverage, rollups
+
+
+@receiver(post_save, sender=PrivateClass)
+def sync_payment_trainer(sender, instance, created, **kwargs):
+    # The admin can reassign a class to another trainer; move its payments too
+    if created:
+        return
+    moved = Payment.objects.filter(private_class=instance).exclude(trainer_id=instance.trainer_id)
+    # .update() skips the payment signals, so move the rolled-up revenue here
+    for state in moved.filter(payment_status='Completed').values_list(*rollups.PAYMENT_STATE_FIELDS):
+        rollups.payment_changed(state, state[:-1] + (instance.trainer_id,))
+    moved.update(trainer_id=instance.trainer_id)
+
+
+# -------------------------
+# Daily rollups
+# -------------------------
+ROLLUP_MODELS = {
+    Payment: (rollups.PAYMENT_STATE_FIELDS, rollups.payment_changed),
+    MemberSubscription: (rollups.SUBSCRIPTION_STATE_FIELDS, rollups.subscription_changed),
+    PrivateClass: (rollups.CLASS_STATE_FIELDS, rollups.class_changed),
+}
+
+
+def remember_rollup_state(sender, instance, **kwargs):
+    fields, _ = ROLLUP_MODELS[sender]
+    instance._rollup_state = rollups.snapshot(instance, fields) if instance.pk else None
+
+
+def load_missing_rollup_state(sender, instance, raw=False, **kwargs):
+    # Instances loaded with deferred fields have no snapshot; read it now
+    if raw or not instance.pk or getattr(instance, '_rollup_state', None) is not None:
+        return
+    fields, _ = ROLLUP_MODELS[sender]
+    instance._rollup_state = rollups.stored_state(instance, fields)
+
+
+def update_rollups_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    fields, changed = ROLLUP_MODELS[sender]
+    old_state = None if created else getattr(instance, '_rollup_state', None)
+    new_state = rollups.snapshot(instance, fields) or rollups.stored_state(instance, fields)
+    changed(old_state, new_state)
+    instance._rollup_state = new_state
+
+
+def update_rollups_on_delete(sender, instance, **kwargs):
+    _, changed = ROLLUP_MODELS[sender]
+    changed(getattr(instance, '_rollup_state', None), None)
+
+
+for model in ROLLUP_MODELS:
+    post_init.connect(remember_rollup_state, sender=model)
+    pre_save.connect(load_missing_rollup_state, sender=model)
+    post_save.connect(update_rollups_on_save, sender=model)
+    post_delete.connect(update_rollups_on_delete, sender=model)
+
+
+# -------------------------
+# Coverage / deferred revenue cache
+# -------------------------
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=MemberSubscription)
+def invalidate_coverage(sender, **kwargs):
+    transaction.on_commit(coverage.invalidate)
+
+
+# -------------------------
+# Check-in index
+# -------------------------
+@receiver([post_save, post_delete], sender=MemberSubscription)
+def refresh_checkin_index(sender, instance, **kwargs):
+    member_id = instance.member_id
+    transaction.on_commit(lambda: checkins.member_changed(member_id))
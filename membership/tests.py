@@ -1,3 +1,284 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import json
+import time
+from datetime import date, time as clock
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from classes.models import PrivateClass
+from trainwise.querybudget import assert_query_budget
+from . import gateways, payments
+from .models import CheckoutIntent, MembershipPlan, MemberSubscription, Payment, WebhookEvent
+
+KHALTI_SECRET = 'khalti-test-secret'
+DODO_KEY = b'dodo-test-key'
+DODO_SECRET = 'whsec_' + base64.b64encode(DODO_KEY).decode()
+
+
+def khalti_headers(body):
+    return {'X-Khalti-Signature': hmac.new(KHALTI_SECRET.encode(), body, hashlib.sha256).hexdigest()}
+
+
+def dodo_headers(body, webhook_id='msg_1', timestamp=None):
+    timestamp = str(int(time.time()) if timestamp is None else timestamp)
+    signed = f"{webhook_id}.{timestamp}.".encode() + body
+    signature = base64.b64encode(hmac.new(DODO_KEY, signed, hashlib.sha256).digest()).decode()
+    return {'webhook-id': webhook_id, 'webhook-timestamp': timestamp, 'webhook-signature': f'v1,{signature}'}
+
+
+@override_settings(KHALTI_WEBHOOK_SECRET=KHALTI_SECRET, DODO_WEBHOOK_SECRET=DODO_SECRET)
+class PaymentFinalizationTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create_user(username='member', password='pass', role='Member')
+        self.plan = MembershipPlan.objects.create(
+            plan_name='Monthly', duration_months=1, price=1000, dodo_product_id='prod_1'
+        )
+        self.intent = payments.start_membership(self.member, self.plan, date.today())
+        self.intent.provider, self.intent.provider_reference = 'khalti', 'pidx_1'
+        self.intent.save()
+
+    def khalti_completed(self):
+        return {'pidx': 'pidx_1', 'status': 'Completed', 'total_amount': 100000,
+                'purchase_order_id': str(self.intent.uid)}
+
+    def khalti_body(self):
+        return json.dumps(self.khalti_completed()).encode()
+
+    def dodo_body(self):
+        return json.dumps({
+            'type': 'payment.succeeded',
+            'data': {'checkout_session_id': 'cs_1', 'metadata': {'checkout_uid': str(self.intent.uid)}},
+        }).encode()
+
+    # -------------------------
+    # apply()
+    # -------------------------
+    def test_apply_twice_creates_one_subscription(self):
+        first = payments.apply(self.intent.pk, CheckoutIntent.COMPLETED)
+        second = payments.apply(self.intent.pk, CheckoutIntent.COMPLETED)
+
+        self.assertEqual(first.payment_id, second.payment_id)
+        self.assertEqual(MemberSubscription.objects.filter(member=self.member).count(), 1)
+        self.assertEqual(Payment.objects.filter(uid=self.intent.uid).count(), 1)
+
+    def test_apply_after_a_racing_caller_recorded_the_payment(self):
+        # The other caller got its Payment in under the intent's uid first
+        payments._create_purchase(self.intent)
+
+        intent = payments.apply(self.intent.pk, CheckoutIntent.COMPLETED)
+
+        self.assertEqual(intent.status, CheckoutIntent.COMPLETED)
+        self.assertEqual(intent.payment, Payment.objects.get(uid=self.intent.uid))
+        self.assertEqual(MemberSubscription.objects.filter(member=self.member).count(), 1)
+
+    def test_apply_does_not_fail_a_settled_intent(self):
+        payments.apply(self.intent.pk, CheckoutIntent.COMPLETED)
+        intent = payments.apply(self.intent.pk, CheckoutIntent.FAILED, "late failure")
+
+        self.assertEqual(intent.status, CheckoutIntent.COMPLETED)
+
+    # -------------------------
+    # Webhooks
+    # -------------------------
+    def test_replayed_khalti_notification_is_dropped(self):
+        body = self.khalti_body()
+        for _ in range(2):
+            response = self.client.post(
+                reverse('khalti-webhook'), body, content_type='application/json', headers=khalti_headers(body)
+            )
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(WebhookEvent.objects.filter(provider='khalti').count(), 1)
+
+    def test_replayed_dodo_webhook_id_is_dropped(self):
+        body = self.dodo_body()
+        self.assertTrue(payments.ingest_dodo(dodo_headers(body), body))
+        self.assertFalse(payments.ingest_dodo(dodo_headers(body), body))
+        self.assertEqual(WebhookEvent.objects.filter(provider='dodo', event_id='msg_1').count(), 1)
+
+    def test_bad_khalti_signature_is_rejected(self):
+        body = self.khalti_body()
+        response = self.client.post(
+            reverse('khalti-webhook'), body, content_type='application/json',
+            headers={'X-Khalti-Signature': '0' * 64},
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_bad_dodo_signature_is_rejected(self):
+        body = self.dodo_body()
+        headers = dodo_headers(body)
+        headers['webhook-signature'] = 'v1,' + base64.b64encode(b'x' * 32).decode()
+        response = self.client.post(reverse('dodo-webhook'), body, content_type='application/json', headers=headers)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_stale_dodo_timestamp_is_rejected(self):
+        body = self.dodo_body()
+        stale = int(time.time()) - payments.DODO_WEBHOOK_TOLERANCE - 60
+        response = self.client.post(
+            reverse('dodo-webhook'), body, content_type='application/json',
+            headers=dodo_headers(body, timestamp=stale),
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    # -------------------------
+    # Inbox and return views
+    # -------------------------
+    def test_inbox_settles_the_checkout_once(self):
+        body = self.khalti_body()
+        payments.ingest_khalti(khalti_headers(body), body)
+
+        with mock.patch.object(gateways.khalti, 'lookup', return_value=self.khalti_completed()) as lookup:
+            self.assertEqual(payments.process_inbox(), (1, 1))
+            self.assertEqual(payments.process_inbox(), (0, 0))
+
+        lookup.assert_called_once_with('pidx_1')
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.status, CheckoutIntent.COMPLETED)
+        self.assertEqual(MemberSubscription.objects.filter(member=self.member).count(), 1)
+
+    def test_return_after_webhook_does_not_ask_the_gateway_again(self):
+        body = self.khalti_body()
+        payments.ingest_khalti(khalti_headers(body), body)
+        with mock.patch.object(gateways.khalti, 'lookup', return_value=self.khalti_completed()):
+            payments.process_inbox()
+
+        self.client.force_login(self.member)
+        with mock.patch.object(gateways.khalti, 'alookup') as alookup:
+            response = self.client.get(reverse('khalti-return-membership', args=[self.intent.uid]))
+
+        alookup.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MemberSubscription.objects.filter(member=self.member).count(), 1)
+
+    def test_esewa_return_after_a_khalti_attempt(self):
+        self.client.force_login(self.member)
+        with mock.patch.object(gateways.esewa, 'ais_completed', return_value=True) as ais_completed, \
+                mock.patch.object(gateways.khalti, 'alookup') as alookup:
+            response = self.client.get(reverse('success', args=[self.intent.uid]))
+
+        ais_completed.assert_called_once()
+        alookup.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.intent.refresh_from_db()
+        self.assertEqual((self.intent.status, self.intent.provider), (CheckoutIntent.COMPLETED, 'esewa'))
+        self.assertEqual(self.intent.payment.payment_method, 'Esewa')
+
+    # -------------------------
+    # Several payments for one checkout
+    # -------------------------
+    def start_two_khalti_payments(self):
+        async_to_sync(payments.achoose_provider)(self.intent, 'khalti', 'pidx_1')
+        async_to_sync(payments.achoose_provider)(self.intent, 'khalti', 'pidx_2')
+
+    def khalti_lookup(self, pidx):
+        # Only the first payment was paid
+        return self.khalti_completed() if pidx == 'pidx_1' else {'pidx': pidx, 'status': 'Initiated'}
+
+    def test_return_with_the_first_of_two_started_payments(self):
+        self.start_two_khalti_payments()
+        self.client.force_login(self.member)
+
+        async def alookup(pidx):
+            return self.khalti_lookup(pidx)
+
+        with mock.patch.object(gateways.khalti, 'alookup', side_effect=alookup):
+            response = self.client.get(
+                reverse('khalti-return-membership', args=[self.intent.uid]), {'pidx': 'pidx_1'}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.intent.refresh_from_db()
+        self.assertEqual((self.intent.status, self.intent.provider_reference), (CheckoutIntent.COMPLETED, 'pidx_1'))
+        self.assertEqual(MemberSubscription.objects.filter(member=self.member).count(), 1)
+
+    def test_webhook_for_the_first_of_two_started_payments(self):
+        self.start_two_khalti_payments()
+        body = self.khalti_body()
+        payments.ingest_khalti(khalti_headers(body), body)
+
+        with mock.patch.object(gateways.khalti, 'lookup', side_effect=self.khalti_lookup) as lookup:
+            self.assertEqual(payments.process_inbox(), (1, 1))
+
+        lookup.assert_called_once_with('pidx_1')
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.status, CheckoutIntent.COMPLETED)
+        self.assertEqual(MemberSubscription.objects.filter(member=self.member).count(), 1)
+
+    def test_return_with_a_pidx_not_started_for_the_checkout(self):
+        self.start_two_khalti_payments()
+        self.client.force_login(self.member)
+
+        with mock.patch.object(gateways.khalti, 'alookup', return_value={'status': 'Initiated'}) as alookup:
+            self.client.get(reverse('khalti-return-membership', args=[self.intent.uid]), {'pidx': 'someone_elses'})
+
+        alookup.assert_called_once_with('pidx_2')
+        self.intent.refresh_from_db()
+        self.assertEqual(self.intent.status, CheckoutIntent.PENDING)
+
+    # -------------------------
+    # Private classes
+    # -------------------------
+    def test_paid_private_class_whose_slot_was_taken_meanwhile(self):
+        trainer = User.objects.create_user(username='trainer', password='pass', role='Trainer')
+        start = date.today()
+        intent = payments.start_private_class(self.member, trainer, 500, start, clock(7), 1, 1)
+        # Booked through another worker after this checkout started
+        other = User.objects.create_user(username='other', password='pass', role='Member')
+        PrivateClass.objects.create(
+            member=other, trainer=trainer, start_date=start, start_time=clock(7, 30),
+            duration_hours=1, duration_months=1, price=500,
+        )
+
+        intent = payments.apply(intent.pk, CheckoutIntent.COMPLETED, provider='esewa')
+
+        self.assertEqual(intent.status, CheckoutIntent.FAILED)
+        self.assertEqual(intent.failure_reason, payments.SLOT_TAKEN_REASON)
+        self.assertFalse(PrivateClass.objects.filter(member=self.member).exists())
+
+
+class PaymentQueryBudgetTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='pass', role='Admin')
+        plan = MembershipPlan.objects.create(plan_name='Monthly', duration_months=1, price=1000, dodo_product_id='p')
+        for i in range(10):
+            member = User.objects.create_user(username=f'member{i}', password='pass', role='Member')
+            subscription = MemberSubscription.objects.create(member=member, plan=plan, start_date=date.today())
+            Payment.objects.create(
+                member_subscription=subscription, amount=1000, tax_amount=0, service_charge=0,
+                delivery_charge=0, payment_method='Esewa', payment_status='Completed',
+            )
+        self.client.force_login(self.admin)
+
+    def test_admin_payments_within_budget(self):
+        with assert_query_budget(view_name='admin-payments', max_duplicates=1):
+            response = self.client.get(reverse('admin-payments'))
+        self.assertEqual(response.status_code, 200)
+
+        with assert_query_budget(view_name='admin-payments-data', max_duplicates=1):
+            response = self.client.get(reverse('admin-payments-data'), {'draw': 1, 'start': 0, 'length': 10})
+        self.assertEqual(len(response.json()['data']), 10)
+
+    def test_streamed_export_counts_against_its_budget(self):
+        budget = {'ENABLED': True, 'VIEWS': {'admin-payments-export': {'MAX_QUERIES': 0}}}
+        with override_settings(QUERY_BUDGET=budget):
+            self.client.handler.load_middleware()
+            response = self.client.get(reverse('admin-payments-export'))
+            # Nothing is reported until the body has been sent
+            with self.assertLogs('trainwise.querybudget', 'WARNING') as logs:
+                b''.join(response.streaming_content)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('admin-payments-export', logs.output[0])
+        self.assertNotIn(' 0 queries', logs.output[0])
@@ -0,0 +1,94 @@
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from itertools import accumulate
+
+from .models import MemberSubscription
+
+# A member's active subscriptions as a sorted timeline.
+#
+# Loaded with one query, then every question (where does a new plan fit,
+# is the member covered on a day, which subscription is current) is answered
+# in memory with binary searches over the sorted intervals.
+
+
+class SubscriptionTimeline:
+    def __init__(self, subscriptions):
+        self.subscriptions = sorted(
+            (sub for sub in subscriptions if sub.end_date),
+            key=lambda sub: (sub.start_date, sub.end_date),
+        )
+        self.starts = [sub.start_date for sub in self.subscriptions]
+
+        # Overlapping or back-to-back subscriptions merged into coverage blocks
+        self.block_starts = []
+        self.block_ends = []
+        for sub in self.subscriptions:
+            if self.block_ends and sub.start_date <= self.block_ends[-1] + timedelta(days=1):
+                self.block_ends[-1] = max(self.block_ends[-1], sub.end_date)
+            else:
+                self.block_starts.append(sub.start_date)
+                self.block_ends.append(sub.end_date)
+
+        # gaps[i]: free days between block i and block i + 1
+        self.gaps = [
+            (next_start - (end + timedelta(days=1))).days
+            for end, next_start in zip(self.block_ends, self.block_starts[1:])
+        ]
+
+    @classmethod
+    def for_member(cls, member):
+        """Active subscriptions for the member, in a single query"""
+        subscriptions = MemberSubscription.objects.filter(
+            member=member,
+            is_active=True
+        ).select_related('plan').order_by('start_date')
+        return cls(subscriptions)
+
+    def next_start_date(self, duration_days, today=None):
+        """
+        Earliest date from `today` on where a new subscription of
+        `duration_days` fits: the first big-enough gap, otherwise right after
+        the last active subscription.
+        """
+        today = today or date.today()
+        if not self.block_starts:
+            return today
+
+        # First coverage block that hasn't finished before today
+        k = bisect_left(self.block_ends, today)
+        if k == len(self.block_starts):
+            return today
+
+        # Room between today and that block?
+        if self.block_starts[k] > today and (self.block_starts[k] - today).days >= duration_days:
+            return today
+
+        # Earliest later gap that is big enough: the running max of the gap
+        # sizes is non-decreasing, so it can be binary searched
+        running_max = list(accumulate(self.gaps[k:], max))
+        i = bisect_left(running_max, duration_days)
+        if i < len(running_max):
+            return self.block_ends[k + i] + timedelta(days=1)
+
+        return self.block_ends[-1] + timedelta(days=1)
+
+    def covers(self, day):
+        """Is the member covered by an active subscription on `day`?"""
+        i = bisect_right(self.block_starts, day) - 1
+        return i >= 0 and self.block_ends[i] >= day
+
+    def coverage_until(self, day):
+        """Last day of the unbroken coverage that includes `day`, or None"""
+        i = bisect_right(self.block_starts, day) - 1
+        if i >= 0 and self.block_ends[i] >= day:
+            return self.block_ends[i]
+        return None
+
+    def current(self, day=None):
+        """The started, unexpired subscription on `day` that runs the longest"""
+        day = day or date.today()
+        if not self.covers(day):
+            return None
+        candidates = self.subscriptions[:bisect_right(self.starts, day)]
+        covering = [sub for sub in candidates if sub.end_date >= day]
+        return max(covering, key=lambda sub: sub.end_date, default=None)
@@ -14,7 +14,23 @@ urlpatterns = [
     # Payments Admin
     # -------------------------
     path('admin-dashboard/payments/', views.admin_payments, name='admin-payments'),
+    path('admin-dashboard/payments/data/', views.admin_payments_data, name='admin-payments-data'),
+    path('admin-dashboard/payments/export/', views.admin_payments_export, name='admin-payments-export'),
     path('admin-dashboard/payments/<int:pk>/', views.admin_payment_detail, name='admin-payment-detail'),
+    path('admin-dashboard/payments/gateways/', views.admin_gateway_metrics, name='admin-gateway-metrics'),
+
+    # -------------------------
+    # Door check-ins
+    # -------------------------
+    path('admin-dashboard/check-in/', views.checkin_desk, name='checkin-desk'),
+    path('api/check-in/scan/', views.checkin_scan, name='checkin-scan'),
+
+    # -------------------------
+    # Live occupancy
+    # -------------------------
+    path('occupancy/events/', views.occupancy_event, name='occupancy-event'),
+    path('occupancy/stream/', views.occupancy_stream, name='occupancy-stream'),
+    path('api/occupancy/events/', views.occupancy_device_event, name='occupancy-device-event'),
 
 
     # ---------------------------------
@@ -44,4 +60,8 @@ urlpatterns = [
     # Khalti placeholders
     path('khalti/initiate/membership/', views.khalti_initiate_membership, name='khalti-initiate-membership'),
     path('khalti/return/membership/<uid>/', views.khalti_return_membership, name='khalti-return-membership'),
+
+    # Gateway webhooks (stored in the inbox, see membership/payments.py)
+    path('payments/webhooks/khalti/', views.khalti_webhook, name='khalti-webhook'),
+    path('payments/webhooks/dodo/', views.dodo_webhook, name='dodo-webhook'),
 ]
@@ -1,21 +1,26 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
-from django.db.models import Sum
-from .models import MembershipPlan, MemberSubscription, Payment
+from .models import MembershipPlan, MemberSubscription, Payment, OccupancyEvent, CheckoutIntent
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 from django.urls import reverse
 from django.conf import settings
-from django_esewa import EsewaPayment
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from dodopayments import DodoPayments
-import os
+import hmac
 import uuid
 import json
-import requests
-from datetime import date, timedelta, datetime
+from asgiref.sync import sync_to_async
+from datetime import date
+from accounts.kpis import invalidate_admin_kpis
+from .timeline import SubscriptionTimeline
+from . import checkins, gateways, occupancy, payments
+from accounts.datatables import datatables_response, filter_queryset
+from accounts.exports import csv_response, stream_rows
+from accounts.roles import is_staff_member
+from accounts.views import admin_required
+from django.utils.html import escape, format_html
 
 # ===============================
 # Membership Plans
@@ -73,45 +78,150 @@ def admin_payments(request):
     status_filter = request.GET.get('status', '')
     method_filter = request.GET.get('method', '')
     
-    payments = Payment.objects.select_related(
-        'member_subscription__member', 
-        'private_class__member'
-    ).all().order_by('-payment_date')
+    # Rows are loaded page by page from admin_payments_data; the totals
+    # follow the same status/method filters as the list
+    payments = _filter_payments(Payment.objects.all(), status_filter, method_filter)
 
-    # Totals
-    total_payments = payments.aggregate(total=Sum('amount'))['total'] or 0
-    paid_amount = payments.filter(payment_status='Completed').aggregate(total=Sum('amount'))['total'] or 0
-    pending_amount = payments.filter(payment_status='Pending').aggregate(total=Sum('amount'))['total'] or 0
-    failed_amount = payments.filter(payment_status='Failed').aggregate(total=Sum('amount'))['total'] or 0
+    # Totals, one grouped query for every status
+    totals = payments.status_totals()
+    total_payments = totals['total']
+    paid_amount = totals['Completed']
+    pending_amount = totals['Pending']
+    failed_amount = totals['Failed']
 
     context = {
-        'payments': payments,
         'total_payments': total_payments,
         'paid_amount': paid_amount,
         'pending_amount': pending_amount,
         'failed_amount': failed_amount,
         'status_filter': status_filter,
         'method_filter': method_filter,
+        'payment_methods': Payment.objects.order_by('payment_method').values_list('payment_method', flat=True).distinct(),
     }
     return render(request, 'admin/payments.html', context)
 
 
 
+def _filter_payments(queryset, status='', method=''):
+    """Apply the status/method filters shared by the payments list views"""
+    if status:
+        queryset = queryset.filter(payment_status=status)
+    if method:
+        queryset = queryset.filter(payment_method=method)
+    return queryset
+
+
+# Filters and search shared by the payments list and its CSV export
+PAYMENT_LIST_FILTERS = {
+    'status': lambda qs, value: _filter_payments(qs, status=value),
+    'method': lambda qs, value: _filter_payments(qs, method=value),
+}
+PAYMENT_SEARCH_FIELDS = [
+    'member_subscription__member__first_name',
+    'member_subscription__member__last_name',
+    'private_class__member__first_name',
+    'private_class__member__last_name',
+]
+
+
+def _payment_status_badge(status):
+    if status == 'Completed':
+        css = 'badge-paid'
+    elif status == 'Pending':
+        css = 'badge-pending'
+    else:
+        css = 'badge-failed'
+    label = 'Unpaid' if status == 'Pending' else status
+    return format_html('<span class="badge {}">{}</span>', css, label)
+
+
+@login_required
+@admin_required
+def admin_payments_data(request):
+    """DataTables server-side endpoint for the admin payments list"""
+    def render_row(payment):
+        if payment.member_subscription:
+            member = payment.member_subscription.member
+        elif payment.private_class:
+            member = payment.private_class.member
+        else:
+            member = None
+        return [
+            f"#{payment.id}",
+            escape(member.full_name if member else '-'),
+            f"Rs.{payment.amount}",
+            'Subscription' if payment.member_subscription else 'Private Class',
+            escape(payment.payment_method),
+            _payment_status_badge(payment.payment_status),
+            timezone.localtime(payment.payment_date).strftime('%b %d, %Y %H:%M'),
+        ]
+
+    payments = Payment.objects.select_related(
+        'member_subscription__member',
+        'private_class__member'
+    )
+
+    return datatables_response(
+        request,
+        payments,
+        order_columns={0: ['id'], 6: ['payment_date']},
+        default_ordering=['-payment_date'],
+        search_fields=PAYMENT_SEARCH_FIELDS,
+        render_row=render_row,
+        filters=PAYMENT_LIST_FILTERS,
+    )
+
+
+@login_required
+@admin_required
+def admin_payments_export(request):
+    """Stream the payment ledger as CSV, with the list's filters and search applied"""
+    payments, _ = filter_queryset(request.GET, Payment.objects.all(), PAYMENT_LIST_FILTERS, PAYMENT_SEARCH_FIELDS)
+    rows = payments.order_by('-payment_date', '-id').values_list(
+        'id', 'uid', 'payer__first_name', 'payer__last_name', 'payer__email',
+        'member_subscription_id', 'private_class_id', 'amount', 'tax_amount',
+        'service_charge', 'delivery_charge', 'payment_method', 'payment_status', 'payment_date',
+    )
+
+    def lines():
+        for (payment_id, uid, first_name, last_name, email, subscription_id, class_id,
+                amount, tax, service, delivery, method, status, paid_at) in stream_rows(rows):
+            yield [
+                payment_id, uid, f"{first_name or ''} {last_name or ''}".strip(), email,
+                'Subscription' if subscription_id else 'Private Class' if class_id else '',
+                amount, tax, service, delivery, method, status,
+                timezone.localtime(paid_at).strftime('%Y-%m-%d %H:%M:%S'),
+            ]
+
+    return csv_response(
+        f'payments-{timezone.localdate().isoformat()}.csv',
+        ['ID', 'UID', 'Member', 'Email', 'Type', 'Amount', 'Tax', 'Service Charge',
+         'Delivery Charge', 'Method', 'Status', 'Date'],
+        lines(),
+    )
+
+
 # Optional: View single payment details (for modal or detail page)
 def admin_payment_detail(request, pk):
     payment = get_object_or_404(Payment, pk=pk)
     return render(request, 'admin/payment_detail.html', {'payment': payment})
 
 
+@login_required
+@admin_required
+def admin_gateway_metrics(request):
+    """Calls, errors and latency per payment gateway operation (this process only), and the webhook backlog"""
+    return JsonResponse({'gateways': gateways.metrics.snapshot(), 'webhook_inbox': payments.inbox_backlog()})
+
+
 def membership_plans(request):
     plans = MembershipPlan.objects.all()
     
     # Optional: check if user already subscribed
     user_subscription = None
     if request.user.is_authenticated:
-        user_subscription = MemberSubscription.objects.filter(
-            member=request.user, is_active=True
-        ).first()
+        timeline = SubscriptionTimeline.for_member(request.user)
+        user_subscription = timeline.current() or (timeline.subscriptions[0] if timeline.subscriptions else None)
     
     return render(request, 'membership/membership_plans.html', {
         'plans': plans,
@@ -134,47 +244,10 @@ def purchase_membership(request, plan_id):
         # Calculate duration in days from plan's duration_months
         duration_days = 30 * plan.duration_months
         
-        # ONLY look at active subscriptions - cancelled ones should be ignored completely
-        active_subs = MemberSubscription.objects.filter(
-            member=request.user,
-            is_active=True
-        ).order_by('start_date')
-        
-        # Default: start from today
-        start_date = today
-        
-        if active_subs.exists():
-            # We have active subscriptions, try to find a gap
-            found_gap = False
-            
-            for i, sub in enumerate(active_subs):
-                if i == 0:
-                    # Check gap before first active subscription
-                    if sub.start_date > today:
-                        gap_size = (sub.start_date - today).days
-                        if gap_size >= duration_days:
-                            # Found a gap big enough at the beginning
-                            start_date = today
-                            found_gap = True
-                            break
-                
-                # Check gap between this subscription and the next
-                if i < len(active_subs) - 1:
-                    next_sub = active_subs[i + 1]
-                    potential_start = sub.end_date + timedelta(days=1)
-                    gap_size = (next_sub.start_date - potential_start).days
-                    
-                    if gap_size >= duration_days:
-                        # Found a gap big enough between subscriptions
-                        start_date = potential_start
-                        found_gap = True
-                        break
-            
-            if not found_gap:
-                # No gap found, stack after the last active subscription
-                last_sub = active_subs.last()
-                start_date = last_sub.end_date + timedelta(days=1)
-        # else: start_date remains today (no active subscriptions)
+        # Stack after (or into a gap between) the member's ACTIVE subscriptions;
+        # cancelled ones are ignored completely
+        timeline = SubscriptionTimeline.for_member(request.user)
+        start_date = timeline.next_start_date(duration_days, today)
 
         # Check if this is a demo/test payment
         if request.POST.get('demo_payment') == 'true':
@@ -211,24 +284,17 @@ def purchase_membership(request, plan_id):
             'transaction_uuid': str(transaction_uuid),
             'amount': float(plan.price)
         }
-
-        paymentEsewa = EsewaPayment(
-            product_code="EPAYTEST",
-            success_url=f"http://localhost:8000/success/{transaction_uuid}/",
-            failure_url=f"http://localhost:8000/failure/{transaction_uuid}/",
-            amount=float(plan.price),
-            tax_amount=0,
-            total_amount=float(plan.price),
-            product_service_charge=0,
-            product_delivery_charge=0,
-            transaction_uuid=str(transaction_uuid),
-        )
-        
-        signature = paymentEsewa.create_signature()
+        payments.start_membership(request.user, plan, start_date, uid=transaction_uuid)
 
         context = {
             'plan': plan,
-            'form': paymentEsewa.generate_form(),
+            'form': gateways.esewa.form(
+                transaction_uuid=transaction_uuid,
+                amount=float(plan.price),
+                success_url=request.build_absolute_uri(reverse('success', args=[transaction_uuid])),
+                failure_url=request.build_absolute_uri(reverse('failure', args=[transaction_uuid])),
+            ),
+            'esewa_form_url': gateways.esewa.form_url(),
             'khalti_amount': int(float(plan.price) * 100),
             'khalti_order_id': str(transaction_uuid),
             'khalti_order_name': plan.plan_name,
@@ -241,61 +307,42 @@ def purchase_membership(request, plan_id):
 
     return render(request, 'membership/purchase_membership.html', {'plan': plan})
 
-def success(request, uid):    
-    # Get pending subscription data from session
-    pending_data = request.session.get('pending_subscription')
-    if not pending_data or pending_data.get('transaction_uuid') != str(uid):
+# The gateway return and initiate views below are async: while a provider
+# takes its time answering, the request waits as a coroutine instead of
+# holding a worker thread. Run under trainwise.asgi to get that; under WSGI
+# they still work, one request per thread as before. Rendering goes through
+# sync_to_async since templates follow relations lazily.
+#
+# Paying doesn't depend on the member coming back: a return view settles the
+# checkout through membership/payments.py, same as the webhook inbox, and if
+# a webhook got there first it only reads the result.
+
+async def success(request, uid):
+    intent = await payments.aget_intent(uid, await request.auser())
+    if intent is None or intent.kind != CheckoutIntent.MEMBERSHIP:
         messages.error(request, "Invalid or expired payment session.")
         return redirect('membership-plans')
-    
-    # Get plan
-    plan = get_object_or_404(MembershipPlan, id=pending_data['plan_id'])
-    start_date = datetime.fromisoformat(pending_data['start_date']).date()
-    
-    paymentEsewa = EsewaPayment(
-        product_code="EPAYTEST",
-        success_url=f"http://localhost:8000/success/{uid}/",
-        failure_url=f"http://localhost:8000/failure/{uid}/",
-        amount=float(pending_data['amount']),
-        tax_amount=0,
-        total_amount=float(pending_data['amount']),
-        product_service_charge=0,
-        product_delivery_charge=0,
-        transaction_uuid=str(uid),
-    )
-    signature = paymentEsewa.create_signature()
-    
-    if paymentEsewa.is_completed(dev=True):
-        # NOW create the subscription and payment records
-        subscription = MemberSubscription.objects.create(
-            member=request.user,
-            plan=plan,
-            start_date=start_date,
-            is_active=True
-        )
-        
-        payment = Payment.objects.create(
-            uid=uid,
-            member_subscription=subscription,
-            amount=pending_data['amount'],
-            tax_amount=0,
-            service_charge=0,
-            delivery_charge=0,
-            payment_method='Esewa',
-            payment_status='Completed'
-        )
-        
-        # Clear session data
-        del request.session['pending_subscription']
-        
-        context = {
-            'payment': payment,
-            'subscription': subscription,
-        }
-        messages.success(request, f"Payment completed: {payment.uid}")
-        return render(request, 'membership/payment_success.html', context)
-    
-    return redirect('failure', uid)
+
+    try:
+        intent = await payments.asettle(intent, 'esewa')
+    except gateways.GatewayError:
+        messages.error(request, "eSewa verification failed. Please try again.")
+        return redirect('failure', uid)
+
+    if intent.status != CheckoutIntent.COMPLETED:
+        return redirect('failure', uid)
+
+    # Clear session data
+    await request.session.apop('pending_subscription', None)
+
+    payment = await payments.areceipt(intent)
+    context = {
+        'payment': payment,
+        'subscription': payment.member_subscription,
+    }
+    messages.success(request, f"Payment completed: {payment.uid}")
+    return await sync_to_async(render)(request, 'membership/payment_success.html', context)
+
 
 def failure(request, uid):
     # Get pending subscription from session to show details
@@ -316,146 +363,72 @@ def failure(request, uid):
 
 @login_required
 @require_http_methods(["POST"])
-def khalti_initiate_membership(request):
+async def khalti_initiate_membership(request):
     return_url = request.POST.get('return_url')
     if not return_url:
         messages.error(request, "Missing Khalti return URL.")
         return redirect('membership-plans')
 
-    base_url = (
-        "https://khalti.com/api/v2/"
-        if getattr(settings, 'KHALTI_ENV', 'sandbox') == 'production'
-        else "https://dev.khalti.com/api/v2/"
-    )
-    url = f"{base_url}epayment/initiate/"
     website_url = request.POST.get('website_url') or request.build_absolute_uri('/')
-    amount = request.POST.get('amount')
-    purchase_order_id = request.POST.get('purchase_order_id')
     purchase_order_name = request.POST.get('purchase_order_name') or 'Membership'
 
-    if not getattr(settings, 'KHALTI_SECRET_KEY', ''):
+    if not gateways.khalti.configured:
         messages.error(request, "Khalti secret key is not configured.")
         return redirect('membership-plans')
 
-    try:
-        amount_value = int(amount)
-    except (TypeError, ValueError):
-        messages.error(request, "Invalid Khalti amount.")
+    # The amount comes from the checkout, not from the posted form
+    user = await request.auser()
+    intent = await payments.aget_intent(request.POST.get('purchase_order_id'), user)
+    if intent is None or intent.status != CheckoutIntent.PENDING:
+        messages.error(request, "Invalid or expired payment session.")
         return redirect('membership-plans')
 
-    payload = json.dumps({
-        "return_url": return_url,
-        "website_url": website_url,
-        "amount": amount_value,
-        "purchase_order_id": purchase_order_id,
-        "purchase_order_name": purchase_order_name,
-        "customer_info": {
-        "name": request.user.get_full_name() or request.user.username,
-        "email": request.user.email or "",
-        "phone": getattr(request.user, 'phone', '') or ""
-        }
-    })
-
-    headers = {
-        'Authorization': f"Key {settings.KHALTI_SECRET_KEY}",
-        'Content-Type': 'application/json',
-    }
-
-    response = requests.request("POST", url, headers=headers, data=payload)
-    if response.status_code != 200:
+    try:
+        pidx, payment_url = await gateways.khalti.ainitiate(
+            return_url=return_url,
+            website_url=website_url,
+            amount=int(intent.amount * 100),
+            purchase_order_id=str(intent.uid),
+            purchase_order_name=purchase_order_name,
+            customer=user,
+        )
+    except gateways.GatewayError:
         messages.error(request, "Khalti initiate failed. Please try again.")
         return redirect('membership-plans')
 
-    new_res = json.loads(response.text)
-    payment_url = new_res.get('payment_url')
-    if not payment_url:
-        messages.error(request, "Khalti response missing payment URL.")
-        return redirect('membership-plans')
-
+    await payments.achoose_provider(intent, 'khalti', pidx)
     return redirect(payment_url)
 
 
 @login_required
 @require_http_methods(["GET"])
-def khalti_return_membership(request, uid):
-    pending_data = request.session.get('pending_subscription')
-    if not pending_data or pending_data.get('transaction_uuid') != str(uid):
+async def khalti_return_membership(request, uid):
+    intent = await payments.aget_intent(uid, await request.auser())
+    if intent is None or intent.kind != CheckoutIntent.MEMBERSHIP:
         messages.error(request, "Invalid or expired payment session.")
         return redirect('membership-plans')
 
-    pidx = request.GET.get('pidx')
-    if not pidx:
-        messages.error(request, "Missing Khalti payment reference. Please try again.")
-        return redirect('failure', uid)
-
-    url = "https://a.khalti.com/api/v2/epayment/lookup/"
-    headers = {
-        'Authorization': f"Key {settings.KHALTI_SECRET_KEY}",
-        'Content-Type': 'application/json',
-    }
-    data = json.dumps({'pidx': pidx})
-
+    # Khalti sends back the pidx that was paid, which needn't be the latest one started
     try:
-        res = requests.request('POST', url, headers=headers, data=data, timeout=15)
-    except requests.RequestException:
+        intent = await payments.asettle(intent, 'khalti', request.GET.get('pidx'))
+    except gateways.GatewayError:
         messages.error(request, "Khalti verification failed. Please try again.")
         return redirect('failure', uid)
 
-    if res.status_code != 200:
-        messages.error(request, "Khalti verification failed. Please try again.")
-        return redirect('failure', uid)
-
-    try:
-        new_res = res.json()
-    except ValueError:
-        messages.error(request, "Khalti verification failed. Please try again.")
-        return redirect('failure', uid)
-
-    status = (new_res.get('status') or '').lower()
-    if status != 'completed':
-        messages.error(request, "Khalti payment verification failed. Please try again.")
-        return redirect('failure', uid)
-
-    expected_amount = int(float(pending_data['amount']) * 100)
-    if 'total_amount' in new_res and int(new_res.get('total_amount') or 0) != expected_amount:
-        messages.error(request, "Khalti payment amount mismatch. Please contact support.")
-        return redirect('failure', uid)
-
-    if 'purchase_order_id' in new_res and str(new_res.get('purchase_order_id')) != str(uid):
-        messages.error(request, "Khalti payment reference mismatch. Please contact support.")
+    if intent.status != CheckoutIntent.COMPLETED:
+        messages.error(request, intent.failure_reason or "Khalti payment verification failed. Please try again.")
         return redirect('failure', uid)
 
-    plan = get_object_or_404(MembershipPlan, id=pending_data['plan_id'])
-    start_date = datetime.fromisoformat(pending_data['start_date']).date()
-
-    subscription = MemberSubscription.objects.create(
-        member=request.user,
-        plan=plan,
-        start_date=start_date,
-        is_active=True
-    )
-    payment = Payment.objects.create(
-        uid=uid,
-        member_subscription=subscription,
-        amount=pending_data['amount'],
-        tax_amount=0,
-        service_charge=0,
-        delivery_charge=0,
-        payment_method='Khalti',
-        payment_status='Completed'
-    )
-    del request.session['pending_subscription']
+    await request.session.apop('pending_subscription', None)
 
+    payment = await payments.areceipt(intent)
     context = {
         'payment': payment,
-        'subscription': subscription,
+        'subscription': payment.member_subscription,
     }
     messages.success(request, f"Payment completed: {payment.uid}")
-    return render(request, 'membership/payment_success.html', context)
-    
-
+    return await sync_to_async(render)(request, 'membership/payment_success.html', context)
 
-    
 
 @login_required
 def my_memberships(request):
@@ -467,14 +440,13 @@ def my_memberships(request):
     today = date.today()
 
     # Fetch all subscriptions for the user, ordered by start date
-    subscriptions = MemberSubscription.objects.filter(member=request.user).order_by('start_date')
+    subscriptions = list(
+        MemberSubscription.objects.filter(member=request.user).select_related('plan').order_by('start_date')
+    )
 
     # Find active subscription that has STARTED (not future subscriptions)
-    latest_active = subscriptions.filter(
-        is_active=True,
-        start_date__lte=today,  # Must have started already
-        end_date__gte=today     # Not expired yet
-    ).order_by('-end_date').first()
+    timeline = SubscriptionTimeline([sub for sub in subscriptions if sub.is_active])
+    latest_active = timeline.current(today)
 
     if latest_active:
         days_left = (latest_active.end_date - today).days
@@ -485,6 +457,7 @@ def my_memberships(request):
         'subscriptions': subscriptions,
         'days_left': days_left,
         'today': today,
+        'checkin_token': checkins.member_token(request.user),
     }
 
     return render(request, 'user/my_membership.html', context)
@@ -513,6 +486,8 @@ def cancel_membership(request, subscription_id):
             payment_status='Pending'
         )
         pending_payments.update(payment_status='Cancelled')
+        # Bulk update skips post_save, so drop the cached admin KPIs here
+        invalidate_admin_kpis()
         
         messages.success(
             request,
@@ -534,18 +509,16 @@ def my_payments(request):
     - Includes filters and total amounts per status
     """
     # Fetch all payments related to this user
-    payments = Payment.objects.filter(
-        member_subscription__member=request.user
-    ) | Payment.objects.filter(
-        private_class__member=request.user
-    )
-    payments = payments.order_by('-payment_date')  # latest first
+    payments = Payment.objects.filter(payer=request.user).select_related(
+        'member_subscription__member', 'private_class__member'
+    ).order_by('-payment_date')  # latest first
 
     # Calculate total amounts by status
-    total_payments = payments.aggregate(total=Sum('amount'))['total'] or 0
-    paid_amount = payments.filter(payment_status='Completed').aggregate(total=Sum('amount'))['total'] or 0
-    pending_amount = payments.filter(payment_status='Pending').aggregate(total=Sum('amount'))['total'] or 0
-    cancelled_amount = payments.filter(payment_status='Cancelled').aggregate(total=Sum('amount'))['total'] or 0
+    totals = payments.status_totals()
+    total_payments = totals['total']
+    paid_amount = totals['Completed']
+    pending_amount = totals['Pending']
+    cancelled_amount = totals['Cancelled']
 
     context = {
         'payments': payments,
@@ -561,160 +534,185 @@ def my_payments(request):
 
 
 # DODO Payment
-client = DodoPayments(
-    bearer_token=os.environ.get("DODO_PAYMENTS_API_KEY"),
-    environment="test_mode"
-)
-
-
 @login_required
 @csrf_exempt
 @require_http_methods(["POST"])
-def dodo_payment_checkout(request):
+async def dodo_payment_checkout(request):
     plan_id = request.POST.get('plan_id')
-    plan = get_object_or_404(MembershipPlan, id=plan_id)
+    plan = await aget_object_or_404(MembershipPlan, id=plan_id)
+    user = await request.auser()
     today = date.today()
 
     if not plan.dodo_product_id:
         return JsonResponse({'error': 'Dodo product ID is not configured for this plan.'}, status=400)
 
-    session = client.checkout_sessions.create(
-        product_cart=[{
-            "product_id": plan.dodo_product_id,
-            "quantity": 1,
-        }],
-        return_url=request.build_absolute_uri(f'/dodo/return/{request.user.id}/')
-    )
-
-    start_date = today
     duration_days = 30 * plan.duration_months
-        
-    # ONLY look at active subscriptions - cancelled ones should be ignored completely
-    active_subs = MemberSubscription.objects.filter(
-        member=request.user,
-        is_active=True
-    ).order_by('start_date')
-    
-    if active_subs.exists():
-        found_gap = False
-        
-        for i, sub in enumerate(active_subs):
-            if i == 0:
-                # Check gap before first active subscription
-                if sub.start_date > today:
-                    gap_size = (sub.start_date - today).days
-                    if gap_size >= duration_days:
-                        # Found a gap big enough at the beginning
-                        start_date = today
-                        found_gap = True
-                        break
-            
-            # Check gap between this subscription and the next
-            if i < len(active_subs) - 1:
-                next_sub = active_subs[i + 1]
-                potential_start = sub.end_date + timedelta(days=1)
-                gap_size = (next_sub.start_date - potential_start).days
-                
-                if gap_size >= duration_days:
-                    # Found a gap big enough between subscriptions
-                    start_date = potential_start
-                    found_gap = True
-                    break
-        
-        if not found_gap:
-            # No gap found, stack after the last active subscription
-            last_sub = active_subs.last()
-            start_date = last_sub.end_date + timedelta(days=1)
-    
-    request.session['pending_subscription'] = {
+
+    # Stack after (or into a gap between) the member's ACTIVE subscriptions;
+    # cancelled ones are ignored completely
+    timeline = await sync_to_async(SubscriptionTimeline.for_member)(user)
+    start_date = timeline.next_start_date(duration_days, today)
+    intent = await sync_to_async(payments.start_membership)(user, plan, start_date)
+
+    try:
+        session_id, checkout_url = await gateways.dodo.acreate_checkout(
+            product_id=plan.dodo_product_id,
+            return_url=request.build_absolute_uri(reverse('dodo-payment-return', args=[user.id])),
+            # Comes back in Dodo's webhooks, to find this checkout by
+            metadata={'checkout_uid': str(intent.uid)},
+        )
+    except gateways.GatewayError:
+        return JsonResponse({'error': 'Could not start a Dodo checkout. Please try again.'}, status=502)
+    await payments.achoose_provider(intent, 'dodo', session_id)
+
+    await request.session.aset('pending_subscription', {
         'plan_id': plan_id,
         'start_date': start_date.isoformat(),
-        'transaction_uuid': str(session.session_id),
+        'transaction_uuid': str(intent.uid),
         'amount': float(plan.price)
-    }
+    })
 
-    return redirect(session.checkout_url)
+    return redirect(checkout_url)
 
 
-def dodo_payment_return(request, user_id):
-    pending = request.session.get('pending_subscription')
+async def dodo_payment_return(request, user_id):
+    pending = await request.session.aget('pending_subscription')
     if not pending:
         messages.error(request, "No pending payment session found.")
         return redirect('membership-plans')
-    
-    if str(user_id) != str(request.user.id):
+
+    failure_url = f"{reverse('failure', args=[pending.get('transaction_uuid')])}?provider=dodo"
+    user = await request.auser()
+    if str(user_id) != str(user.id):
         messages.error(request, "Invalid payment session.")
-        return redirect(f"{reverse('failure', args=[pending.get('transaction_uuid')])}?provider=dodo")
-    
-    session_id = pending.get('transaction_uuid') 
-    if not session_id:
+        return redirect(failure_url)
+
+    intent = await payments.aget_intent(pending.get('transaction_uuid'), user)
+    if intent is None or intent.provider != 'dodo':
         messages.error(request, "Invalid payment session.")
-        return redirect(f"{reverse('failure', args=[pending.get('transaction_uuid')])}?provider=dodo")
-    
+        return redirect(failure_url)
+
+    # Only Dodo's answer counts; the ?status= on the return URL is the browser's word
     try:
-        session = client.checkout_sessions.retrieve(session_id)
-    except Exception as e:
+        intent = await payments.asettle(intent)
+    except gateways.GatewayError:
         messages.error(request, "Failed to verify payment with Dodo. Please contact support.")
-        return redirect(f"{reverse('failure', args=[pending.get('transaction_uuid')])}?provider=dodo")
-    
-    status = None
-    query_status = request.GET.get('status', '')
-    if hasattr(session, 'status'):
-        status = session.status
-    elif isinstance(session, dict):
-        status = session.get('status')
-    else:
-        status = session
+        return redirect(failure_url)
 
-    if hasattr(status, 'value'):
-        status_value = str(status.value)
-    else:
-        status_value = str(status) if status is not None else ''
+    if intent.status != CheckoutIntent.COMPLETED:
+        messages.error(request, "Payment not completed. Please try again.")
+        return redirect(failure_url)
 
-    if not status_value:
-        status_value = query_status
+    # Clear the pending session from session data
+    await request.session.apop('pending_subscription', None)
 
-    if query_status.lower() == 'succeeded':
-        status_value = 'succeeded'
+    payment = await payments.areceipt(intent)
+    subscription = payment.member_subscription
+    context = {
+        'payment': payment,
+        'subscription': subscription,
+    }
+    messages.success(request, f"Your subscription for '{subscription.plan.plan_name}' has been successfully activated.")
+    return await sync_to_async(render)(request, 'membership/payment_success.html', context)
 
-    if 'succeeded' not in status_value.lower():
-        messages.error(request, "Payment not completed. Please try again.")
-        return redirect(f"{reverse('failure', args=[pending.get('transaction_uuid')])}?provider=dodo")
+
+# ===============================
+# Payment webhooks
+# ===============================
+def _webhook(request, verify, ingest):
+    if not verify(request.headers, request.body):
+        return JsonResponse({'error': 'Invalid signature.'}, status=401)
+    try:
+        ingest(request.headers, request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid payload.'}, status=400)
+    # Repeats get a 200 as well, or the gateway keeps redelivering
+    return JsonResponse({'received': True})
 
 
-     # If payment is completed, create the subscription
-    plan = get_object_or_404(MembershipPlan, id=pending.get('plan_id'))
-    start_date_value = pending.get('start_date')
+@csrf_exempt
+@require_http_methods(["POST"])
+def khalti_webhook(request):
+    """Khalti payment notification: verified and queued for process_payment_inbox"""
+    return _webhook(request, payments.verify_khalti_signature, payments.ingest_khalti)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def dodo_webhook(request):
+    """Dodo webhook (Standard Webhooks signature): verified and queued for process_payment_inbox"""
+    return _webhook(request, payments.verify_dodo_signature, payments.ingest_dodo)
+
+
+# ===============================
+# Door Check-ins
+# ===============================
+@login_required
+@admin_required
+def checkin_desk(request):
+    """Front desk page: scan member QR codes"""
+    return render(request, 'admin/checkin_desk.html', {'occupancy': occupancy.current_count()})
+
+
+@login_required
+@admin_required
+@require_http_methods(["POST"])
+def checkin_scan(request):
+    """Check one scanned code; answered from the in-memory membership index"""
     try:
-        start_date = datetime.fromisoformat(start_date_value).date()
-    except (TypeError, ValueError):
-        start_date = date.today()
+        token = json.loads(request.body or b'{}').get('token', '')
+    except (ValueError, AttributeError):
+        return JsonResponse({'allowed': False, 'reason': 'Invalid JSON body.'}, status=400)
 
-    subscription = MemberSubscription.objects.create(
-        member=request.user,
-        plan=plan,
-        start_date=start_date,
-        is_active=True
-    )
-    
-    # Update payment status to Completed
-    payment = Payment.objects.create(
-            member_subscription=subscription,
-            amount=pending.get('amount'),
-            tax_amount=0,
-            service_charge=0,
-            delivery_charge=0,
-            payment_method='Online Payment (Dodo)',
-            payment_status='Completed'
-        )
+    result = checkins.scan(token, scanned_by=request.user)
+    return JsonResponse(result, status=200 if 'member' in result else 400)
 
-    # Clear the pending session from session data
-    if 'pending_subscription' in request.session:
-        del request.session['pending_subscription']
 
-    context = {
-        'payment': payment,
-        'subscription': subscription,
-    }
-    messages.success(request, f"Your subscription for '{plan.plan_name}' has been successfully activated.")
-    return render(request, 'membership/payment_success.html', context)
\ No newline at end of file
+# ===============================
+# Live Occupancy
+# ===============================
+def _occupancy_kind(value):
+    return value if value in (OccupancyEvent.ENTRY, OccupancyEvent.EXIT) else None
+
+
+@login_required
+@require_http_methods(["POST"])
+def occupancy_event(request):
+    """Front desk: record one entry or exit"""
+    if not is_staff_member(request.user):
+        return JsonResponse({'error': 'Not allowed.'}, status=403)
+    kind = _occupancy_kind(request.POST.get('kind'))
+    if kind is None:
+        return JsonResponse({'error': "kind must be 'in' or 'out'."}, status=400)
+    count = occupancy.record(kind, recorded_by=request.user)
+    return JsonResponse({'count': count})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def occupancy_device_event(request):
+    """Door device: record an entry or exit, authenticated with OCCUPANCY_DEVICE_TOKEN"""
+    expected = getattr(settings, 'OCCUPANCY_DEVICE_TOKEN', '')
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not expected or not hmac.compare_digest(supplied, expected):
+        return JsonResponse({'error': 'Invalid device token.'}, status=403)
+    try:
+        kind = _occupancy_kind(json.loads(request.body or b'{}').get('kind'))
+    except (ValueError, AttributeError):
+        kind = None
+    if kind is None:
+        return JsonResponse({'error': "kind must be 'in' or 'out'."}, status=400)
+    count = occupancy.record(kind, source=OccupancyEvent.SOURCE_DEVICE)
+    return JsonResponse({'count': count})
+
+
+async def occupancy_stream(request):
+    """Server-Sent Events stream of the headcount; async so open dashboards don't hold a thread"""
+    user = await request.auser()
+    if not is_staff_member(user):
+        return JsonResponse({'error': 'Not allowed.'}, status=403)
+    response = StreamingHttpResponse(occupancy.stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
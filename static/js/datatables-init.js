@@ -41,6 +41,73 @@ const populateFilterOptions = (select, dataTable) => {
     });
 };
 
+const getFilterSelects = (table) => {
+  const tableId = table.getAttribute('id');
+  if (!tableId) {
+    return [];
+  }
+
+  return Array.from(document.querySelectorAll(`[data-dt-target="${tableId}"] [data-dt-filter]`));
+};
+
+// Server-side processing: the endpoint in data-dt-source returns one page at a
+// time. When the user moves to the next page with the same ordering, search
+// and filters, the cursor from the previous response is sent back so the
+// server can continue from the last row instead of using an offset.
+const serverSideAjax = (table) => {
+  const source = table.dataset.dtSource;
+  let previous = null;
+
+  return (data, callback) => {
+    const params = new URLSearchParams(window.location.search);
+    params.set('draw', data.draw);
+    params.set('start', data.start);
+    params.set('length', data.length);
+    params.set('search[value]', data.search.value || '');
+
+    if (data.order && data.order.length) {
+      params.set('order[0][column]', data.order[0].column);
+      params.set('order[0][dir]', data.order[0].dir);
+    }
+
+    getFilterSelects(table).forEach((select) => {
+      if (select.name) {
+        params.set(select.name, select.value);
+      }
+    });
+
+    params.delete('cursor');
+    const signature = [...params.entries()]
+      .filter(([key]) => !['draw', 'start'].includes(key))
+      .map(([key, value]) => `${key}=${value}`)
+      .join('&');
+
+    if (previous && previous.cursor && previous.signature === signature
+        && data.start === previous.start + previous.length) {
+      params.set('cursor', previous.cursor);
+    }
+
+    fetch(`${source}?${params.toString()}`, {
+      headers: { 'X-Requested-With': 'XMLHttpRequest' },
+      credentials: 'same-origin'
+    })
+      .then((response) => response.json())
+      .then((json) => {
+        previous = {
+          signature,
+          start: data.start,
+          length: data.length,
+          cursor: json.cursor
+        };
+        callback(json);
+      })
+      .catch(() => {
+        previous = null;
+        callback({ draw: data.draw, recordsTotal: 0, recordsFiltered: 0, data: [] });
+      });
+  };
+};
+
 const bindTableFilters = (table, dataTable) => {
   const tableId = table.getAttribute('id');
   if (!tableId) {
@@ -55,12 +122,42 @@ const bindTableFilters = (table, dataTable) => {
   filterGroups.forEach((group) => {
     const selects = group.querySelectorAll('[data-dt-filter]');
 
+    // Export links download what the table currently shows: same filters and search
+    group.querySelectorAll('[data-dt-export]').forEach((link) => {
+      const base = link.getAttribute('href').split('?')[0];
+      link.addEventListener('click', () => {
+        const params = new URLSearchParams();
+        getFilterSelects(table).forEach((select) => {
+          if (select.name && select.value) {
+            params.set(select.name, select.value);
+          }
+        });
+        const search = dataTable.search();
+        if (search) {
+          params.set('search[value]', search);
+        }
+        const query = params.toString();
+        link.setAttribute('href', query ? `${base}?${query}` : base);
+      });
+    });
+
     selects.forEach((select) => {
       if (select.dataset.dtAutofill === 'true') {
         populateFilterOptions(select, dataTable);
       }
 
       select.addEventListener('change', () => {
+        // Filter forms whose totals are rendered server-side reload the page
+        if (group.hasAttribute('data-dt-submit') && group.tagName === 'FORM') {
+          group.submit();
+          return;
+        }
+
+        if (table.dataset.dtSource) {
+          dataTable.draw();
+          return;
+        }
+
         const columnIndex = parseInt(select.dataset.dtColumn || '', 10);
         if (Number.isNaN(columnIndex)) {
           return;
@@ -112,8 +209,27 @@ document.addEventListener('DOMContentLoaded', () => {
     const paging = table.dataset.dtPaging !== 'false';
     const lengthChange = table.dataset.dtLength !== 'false';
     const searching = table.dataset.dtSearch !== 'false';
+    const serverSide = Boolean(table.dataset.dtSource);
+
+    const unorderableTargets = [];
+    headerCells.forEach((cell, index) => {
+      if (cell.dataset.dtOrderable === 'false') {
+        unorderableTargets.push(index);
+      }
+    });
+
+    const serverOptions = serverSide
+      ? {
+        serverSide: true,
+        processing: true,
+        searchDelay: 400,
+        order: [],
+        ajax: serverSideAjax(table)
+      }
+      : {};
 
     const dataTable = jQuery(table).DataTable({
+      ...serverOptions,
       pageLength: 10,
       lengthMenu: [5, 10, 25, 50],
       paging,
@@ -129,7 +245,8 @@ document.addEventListener('DOMContentLoaded', () => {
       autoWidth: false,
       columnDefs: [
         { targets: visibleTargets, className: 'all' },
-        { targets: hiddenTargets, className: 'none' }
+        { targets: hiddenTargets, className: 'none' },
+        { targets: unorderableTargets, orderable: false }
       ],
       language: {
         search: 'Search:',
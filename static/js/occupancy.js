@@ -0,0 +1,37 @@
+// Live gym headcount: any element with data-occupancy-stream subscribes to
+// the Server-Sent Events stream and updates its [data-occupancy-count] child.
+// EventSource reconnects on its own if the connection drops.
+document.addEventListener('DOMContentLoaded', () => {
+    if (!window.EventSource) {
+        return;
+    }
+
+    document.querySelectorAll('[data-occupancy-stream]').forEach((widget) => {
+        const value = widget.querySelector('[data-occupancy-count]');
+        const source = new EventSource(widget.dataset.occupancyStream);
+
+        source.addEventListener('occupancy', (event) => {
+            const data = JSON.parse(event.data);
+            value.textContent = data.count;
+            widget.classList.remove('is-offline');
+        });
+
+        source.addEventListener('error', () => {
+            widget.classList.add('is-offline');
+        });
+    });
+
+    // Entry / exit buttons (front desk)
+    document.querySelectorAll('[data-occupancy-kind]').forEach((button) => {
+        button.addEventListener('click', () => {
+            const body = new FormData();
+            body.append('kind', button.dataset.occupancyKind);
+            fetch(button.dataset.occupancyUrl, {
+                method: 'POST',
+                credentials: 'same-origin',
+                headers: { 'X-CSRFToken': getCookie('csrftoken') },
+                body
+            });
+        });
+    });
+});
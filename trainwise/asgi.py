@@ -3,6 +3,10 @@ ASGI config for trainwise project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn trainwise.asgi:application``) for
+the async payment views and the occupancy stream: requests waiting on a
+payment gateway then cost a coroutine rather than a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -14,3 +18,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trainwise.settings')
 
 application = get_asgi_application()
+
+# The server's event loop outlives requests, so gateway clients can stay open on it
+from membership import gateways  # noqa: E402
+
+gateways.keep_async_clients_open()
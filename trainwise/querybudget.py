@@ -0,0 +1,292 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db import connections
+
+# Per-request query and latency budgets.
+#
+# Every database connection gets an execute wrapper (installed when the
+# connection is created) that reports each query to whichever QueryStats are
+# active in the current context. QueryBudgetMiddleware activates one per
+# request, logs a warning on the 'trainwise.querybudget' logger when the
+# request goes over its budget, and adds a Server-Timing header in DEBUG.
+# A streaming response runs its queries while the body is sent, so its
+# budget is checked after the last chunk instead.
+# assert_query_budget() activates one around a block of test code.
+#
+# Queries are fingerprinted by their SQL with parameters left out and IN
+# lists collapsed, so the same query run once per row of a list shows up as
+# one fingerprint with a high count: the usual N+1 pattern.
+#
+# Settings (QUERY_BUDGET):
+#     ENABLED               turn the middleware on (default: DEBUG)
+#     MAX_QUERIES           queries per request
+#     MAX_SQL_MS            total time spent in SQL per request
+#     MAX_TOTAL_MS          wall time per request
+#     DUPLICATE_THRESHOLD   same fingerprint this many times = likely N+1
+#     VIEWS                 {url name: {...}} per-view overrides of the above
+
+logger = logging.getLogger('trainwise.querybudget')
+
+DEFAULT_BUDGET = {
+    'ENABLED': False,
+    'MAX_QUERIES': 50,
+    'MAX_SQL_MS': 250,
+    'MAX_TOTAL_MS': 1000,
+    'DUPLICATE_THRESHOLD': 5,
+    'VIEWS': {},
+}
+
+_active = ContextVar('query_budget_active', default=())
+_IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    return _WHITESPACE.sub(' ', _IN_LIST.sub('IN (...)', sql)).strip()
+
+
+class QueryStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.fingerprints = Counter()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        self.fingerprints[fingerprint(sql)] += 1
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def total_time(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def duplicates(self, threshold):
+        """(fingerprint, count) pairs run at least `threshold` times, most repeated first"""
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+    def violations(self, budget):
+        problems = []
+        if self.queries > budget['MAX_QUERIES']:
+            problems.append(f"{self.queries} queries (budget {budget['MAX_QUERIES']})")
+        if self.sql_time * 1000 > budget['MAX_SQL_MS']:
+            problems.append(f"{self.sql_time * 1000:.0f} ms in SQL (budget {budget['MAX_SQL_MS']} ms)")
+        if self.total_time * 1000 > budget['MAX_TOTAL_MS']:
+            problems.append(f"{self.total_time * 1000:.0f} ms total (budget {budget['MAX_TOTAL_MS']} ms)")
+        for sql, count in self.duplicates(budget['DUPLICATE_THRESHOLD']):
+            problems.append(f"possible N+1: {count}x {sql[:200]}")
+        return problems
+
+    def summary(self):
+        return (
+            f"{self.queries} queries, {self.sql_time * 1000:.1f} ms SQL, "
+            f"{self.render_time * 1000:.1f} ms render, {self.total_time * 1000:.1f} ms total"
+        )
+
+
+@contextmanager
+def recording(stats):
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+        stats.finish()
+
+
+# -------------------------
+# Instrumentation
+# -------------------------
+def _record_query(execute, sql, params, many, context):
+    active = _active.get()
+    if not active:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        for stats in active:
+            stats.record(sql, duration)
+
+
+def _install_wrapper(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        active = _active.get()
+        if not active:
+            return render(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            for stats in active:
+                stats.render_time += duration
+    wrapper.__wrapped__ = render
+    return wrapper
+
+
+_installed = False
+
+
+def install():
+    """Hook query recording into every connection and time template rendering"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(_install_wrapper, dispatch_uid='trainwise.querybudget')
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+
+    # Template rendering has no hook, so wrap the Django backend's render()
+    from django.template.backends.django import Template
+    Template.render = _timed_render(Template.render)
+
+
+# -------------------------
+# Budgets
+# -------------------------
+def get_budget(view_name=None):
+    configured = getattr(settings, 'QUERY_BUDGET', {})
+    budget = {**DEFAULT_BUDGET, 'ENABLED': settings.DEBUG, **configured}
+    overrides = budget['VIEWS'].get(view_name, {}) if view_name else {}
+    return {**budget, **overrides}
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else None
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = get_budget()['ENABLED']
+        if self.enabled:
+            install()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        with recording(QueryStats()) as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        with recording(QueryStats()) as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        if response.streaming:
+            # Keep recording while the body is iterated; the clock keeps running too
+            stats.finished = None
+            stream = self._astream if response.is_async else self._stream
+            response.streaming_content = stream(request, response.streaming_content, stats)
+            return response
+        self.report(request, stats)
+        if settings.DEBUG:
+            response['Server-Timing'] = (
+                f'sql;dur={stats.sql_time * 1000:.1f};desc="{stats.queries} queries", '
+                f'render;dur={stats.render_time * 1000:.1f}, '
+                f'total;dur={stats.total_time * 1000:.1f}'
+            )
+        return response
+
+    def report(self, request, stats):
+        view_name = _view_name(request)
+        problems = stats.violations(get_budget(view_name))
+        if problems:
+            logger.warning(
+                "%s %s (%s) over budget: %s; %s",
+                request.method, request.path, view_name or '-', stats.summary(), '; '.join(problems),
+            )
+
+    # Each chunk is produced with the stats active, in whatever context the
+    # server iterates the body in; a client that disconnects early is not reported
+    def _stream(self, request, content, stats):
+        chunks = iter(content)
+        while True:
+            token = _active.set(_active.get() + (stats,))
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                _active.reset(token)
+            yield chunk
+        stats.finish()
+        self.report(request, stats)
+
+    async def _astream(self, request, content, stats):
+        chunks = aiter(content)
+        while True:
+            token = _active.set(_active.get() + (stats,))
+            try:
+                chunk = await anext(chunks)
+            except StopAsyncIteration:
+                break
+            finally:
+                _active.reset(token)
+            yield chunk
+        stats.finish()
+        self.report(request, stats)
+
+
+# -------------------------
+# Test helper
+# -------------------------
+@contextmanager
+def assert_query_budget(max_queries=None, max_sql_ms=None, max_duplicates=None, view_name=None):
+    """
+    Fail if the block runs more queries, spends longer in SQL, or repeats a
+    query fingerprint more often than allowed. Unset limits come from the
+    QUERY_BUDGET settings for `view_name` (or the global ones).
+
+        with assert_query_budget(view_name='admin-payments'):
+            client.get(reverse('admin-payments'))
+    """
+    install()
+    budget = get_budget(view_name)
+    if max_queries is not None:
+        budget['MAX_QUERIES'] = max_queries
+    if max_sql_ms is not None:
+        budget['MAX_SQL_MS'] = max_sql_ms
+    if max_duplicates is not None:
+        budget['DUPLICATE_THRESHOLD'] = max_duplicates + 1
+    # Wall time depends on the test machine; only the middleware enforces it
+    budget['MAX_TOTAL_MS'] = float('inf')
+
+    with recording(QueryStats()) as stats:
+        yield stats
+    problems = stats.violations(budget)
+    if problems:
+        raise AssertionError(f"Query budget exceeded ({stats.summary()}):\n  " + '\n  '.join(problems))
@@ -60,6 +60,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so session/auth queries count towards the request's budget
+    'trainwise.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,6 +98,24 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # checkouts finalizing (read, then write) wait their turn instead
+            # of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+
+# Cache
+# Admin KPIs and other derived numbers are cached here. Point this at a shared
+# backend (Redis/Memcached) when running more than one worker process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'trainwise',
     }
 }
 
@@ -137,10 +157,56 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
+# Generated files (PDF reports are written under MEDIA_ROOT/reports)
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Background PDF report generation
+REPORT_PDF_WORKERS = 2
+REPORT_PDF_KEEP = 10
+# Seconds before an unfinished PDF job is treated as failed
+REPORT_PDF_TIMEOUT = 300
+
+# Bulk weight log sync (entries accepted per request / rows per INSERT)
+WEIGHT_SYNC_MAX_ENTRIES = 1000
+WEIGHT_SYNC_BATCH_SIZE = 500
+
+# Door check-ins are buffered and written in batches of this size, or after
+# this many seconds, whichever comes first
+CHECKIN_BATCH_SIZE = 50
+CHECKIN_FLUSH_SECONDS = 2
+
+# Live occupancy: how often each worker re-reads the headcount for its open
+# dashboard streams, and the bearer token a door device uses to post events
+# (device posting is disabled while it's empty)
+OCCUPANCY_POLL_SECONDS = 1
+OCCUPANCY_DEVICE_TOKEN = os.getenv('OCCUPANCY_DEVICE_TOKEN', '')
+
+# Per-request query / latency budgets (trainwise/querybudget.py). Requests
+# over budget, and queries repeated DUPLICATE_THRESHOLD times (likely N+1),
+# are logged as warnings on the 'trainwise.querybudget' logger.
+QUERY_BUDGET = {
+    'ENABLED': DEBUG or os.getenv('QUERY_BUDGET_ENABLED') == '1',
+    'MAX_QUERIES': 30,
+    'MAX_SQL_MS': 200,
+    'MAX_TOTAL_MS': 1000,
+    'DUPLICATE_THRESHOLD': 5,
+    # Per-view overrides, keyed by URL name
+    'VIEWS': {
+        'admin-reports': {'MAX_QUERIES': 40},
+        'admin-payments-export': {'MAX_TOTAL_MS': 30000},
+        'admin-members-export': {'MAX_TOTAL_MS': 30000},
+        'admin-private-classes-export': {'MAX_TOTAL_MS': 30000},
+    },
+}
+
 AUTH_USER_MODEL = 'accounts.User'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Gym opening hours (24h clock), used when searching for free private class slots
+GYM_OPEN_HOUR = 6
+GYM_CLOSE_HOUR = 22
+
 # eSewa Configuration
 ESEWA_MERCHANT_CODE = 'EPAYTEST'  # Test merchant code
 ESEWA_SECRET_KEY = ''  # Leave empty for test
@@ -152,3 +218,39 @@ ESEWA_FAILURE_URL = 'esewa-failure'
 KHALTI_SECRET_KEY = os.getenv('KHALTI_SECRET_KEY', '')
 KHALTI_ENV = os.getenv('KHALTI_ENV', 'sandbox')  # 'sandbox' or 'production'
 KHALTI_WEBSITE_URL = os.getenv('KHALTI_WEBSITE_URL', 'http://localhost:8000/')
+
+# Payment gateway endpoints. Each can be overridden on its own, or set
+# PAYMENT_GATEWAY_URL to send every gateway to the local stand-in started
+# with `python manage.py fake_gateway` (e.g. http://127.0.0.1:8765).
+PAYMENT_GATEWAY_URL = os.getenv('PAYMENT_GATEWAY_URL', '').rstrip('/')
+KHALTI_API_URL = os.getenv('KHALTI_API_URL') or (
+    f'{PAYMENT_GATEWAY_URL}/khalti/api/v2/' if PAYMENT_GATEWAY_URL
+    else 'https://khalti.com/api/v2/' if KHALTI_ENV == 'production'
+    else 'https://dev.khalti.com/api/v2/'
+)
+ESEWA_FORM_URL = os.getenv('ESEWA_FORM_URL') or (
+    f'{PAYMENT_GATEWAY_URL}/esewa/api/epay/main/v2/form' if PAYMENT_GATEWAY_URL
+    else 'https://epay.esewa.com.np/api/epay/main/v2/form' if ESEWA_LIVE
+    else 'https://rc-epay.esewa.com.np/api/epay/main/v2/form'
+)
+ESEWA_STATUS_URL = os.getenv('ESEWA_STATUS_URL') or (
+    f'{PAYMENT_GATEWAY_URL}/esewa/api/epay/transaction/status/' if PAYMENT_GATEWAY_URL
+    else 'https://epay.esewa.com.np/api/epay/transaction/status/' if ESEWA_LIVE
+    else 'https://rc.esewa.com.np/api/epay/transaction/status/'
+)
+# None: the Dodo SDK's own test_mode endpoint
+DODO_PAYMENTS_BASE_URL = os.getenv('DODO_PAYMENTS_BASE_URL') or (
+    f'{PAYMENT_GATEWAY_URL}/dodo' if PAYMENT_GATEWAY_URL else None
+)
+
+# Outgoing gateway calls (membership/gateways.py): (connect, read) timeout in
+# seconds, and keep-alive connections kept open per gateway
+PAYMENT_GATEWAY_TIMEOUT = (3.05, 10)
+PAYMENT_GATEWAY_POOL_SIZE = 20
+
+# Payment webhooks (membership/payments.py). Notifications are only accepted
+# with a valid signature, so each endpoint is off while its secret is empty.
+# Dodo's is the whsec_... signing secret from its dashboard; Khalti
+# notifications are expected HMAC-SHA256 signed (hex) in X-Khalti-Signature.
+KHALTI_WEBHOOK_SECRET = os.getenv('KHALTI_WEBHOOK_SECRET', '')
+DODO_WEBHOOK_SECRET = os.getenv('DODO_WEBHOOK_SECRET', '')